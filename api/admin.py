@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Task
+from .models import NDVIObservation, Paddock
 
 # Register your models here.
-admin.site.register(Task)
\ No newline at end of file
+admin.site.register(Paddock)
+admin.site.register(NDVIObservation)
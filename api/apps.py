@@ -1,6 +1,15 @@
+import os
+
 from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Con EE_WARMUP=1 la sesión de Earth Engine se prepara al arrancar el proceso.
+        # Con gunicorn se hace en el hook post_fork (ver gunicorn.conf.py).
+        if os.environ.get('EE_WARMUP') == '1':
+            from .ee_session import warm_up_in_background
+            warm_up_in_background()
@@ -0,0 +1,491 @@
+import json
+import math
+import random
+import tempfile
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def increment(self):
+        with self._lock:
+            self.count += 1
+
+
+# --- Earth Engine ---
+
+def synthetic_ee_fixture(start=date(2024, 1, 1), days=366, every=5):
+    """Respuestas de ejemplo: una escena cada `every` días y un potrero casi todo Caldenal."""
+    rows = []
+    for offset in range(0, days, every):
+        day = start + timedelta(days=offset)
+        rows.append({
+            "fecha": day.isoformat(),
+            "NDVI": round(0.45 + 0.25 * math.sin(2 * math.pi * offset / 365), 4),
+            "q": 1.0,
+        })
+    return {"ndvi": rows, "histograma": {"b1": {"22.0": 870, "21.0": 130}}}
+
+
+def encode_expression(obj):
+    import ee
+
+    return ee.serializer.encode(obj, for_cloud_api=True)
+
+
+def classify_expression(obj):
+    """
+    Tipo de consulta de evaluate al que corresponde un objeto: 'ndvi', 'histograma' o ambos,
+    más 'lote' si es una consulta de varios polígonos (reduceRegions, ver get_batch_ndvi_and_regions).
+    """
+    expression = json.dumps(encode_expression(obj))
+    kinds = []
+    if 'normalizedDifference' in expression:
+        kinds.append('ndvi')
+    if 'frequencyHistogram' in expression:
+        kinds.append('histograma')
+    if '"Image.reduceRegions"' in expression:
+        kinds.append('lote')
+    return kinds
+
+
+def batch_feature_ids(obj):
+    """Los 'feature_id' de los polígonos de una consulta de varios polígonos, en orden."""
+    ids = []
+
+    def walk(value):
+        if isinstance(value, dict):
+            constant = value.get('constantValue')
+            if isinstance(constant, dict) and 'feature_id' in constant:
+                if constant['feature_id'] not in ids:
+                    ids.append(constant['feature_id'])
+                return
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(encode_expression(obj))
+    return ids
+
+
+class FakeEarthEngine:
+    """
+    Reemplaza ee.data.computeValue (lo que ejecuta cada getInfo) por respuestas grabadas.
+
+    El cliente de ee se inicializa sin red con la lista de algoritmos que trae el propio
+    paquete (ee.apitestcase), así que las consultas se arman igual que en producción.
+    `fixture` es { "ndvi": [filas de daily_ndvi], "histograma": {...} }, como lo graba
+    record_ee_fixture. En las consultas de varios polígonos todos reciben esas mismas respuestas.
+    Los map id de las capas (ee.data.getMapId) apuntan a TILE_URL, que no existe: las teselas
+    se descargan con tiles.get_session, que hay que reemplazar aparte.
+    """
+
+    TILE_URL = "https://earthengine.invalid/v1/projects/fake/maps/ndvi/tiles/{z}/{x}/{y}"
+
+    def __init__(self, fixture, latency=0.0, jitter=0.0):
+        self.fixture = fixture
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = CallCounter()
+
+    def compute_value(self, obj):
+        self.calls.increment()
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        kinds = classify_expression(obj)
+        if 'lote' in kinds:
+            return self.batch_value(obj, kinds)
+        if kinds == ['ndvi', 'histograma']:
+            return {"ndvi": self.fixture["ndvi"], "histograma": self.fixture["histograma"]}
+        if kinds == ['histograma']:
+            return self.fixture["histograma"]
+        return self.fixture["ndvi"]
+
+    def batch_value(self, obj, kinds):
+        """Respuesta de get_batch_ndvi_and_regions: filas [id, fecha, NDVI, q] y pares [id, histograma]."""
+        ids = batch_feature_ids(obj)
+        rows = [[feature_id, row["fecha"], row["NDVI"], row["q"]] for feature_id in ids for row in self.fixture["ndvi"]]
+        if 'histograma' not in kinds:
+            return rows
+        return {
+            "ndvi": rows,
+            "histogramas": [[feature_id, self.fixture["histograma"]["b1"]] for feature_id in ids],
+        }
+
+    def get_map_id(self, params):
+        import ee
+
+        self.calls.increment()
+        return {"mapid": "ndvi", "token": "", "tile_fetcher": ee.data.TileFetcher(self.TILE_URL, map_name="ndvi")}
+
+    @contextmanager
+    def installed(self):
+        import ee
+        from ee import apitestcase
+
+        from . import ee_session
+
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(ee.data, 'getAlgorithms', apitestcase.GetAlgorithms))
+            stack.enter_context(mock.patch.object(ee.data, '_install_cloud_api_resource', lambda: None))
+            stack.enter_context(mock.patch.object(ee.deprecation, '_FetchDataCatalogStac', lambda: {}))
+            stack.enter_context(mock.patch.object(ee.data, 'computeValue', self.compute_value))
+            stack.enter_context(mock.patch.object(ee.data, 'getMapId', self.get_map_id))
+            stack.enter_context(mock.patch.object(ee_session._session, 'ensure', lambda: ee))
+            ee.Reset()
+            ee.Initialize(None, '')
+            try:
+                yield self
+            finally:
+                ee.Reset()
+
+
+@contextmanager
+def record_ee_fixture(path):
+    """
+    Graba en `path` las respuestas reales de Earth Engine de las consultas que se hagan dentro
+    del bloque, con el formato que usa FakeEarthEngine.
+    """
+    import ee
+
+    original = ee.data.computeValue
+    fixture = {}
+
+    def recording(obj):
+        result = original(obj)
+        kinds = classify_expression(obj)
+        if 'lote' in kinds:
+            # FakeEarthEngine arma las respuestas de varios polígonos con las de uno solo
+            return result
+        if kinds == ['ndvi', 'histograma']:
+            fixture.setdefault("ndvi", result["ndvi"])
+            fixture.setdefault("histograma", result["histograma"])
+        elif kinds:
+            fixture.setdefault(kinds[0], result)
+        return result
+
+    with mock.patch.object(ee.data, 'computeValue', recording):
+        yield fixture
+    Path(path).write_text(json.dumps(fixture))
+
+
+# --- NASA POWER ---
+
+def synthetic_power_value(parameter, day):
+    """Valor diario de ejemplo con ciclo anual (hemisferio sur): °C para T2M y W/m² para la PAR."""
+    phase = math.cos(2 * math.pi * (day.timetuple().tm_yday - 15) / 365.25)
+    if parameter == "T2M":
+        return round(16 + 8 * phase, 2)
+    return round(85 + 45 * phase, 2)
+
+
+class FakePowerServer:
+    """
+    Servidor HTTP local con la misma interfaz que el endpoint diario de POWER.
+
+    Responde cualquier rango y parámetros pedidos. Con `fixture` (una respuesta grabada de
+    POWER) los valores se toman de ahí por mes y día; si no, son sintéticos.
+    """
+
+    def __init__(self, fixture=None, latency=0.0):
+        self.latency = latency
+        self.calls = CallCounter()
+        self.by_month_day = {}
+        if fixture:
+            for parameter, values in fixture.get("properties", {}).get("parameter", {}).items():
+                for key, value in values.items():
+                    self.by_month_day.setdefault(parameter, {})[key[4:]] = value
+        self._server = None
+
+    def value(self, parameter, day):
+        recorded = self.by_month_day.get(parameter)
+        if recorded:
+            return recorded.get(day.strftime("%m%d"), recorded.get("0228"))
+        return synthetic_power_value(parameter, day)
+
+    def response(self, query):
+        start = date(*map(int, (query["start"][:4], query["start"][4:6], query["start"][6:])))
+        end = date(*map(int, (query["end"][:4], query["end"][4:6], query["end"][6:])))
+        days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+        parameters = {
+            parameter: {day.strftime("%Y%m%d"): self.value(parameter, day) for day in days}
+            for parameter in query["parameters"].split(",")
+        }
+        return {"properties": {"parameter": parameters}}
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/temporal/daily/point"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.calls.increment()
+                if fake.latency:
+                    time.sleep(fake.latency)
+                query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                body = json.dumps(fake.response(query)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-power', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# --- Carga ---
+
+def sample_polygons(count, seed=0):
+    """Potreros rectangulares de 50 a 500 ha repartidos por la región pampeana."""
+    rng = random.Random(seed)
+    polygons = []
+    for _ in range(count):
+        longitud, latitud = rng.uniform(-64, -58), rng.uniform(-38, -32)
+        side = math.sqrt(rng.uniform(50, 500) * 10000)
+        dlat = side / 111320
+        dlon = side / (111320 * math.cos(math.radians(latitud)))
+        polygons.append([[
+            [longitud, latitud], [longitud + dlon, latitud], [longitud + dlon, latitud + dlat],
+            [longitud, latitud + dlat], [longitud, latitud],
+        ]])
+    return polygons
+
+
+def latency_summary(latencies):
+    values = np.asarray(latencies) * 1000
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "media_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+@contextmanager
+def offline_services(fake_ee, fake_power, directory):
+    """
+    Cachés y archivos de estado en `directory`, con los dobles de GEE y POWER instalados.
+    No toca la base de datos: sirve dentro de un TestCase (ver api/tests.py).
+    """
+    fake_power.start()
+    try:
+        with fake_services(fake_ee, fake_power.url, directory):
+            yield
+    finally:
+        fake_power.stop()
+
+
+@contextmanager
+def fake_services(fake_ee, power_url, directory):
+    """offline_services con un servidor de POWER ya levantado en `power_url`."""
+    from django.test.utils import override_settings
+
+    from . import ee_session, power_cache, power_client
+
+    directory = Path(directory)
+    caches = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'ndvi': {
+            'BACKEND': 'api.cache_backends.LRUFileBasedCache',
+            'LOCATION': directory / 'ndvi',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+        'teselas': {
+            'BACKEND': 'api.cache_backends.LRUFileBasedCache',
+            'LOCATION': directory / 'teselas',
+            'OPTIONS': {'MAX_ENTRIES': 100_000, 'MAX_SIZE': 64 * 1024 ** 2},
+        },
+    }
+    with override_settings(CACHES=caches, POWER_CACHE_PATH=directory / 'nasa_power.sqlite3',
+                           POWER_LIMITER_PATH=directory / 'nasa_power_limiter.sqlite3',
+                           VEGETATION_INDEX_DIR=directory / 'raster_uv',
+                           PAR_CLIMATOLOGY_DIR=directory / 'clima_par', METRICS_DIR=directory / 'metrics',
+                           EE_GOVERNOR_PATH=directory / 'ee_turnos.sqlite3',
+                           SINGLEFLIGHT_DIR=directory / 'en_curso', POWER_BASE_URL=power_url), \
+            mock.patch.object(power_cache, '_cache', None), \
+            mock.patch.object(ee_session, '_governor', None), \
+            mock.patch.object(power_client, '_limiter', None), \
+            fake_ee.installed():
+        yield
+
+
+_installed = None
+
+
+def install_fake_services(directory, power_url):
+    """
+    fake_services con los datos sintéticos de GEE, instalado hasta que termine el proceso y
+    sobre la base de prueba del proceso principal. Es el `worker_setup` de process_inventory en
+    las pruebas: cada proceso del pool arranca sin los dobles del proceso que lo creó, y usa el
+    servidor de POWER de ese proceso.
+    """
+    global _installed
+    from django.conf import settings
+
+    database = settings.DATABASES['default']
+    database['NAME'] = database['TEST']['NAME']
+    stack = ExitStack()
+    stack.enter_context(fake_services(FakeEarthEngine(synthetic_ee_fixture()), power_url, directory))
+    _installed = stack
+
+
+@contextmanager
+def isolated_environment(fake_ee, fake_power):
+    """
+    Base de datos de prueba y cachés en una carpeta temporal, con los dobles de GEE y POWER
+    instalados. Nada de lo que haga el banco de pruebas toca la base ni las cachés reales.
+    """
+    from django.db import connections
+    from django.test.utils import (
+        setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+    )
+
+    with tempfile.TemporaryDirectory(prefix='benchmark-ndvi-') as tmp:
+        connections['default'].settings_dict.setdefault('TEST', {})['NAME'] = str(Path(tmp) / 'db.sqlite3')
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with offline_services(fake_ee, fake_power, tmp):
+                yield
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+
+def run_load(polygons, requests, concurrency, start_date, end_date, path='/api/ndvi/'):
+    """
+    Envía `requests` pedidos a `path` desde `concurrency` hilos, rotando entre los polígonos.
+    Retorna (latencias en segundos de los pedidos exitosos, { código HTTP: cantidad }, segundos).
+    """
+    from django.db import connections
+    from django.test import Client
+
+    next_request = iter(range(requests))
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+
+    def worker():
+        client = Client(raise_request_exception=False)
+        try:
+            while True:
+                with lock:
+                    index = next(next_request, None)
+                if index is None:
+                    return
+                body = {
+                    "coordinates": polygons[index % len(polygons)],
+                    "start_date": start_date,
+                    "end_date": end_date,
+                }
+                started = time.perf_counter()
+                response = client.post(path, body, content_type='application/json')
+                elapsed = time.perf_counter() - started
+                with lock:
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code == 200:
+                        latencies.append(elapsed)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f'benchmark-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def run_benchmark(requests=50, concurrency=4, distinct=10, start_date='2024-01-01', end_date='2024-09-30',
+                  ee_fixture=None, ee_latency=0.5, ee_jitter=0.0, power_fixture=None, power_latency=0.2,
+                  warmup=0, seed=0):
+    """
+    Corre el banco de pruebas y retorna los resultados como un diccionario serializable.
+
+    `warmup` pedidos previos (no medidos) llenan las cachés, para medir el caso con caché.
+    """
+    fake_ee = FakeEarthEngine(ee_fixture or synthetic_ee_fixture(), ee_latency, ee_jitter)
+    fake_power = FakePowerServer(power_fixture, power_latency)
+    polygons = sample_polygons(distinct, seed)
+
+    with isolated_environment(fake_ee, fake_power):
+        if warmup:
+            run_load(polygons, warmup, concurrency, start_date, end_date)
+        ee_before, power_before = fake_ee.calls.count, fake_power.calls.count
+        latencies, statuses, elapsed = run_load(polygons, requests, concurrency, start_date, end_date)
+        ee_calls = fake_ee.calls.count - ee_before
+        power_calls = fake_power.calls.count - power_before
+
+    return {
+        "configuracion": {
+            "pedidos": requests,
+            "concurrencia": concurrency,
+            "poligonos_distintos": distinct,
+            "desde": start_date,
+            "hasta": end_date,
+            "latencia_ee_s": ee_latency,
+            "latencia_power_s": power_latency,
+            "precalentamiento": warmup,
+        },
+        "latencia": latency_summary(latencies),
+        "pedidos_por_segundo": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "duracion_s": round(elapsed, 3),
+        "respuestas": {str(code): count for code, count in sorted(statuses.items())},
+        "llamadas": {
+            "earth_engine": ee_calls,
+            "nasa_power": power_calls,
+            "earth_engine_por_pedido": round(ee_calls / requests, 3) if requests else None,
+            "nasa_power_por_pedido": round(power_calls / requests, 3) if requests else None,
+        },
+    }
+
+
+def compare(current, previous):
+    """Variación relativa (%) de las métricas principales respecto de una corrida anterior."""
+    def change(new, old):
+        if new is None or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    metrics = {
+        key: change(current["latencia"].get(key), previous["latencia"].get(key))
+        for key in ("p50_ms", "p95_ms", "p99_ms")
+    }
+    metrics["pedidos_por_segundo"] = change(current["pedidos_por_segundo"], previous["pedidos_por_segundo"])
+    for key in ("earth_engine_por_pedido", "nasa_power_por_pedido"):
+        metrics[key] = change(current["llamadas"][key], previous["llamadas"][key])
+    return metrics
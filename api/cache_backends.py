@@ -0,0 +1,75 @@
+import os
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+# Con MAX_SIZE, cada cuántas escrituras (por proceso) se suma el tamaño de la caché
+SIZE_CHECK_INTERVAL = 100
+# Al pasarse de MAX_SIZE se descartan entradas hasta quedar en esta fracción del límite
+SIZE_CULL_TARGET = 0.9
+
+
+class LRUFileBasedCache(FileBasedCache):
+    """
+    FileBasedCache que, al llegar a MAX_ENTRIES, descarta las entradas usadas hace más
+    tiempo en lugar de entradas al azar. Cada lectura exitosa actualiza la fecha de
+    modificación del archivo, que se usa como marca de último uso.
+
+    Con la opción MAX_SIZE (en bytes) también se limita el espacio en disco: cada
+    SIZE_CHECK_INTERVAL escrituras se suma el tamaño de los archivos y, si se pasa, se
+    descartan los usados hace más tiempo hasta quedar en SIZE_CULL_TARGET del límite.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._max_size = params.get('OPTIONS', {}).get('MAX_SIZE')
+        self._writes = 0
+
+    def get(self, key, default=None, version=None):
+        missing = object()
+        value = super().get(key, missing, version)
+        if value is missing:
+            return default
+        try:
+            os.utime(self._key_to_file(key, version))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def _last_used(self, fname):
+        try:
+            return os.path.getmtime(fname)
+        except FileNotFoundError:
+            return 0
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries >= self._max_entries:
+            if self._cull_frequency == 0:
+                return self.clear()
+            filelist.sort(key=self._last_used)
+            for fname in filelist[:int(num_entries / self._cull_frequency)]:
+                self._delete(fname)
+        elif self._max_size:
+            self._cull_by_size(filelist)
+
+    def _cull_by_size(self, filelist):
+        # Se revisa en la primera escritura del proceso y después cada SIZE_CHECK_INTERVAL
+        self._writes += 1
+        if (self._writes - 1) % SIZE_CHECK_INTERVAL:
+            return
+        entries = []
+        for fname in filelist:
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        total = sum(size for _, size, _ in entries)
+        if total <= self._max_size:
+            return
+        for _, size, fname in sorted(entries):
+            if total <= self._max_size * SIZE_CULL_TARGET:
+                break
+            self._delete(fname)
+            total -= size
@@ -0,0 +1,106 @@
+import warnings
+
+import numpy as np
+
+# Los días se indexan siempre en un calendario bisiesto (366 días), así el mismo
+# mes-día ocupa la misma columna en todos los años.
+DAYS_IN_LEAP_YEAR = 366
+# Índice (base 0) del 29 de febrero en ese calendario
+FEB_29 = 59
+
+# Estadísticos disponibles: percentil (0-100) o None para la media
+STATISTICS = {
+    "p5": 5,
+    "p50": 50,
+    "p95": 95,
+    "media": None,
+}
+
+
+def date_axis(start_date, end_date):
+    """Retorna un arreglo datetime64[D] con todos los días entre start_date y end_date inclusive."""
+    return np.arange(np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1)
+
+
+def is_leap(years):
+    years = np.asarray(years)
+    return (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+
+
+def leap_day_index(dates):
+    """
+    Convierte fechas datetime64[D] al índice del día en el calendario bisiesto (0-365).
+    En los años no bisiestos los días desde el 1 de marzo se corren uno para dejar libre el 29/2.
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    year_start = dates.astype("datetime64[Y]")
+    day_of_year = (dates - year_start.astype("datetime64[D]")).astype(int)
+    years = year_start.astype(int) + 1970
+    return day_of_year + ((~is_leap(years)) & (day_of_year >= FEB_29))
+
+
+def parse_power_dates(keys):
+    """Convierte claves "YYYYMMDD" de NASA POWER a datetime64[D] sin pasar por strptime."""
+    keys = np.asarray(keys, dtype=np.int64)
+    years = (keys // 10000 - 1970).astype("datetime64[Y]")
+    months = (keys // 100 % 100 - 1).astype("timedelta64[M]")
+    days = (keys % 100 - 1).astype("timedelta64[D]")
+    return (years.astype("datetime64[M]") + months).astype("datetime64[D]") + days
+
+
+def series_to_array(values_by_date, dates):
+    """Arma un arreglo alineado con `dates` a partir de { "YYYYMMDD": valor }, con NaN donde falta el dato."""
+    keys = np.datetime_as_string(dates, unit="D")
+    return np.array(
+        [values_by_date.get(key.replace("-", "")) for key in keys], dtype=float
+    )
+
+
+def history_array(by_year, years):
+    """
+    Arma la historia como un arreglo años × 366 a partir de { año: { "YYYYMMDD": valor } }.
+
+    Los valores faltantes quedan en NaN. En los años no bisiestos el 29 de febrero se
+    completa con el promedio del 28 de febrero y el 1 de marzo, para que ese día tenga
+    tantas muestras como el resto.
+    """
+    years = list(years)
+    history = np.full((len(years), DAYS_IN_LEAP_YEAR), np.nan)
+    for row, year in enumerate(years):
+        values = by_year.get(year)
+        if not values:
+            continue
+        keys = list(values)
+        data = np.array([values[key] for key in keys], dtype=float)
+        history[row, leap_day_index(parse_power_dates(keys))] = data
+
+    non_leap = ~is_leap(np.array(years, dtype=int))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        history[non_leap, FEB_29] = np.nanmean(history[non_leap][:, [FEB_29 - 1, FEB_29 + 1]], axis=1)
+    return history
+
+
+def climatology_statistics(history, statistics=("p95",)):
+    """
+    Calcula los estadísticos pedidos para cada día del calendario bisiesto.
+
+    Todos los percentiles se obtienen con una sola llamada a np.nanpercentile sobre el
+    eje de los años. Retorna { nombre: arreglo de 366 valores } con NaN en los días sin datos.
+    """
+    percentiles = [name for name in statistics if STATISTICS[name] is not None]
+    result = {}
+    with warnings.catch_warnings():
+        # Los días sin ningún dato producen avisos "All-NaN slice"; quedan en NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if percentiles:
+            values = np.nanpercentile(history, [STATISTICS[name] for name in percentiles], axis=0)
+            result.update(zip(percentiles, values))
+        if "media" in statistics:
+            result["media"] = np.nanmean(history, axis=0)
+    return result
+
+
+def to_optional_floats(values):
+    """Convierte un arreglo a una lista de float con None en lugar de NaN."""
+    return [None if np.isnan(value) else float(value) for value in values]
@@ -0,0 +1,70 @@
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Las respuestas más cortas no vale la pena comprimirlas
+MIN_LENGTH = 200
+# Calidad de Brotli: 11 es la máxima pero demasiado lenta para respuestas dinámicas
+BROTLI_QUALITY = 5
+
+
+def accepted_encodings(header):
+    """Codificaciones que acepta el cliente según Accept-Encoding (sin las de q=0)."""
+    encodings = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Comprime las respuestas con Brotli si el cliente lo acepta (y está instalado) o si no con
+    gzip, como django.middleware.gzip.GZipMiddleware. Las respuestas por streaming
+    (/api/ndvi/stream/) no se comprimen: cada evento tiene que llegar apenas se envía. Las
+    imágenes (teselas PNG) tampoco, porque ya vienen comprimidas.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or len(response.content) < MIN_LENGTH:
+            return response
+        if response.get("Content-Type", "").startswith("image/"):
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encodings = accepted_encodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if brotli is not None and "br" in encodings:
+            encoding = "br"
+            compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif "gzip" in encodings:
+            encoding = "gzip"
+            compressed = compress_string(response.content, max_random_bytes=100)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(compressed))
+        response.headers["Content-Encoding"] = encoding
+        # El cuerpo ya no es idéntico byte a byte: el ETag pasa a ser débil (RFC 9110 8.8.1)
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        return response
@@ -0,0 +1,258 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SERVICE_ACCOUNT = 'api-monitoreo-forrajero@proyec2020.iam.gserviceaccount.com'
+CREDENTIALS_PATH = os.environ.get('EE_CREDENTIALS_PATH', '/etc/secrets/GOOGLE_APPLICATION_CREDENTIALS')
+# Se renueva el token cuando le quedan menos de estos minutos de vida
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class EarthEngineSession:
+    """
+    Sesión de Google Earth Engine única por proceso.
+
+    Las credenciales de la cuenta de servicio se crean y se pasan a ee.Initialize una sola
+    vez; en las llamadas siguientes sólo se renueva el token cuando está por vencer. Es
+    segura para usar desde varios hilos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = None
+
+    def _needs_refresh(self, credentials):
+        expiry = credentials.expiry
+        if expiry is None:
+            return True
+        # google-auth guarda el vencimiento como UTC sin zona horaria
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return expiry - now < TOKEN_REFRESH_MARGIN
+
+    def ensure(self):
+        """Inicializa Earth Engine si hace falta y retorna el módulo ee listo para usar."""
+        import ee
+
+        credentials = self._credentials
+        if credentials is not None and not self._needs_refresh(credentials):
+            return ee
+        with self._lock:
+            from google.auth.transport.requests import Request
+
+            if self._credentials is None:
+                with metrics.stage('ee_init'):
+                    credentials = ee.ServiceAccountCredentials(SERVICE_ACCOUNT, CREDENTIALS_PATH)
+                    credentials.refresh(Request())
+                    ee.Initialize(credentials)
+                self._credentials = credentials
+            elif self._needs_refresh(self._credentials):
+                # ee.data conserva la misma instancia de credenciales, así que basta con renovarla
+                self._credentials.refresh(Request())
+        return ee
+
+
+class EarthEngineBusyError(Exception):
+    """
+    No se consiguió turno para consultar a Earth Engine a tiempo (ver EarthEngineGovernor).
+    `retry_after` son los segundos sugeridos antes de volver a intentar.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Segundos entre consultas a la cola mientras se espera turno
+QUEUE_POLL_INTERVAL = 0.2
+# Un turno se libera solo si quien lo tiene no lo devuelve en este tiempo (proceso caído)
+SLOT_LEASE = 600.0
+# Un pedido en espera que deja de consultar la cola este tiempo se descarta
+WAITER_LEASE = 30.0
+# Retry-After sugerido cuando no se consigue turno
+BUSY_RETRY_AFTER = 10
+
+
+def process_alive(pid):
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class EarthEngineGovernor:
+    """
+    Semáforo compartido por todos los procesos que limita las evaluaciones de Earth Engine
+    (getInfo) simultáneas a `limit`, para no provocar "Too many concurrent aggregations".
+
+    Cada evaluación saca un número en una tabla de SQLite y pasa cuando hay menos de `limit`
+    números anteriores al suyo: los pedidos se atienden en orden de llegada. Los turnos de
+    procesos que terminaron sin devolverlos se descartan (ver SLOT_LEASE y WAITER_LEASE).
+    """
+
+    def __init__(self, path, limit):
+        self.path = str(path)
+        self.limit = limit
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS ee_turnos ("
+                " ticket INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " pid INTEGER NOT NULL,"
+                " granted INTEGER NOT NULL DEFAULT 0,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def enqueue(self):
+        """Saca un número y lo retorna."""
+        connection = self._connection()
+        with connection:
+            return connection.execute(
+                "INSERT INTO ee_turnos (pid, expires_at) VALUES (?, ?) RETURNING ticket",
+                (os.getpid(), time.time() + WAITER_LEASE),
+            ).fetchone()[0]
+
+    def try_acquire(self, ticket):
+        """True si al número `ticket` le toca (o ya tenía) turno; si no, renueva su lugar en la cola."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            connection.execute("DELETE FROM ee_turnos WHERE expires_at < ?", (now,))
+            others = connection.execute("SELECT ticket, pid FROM ee_turnos WHERE pid != ?", (os.getpid(),)).fetchall()
+            for other, pid in others:
+                if not process_alive(pid):
+                    connection.execute("DELETE FROM ee_turnos WHERE ticket = ?", (other,))
+            ahead, = connection.execute("SELECT COUNT(*) FROM ee_turnos WHERE ticket < ?", (ticket,)).fetchone()
+            granted = ahead < self.limit
+            updated = connection.execute(
+                "UPDATE ee_turnos SET granted = ?, expires_at = ? WHERE ticket = ?",
+                (int(granted), now + (SLOT_LEASE if granted else WAITER_LEASE), ticket),
+            ).rowcount
+            if not updated:
+                # Se descartó por no renovarlo a tiempo: vuelve a la cola con el mismo número
+                connection.execute(
+                    "INSERT INTO ee_turnos (ticket, pid, granted, expires_at) VALUES (?, ?, ?, ?)",
+                    (ticket, os.getpid(), int(granted), now + (SLOT_LEASE if granted else WAITER_LEASE)),
+                )
+        return granted
+
+    def release(self, ticket):
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM ee_turnos WHERE ticket = ?", (ticket,))
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Espera turno como mucho `timeout` segundos (EE_QUEUE_TIMEOUT si no se indica)."""
+        timeout = settings.EE_QUEUE_TIMEOUT if timeout is None else timeout
+        ticket = self.enqueue()
+        try:
+            with metrics.stage('ee_cola'):
+                deadline = time.monotonic() + timeout
+                while not self.try_acquire(ticket):
+                    if time.monotonic() > deadline:
+                        raise EarthEngineBusyError(
+                            "Earth Engine está ocupado; vuelva a intentar en unos segundos.", BUSY_RETRY_AFTER
+                        )
+                    time.sleep(QUEUE_POLL_INTERVAL)
+            yield
+        finally:
+            self.release(ticket)
+
+
+_session = EarthEngineSession()
+_governor = None
+_governor_lock = threading.Lock()
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+
+def ensure_earth_engine():
+    """Retorna el módulo ee con la sesión del proceso inicializada."""
+    return _session.ensure()
+
+
+def get_governor():
+    """Retorna el semáforo de Earth Engine del proceso, creándolo la primera vez."""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = EarthEngineGovernor(settings.EE_GOVERNOR_PATH, settings.EE_MAX_CONCURRENT)
+    return _governor
+
+
+def get_info(obj, stage):
+    """
+    obj.getInfo() medido como la etapa `stage` (ver metrics.stage) y contado como llamada a GEE.
+    Espera turno en el semáforo compartido; lanza EarthEngineBusyError si no lo consigue a tiempo.
+    """
+    with get_governor().slot():
+        with metrics.stage(stage):
+            try:
+                result = obj.getInfo()
+            except Exception:
+                metrics.count_upstream('earth_engine', ok=False)
+                raise
+    metrics.count_upstream('earth_engine', ok=True)
+    return result
+
+
+def get_map_url(image, visualization):
+    """
+    Plantilla de URL de teselas ("...{z}/{x}/{y}") de `image` con los parámetros de
+    visualización indicados. Pedir el map id es una llamada a GEE: espera turno como get_info.
+    """
+    with get_governor().slot():
+        with metrics.stage('ee_mapa'):
+            try:
+                map_id = image.getMapId(visualization)
+            except Exception:
+                metrics.count_upstream('earth_engine', ok=False)
+                raise
+    metrics.count_upstream('earth_engine', ok=True)
+    return map_id['tile_fetcher'].url_format
+
+
+def warm_up():
+    """Importa los módulos pesados del pipeline e inicializa Earth Engine."""
+    from . import evaluate, ndvi_script  # noqa: F401
+
+    try:
+        ensure_earth_engine()
+    except Exception as e:
+        # Si falla se reintenta en el primer pedido
+        logger.warning("Error al inicializar Earth Engine durante el arranque: %s", e)
+
+
+def warm_up_in_background():
+    """Lanza warm_up en un hilo aparte, una sola vez por proceso."""
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, name='ee-warm-up', daemon=True).start()
@@ -1,166 +1,290 @@
-import ee
-import json
-from google.oauth2 import service_account
-import os
-from pathlib import Path
-
-def initialize_earth_engine():
-    service_account = 'api-monitoreo-forrajero@proyec2020.iam.gserviceaccount.com'
-    credentials = ee.ServiceAccountCredentials(service_account, '/etc/secrets/GOOGLE_APPLICATION_CREDENTIALS')
-    ee.Initialize(credentials)
-
-# Función para calcular el centroide del polígono
-def get_ndvi_and_regions(polygon, start_date, end_date):
-    # Iniciar Google Earth Engine
-    initialize_earth_engine()
-    
-    # Función para crear la máscara de nubes a partir de la banda de calidad.
-    # Se asume que en la banda "MSK_CLDPRB" 0 indica píxel sin nubes y 1 con nubes.
-    # Así, con .lt(1) se generan 1 (sin nubes) y 0 (con nubes)
-    def maskcloud(img):
-       q = img.select(["MSK_CLDPRB"]).lt(1)
-       return img.updateMask(q).addBands(q.rename('q'))
-
-    # Cargar la colección Sentinel‑2 SR harmonized, filtrando por fecha, ubicación y porcentaje de nubes
-    dataset = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
-        .filterDate(start_date, end_date) \
-        .filterBounds(ee.Geometry.Polygon(polygon['coordinates'][0])) \
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from . import metrics
+from .ee_session import ensure_earth_engine, get_info
+from .geometry import geodesic_area, normalize_polygon, perimeter
+from .vegetation_index import get_vegetation_index, unit_name
+
+logger = logging.getLogger(__name__)
+
+# El módulo ee se obtiene siempre de ensure_earth_engine(): así cada función que arma consultas
+# lo recibe con la sesión del proceso ya inicializada (ver ee_session)
+
+# Fracción mínima de píxeles sin nubes en el polígono para aceptar un día
+MIN_CLEAR_FRACTION = 0.8
+
+# --- Escala de las reducciones según el tamaño del polígono (ver plan_reduction) ---
+# Escala de siempre, que se mantiene en los potreros chicos y medianos (un cuadrado la
+# conserva hasta unas 3.600 ha)
+MIN_SCALE = 30
+MAX_SCALE = 300
+# Fracción máxima del área del polígono que puede quedar en píxeles de borde
+MAX_EDGE_FRACTION = 0.02
+# Píxeles por reducción a partir de los cuales se sube tileScale (se reparte en más tiles)
+TILE_PIXELS = 100_000
+MAX_TILE_SCALE = 16
+MAX_PIXELS = 1e9
+# Resolución del ráster de unidades de vegetación (Raster_UV): reducirlo más fino no agrega nada
+VEGETATION_SCALE = 50
+
+# --- Tramos de fechas para las series largas ---
+# Píxeles (a la escala de plan_reduction) × días que se piden como máximo en una sola consulta;
+# con esto el tramo inicial es de un año salvo en los polígonos largos y angostos
+WINDOW_PIXEL_DAYS = 2e8
+MAX_WINDOW_DAYS = 365
+# Un tramo que falla no se sigue dividiendo por debajo de este tamaño
+MIN_WINDOW_DAYS = 15
+# Tramos consultados a la vez en una misma serie
+MAX_PARALLEL_WINDOWS = 4
+# Errores de GEE que se resuelven pidiendo menos datos por consulta
+RETRYABLE_ERRORS = (
+    "Computation timed out",
+    "User memory limit exceeded",
+    "Computed value is too large",
+    "Too many concurrent aggregations",
+)
+
+
+# Función para crear la máscara de nubes a partir de la banda de calidad.
+# Se asume que en la banda "MSK_CLDPRB" 0 indica píxel sin nubes y 1 con nubes.
+# Así, con .lt(1) se generan 1 (sin nubes) y 0 (con nubes)
+def maskcloud(img):
+   q = img.select(["MSK_CLDPRB"]).lt(1)
+   return img.updateMask(q).addBands(q.rename('q'))
+
+
+def ndvi_collection(region, start_date, end_date):
+    """
+    Colección Sentinel‑2 SR harmonized con las bandas 'NDVI' (enmascarada por nubes) y 'q'
+    (1 sin nubes, 0 con nubes), filtrada por fecha, ubicación (si `region` no es None) y
+    porcentaje de nubes. Cada imagen lleva la propiedad 'dia' (YYYY-MM-dd) para agruparla con
+    los demás tiles del día.
+    """
+    ee = ensure_earth_engine()
+    def add_ndvi(img):
+        ndvi = img.normalizedDifference(["B8", "B4"]).rename("NDVI")
+        return img.addBands(ndvi).set('dia', img.date().format('YYYY-MM-dd'))
+
+    collection = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED").filterDate(start_date, end_date)
+    if region is not None:
+        collection = collection.filterBounds(region)
+    return collection \
         .filterMetadata("CLOUDY_PIXEL_PERCENTAGE", "less_than", 80) \
         .select("B4", "B8", "MSK_CLDPRB") \
-        .map(maskcloud)
+        .map(maskcloud) \
+        .map(add_ndvi) \
+        .select('NDVI', 'q')
 
-    # Función para calcular NDVI y recortar a la región de interés
-    def NDVI(img):
-        ndvi = img.normalizedDifference(["B8", "B4"]).rename("NDVI")
-        return img.addBands(ndvi).clip(ee.Geometry.Polygon(polygon['coordinates'][0]))
-    
-    # Aplicar la función NDVI a la colección; la imagen resultante incluye la banda 'NDVI' y la banda 'q'
-    ndvi = dataset.map(NDVI).select('NDVI', 'q')
-
-    # Función para asignar la propiedad 'fecha' a cada imagen
-    def get_image_dates(image):
-        return image.set('fecha', image.date().format())
-    
-    dates_list = ndvi.map(get_image_dates).aggregate_array('fecha')
-
-    # Función que, para cada fecha, evalúa la calidad (píxeles sin nubes) y, si es aceptable,
-    # calcula el promedio de NDVI usando solo los píxeles sin nubes.
-    def get_average_ndvi(date):
-        # Seleccionar imágenes dentro del día
-        daily_images = ndvi.filterDate(date, ee.Date(date).advance(1, 'day'))
-        # Seleccionar las bandas 'NDVI' y 'q'
-        daily_image = daily_images.select(['NDVI','q']).mean()
-        
-        # Calcular el promedio de la banda 'q' en la región para obtener el porcentaje de píxeles claros.
-        quality_dict = daily_image.reduceRegion(
+
+def plan_reduction(rings):
+    """
+    Parámetros de reduceRegion para el polígono: {"scale", "tileScale", "bestEffort", "maxPixels"}.
+
+    La escala es la más gruesa entre MIN_SCALE y MAX_SCALE que no cambia el NDVI medio: los
+    píxeles interiores promedian los mismos valores, y la diferencia viene de los píxeles que
+    cortan el borde, que son a lo sumo perímetro × escala / área del polígono. La escala es la
+    que deja esa fracción en MAX_EDGE_FRACTION; como el NDVI de adentro y de afuera de un
+    potrero difiere en menos de 0,5, el error del promedio queda por debajo de 0,01. Así un
+    polígono compacto que pasa de MIN_SCALE se reduce siempre con unos (perímetro² / área) /
+    MAX_EDGE_FRACTION² píxeles (40.000 un cuadrado), y un potrero de 5.000 ha no cuesta cientos
+    de veces más que uno de 5 ha.
+
+    Si esa cota deja más de TILE_PIXELS píxeles (polígonos grandes y angostos) se sube
+    tileScale en proporción; bestEffort sólo se activa si aun así se pasaría de MAX_PIXELS
+    (no ocurre dentro de geometry.MAX_AREA), y entonces GEE puede usar una escala mayor.
+    """
+    area = geodesic_area(rings)
+    edge_limit = MAX_EDGE_FRACTION * area / max(perimeter(rings), 1.0)
+    scale = int(math.ceil(min(MAX_SCALE, max(MIN_SCALE, edge_limit))))
+    pixels = area / (scale * scale)
+    tile_scale = 1
+    while tile_scale < MAX_TILE_SCALE and pixels > TILE_PIXELS * tile_scale:
+        tile_scale *= 2
+    return {"scale": scale, "tileScale": tile_scale, "bestEffort": pixels > MAX_PIXELS, "maxPixels": MAX_PIXELS}
+
+
+def ndvi_composite(start_date, end_date):
+    """Mediana del NDVI sin nubes entre start_date y end_date (exclusive), para los mapas (ver tiles)."""
+    return ndvi_collection(None, start_date, end_date).select('NDVI').median()
+
+
+def daily_ndvi(region, start_date, end_date, plan):
+    """
+    Serie diaria de NDVI medio del polígono, como un ee.List de diccionarios
+    {'fecha', 'NDVI', 'q'} (todavía no evaluado).
+
+    Los tiles de un mismo día se unen en un mosaico y una sola reducción calcula a la vez la
+    fracción de píxeles sin nubes ('q') y el NDVI medio de los píxeles sin nubes. Los días con
+    una fracción menor a MIN_CLEAR_FRACTION se descartan en el servidor. La reducción usa los
+    parámetros de plan_reduction.
+    """
+    ee = ensure_earth_engine()
+    collection = ndvi_collection(region, start_date, end_date)
+    days = ee.List(collection.aggregate_array('dia')).distinct().sort()
+
+    def reduce_day(day):
+        mosaic = collection.filter(ee.Filter.eq('dia', day)).mosaic()
+        stats = mosaic.reduceRegion(reducer=ee.Reducer.mean(), geometry=region, **plan)
+        return ee.Feature(None, stats).set('fecha', day)
+
+    by_day = ee.FeatureCollection(days.map(reduce_day)) \
+        .filter(ee.Filter.gte('q', MIN_CLEAR_FRACTION))
+    return by_day.toList(by_day.size()).map(lambda feature: ee.Feature(feature).toDictionary())
+
+
+def batch_daily_ndvi(features, start_date, end_date, plan):
+    """
+    Serie diaria de NDVI medio de varios polígonos a la vez, como un ee.List de filas
+    [feature_id, fecha, NDVI, q] (todavía no evaluado).
+
+    `features` es un ee.FeatureCollection cuyos elementos tienen la propiedad 'feature_id'.
+    Igual que en daily_ndvi, los tiles de cada día se unen en un mosaico, pero se reduce con
+    reduceRegions sobre todos los polígonos en la misma pasada, con la escala y el tileScale de
+    `plan` (ver get_batch_ndvi_and_regions).
+    """
+    ee = ensure_earth_engine()
+    collection = ndvi_collection(features, start_date, end_date)
+    days = ee.List(collection.aggregate_array('dia')).distinct().sort()
+
+    def reduce_day(day):
+        mosaic = collection.filter(ee.Filter.eq('dia', day)).mosaic()
+        stats = mosaic.reduceRegions(
+            collection=features,
             reducer=ee.Reducer.mean(),
-            geometry=ee.Geometry.Polygon(polygon['coordinates'][0]),
-            scale=30,
-            maxPixels=1e9
+            scale=plan["scale"],
+            tileScale=plan["tileScale"],
         )
-        clearFraction = ee.Number(quality_dict.get('q')).gte(0.8)
-        
-        # Condición: si el % de píxeles sin nubes es mayor o igual al 20%, se calcula el promedio de NDVI;
-        # de lo contrario se descarta la fecha (se retorna None)
-        def compute_ndvi():
-            mean_ndvi = daily_image.select("NDVI").rename('mean_NDVI')
-            ndvi_roi = mean_ndvi.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=ee.Geometry.Polygon(polygon['coordinates'][0]),
-                scale=30,
-                maxPixels=1e9
-            )
-            return ee.Dictionary(ndvi_roi).set('date', date)
-        
-        # Si clearFraction >= 0.8 se computa el NDVI promedio; de lo contrario se retorna None
-        result = ee.Algorithms.If(ee.String(clearFraction), compute_ndvi(), None)
-        return result
-
-    # Mapear la función sobre la lista de fechas y obtener la colección diaria
-    daily_ndvi_collection = ee.List(dates_list.map(get_average_ndvi))
-    # Obtener los resultados como una lista de diccionarios
-    results = daily_ndvi_collection.getInfo()
-    # Filtrar fechas eliminadas (None) y formatear resultados
-    ndvi_results = [{"fecha": item['date'], "NDVI": item.get('mean_NDVI', None)}
-                    for item in results if item is not None]
-
-    # Ahora evaluamos a qué unidad de vegetación pertenece el polígono usando un ráster de cobertura terrestre.
+        return stats.map(lambda feature: feature.set('fecha', day))
+
+    by_day = ee.FeatureCollection(days.map(reduce_day)).flatten() \
+        .filter(ee.Filter.gte('q', MIN_CLEAR_FRACTION))
+    return by_day.reduceColumns(ee.Reducer.toList(4), ['feature_id', 'fecha', 'NDVI', 'q']).get('list')
+
+
+def date_windows(start_date, end_date, days):
+    """Divide [start_date, end_date) (YYYY-MM-DD) en tramos consecutivos de a lo sumo `days` días."""
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    windows = []
+    while start < end:
+        window_end = min(start + timedelta(days=days), end)
+        windows.append((start.isoformat(), window_end.isoformat()))
+        start = window_end
+    return windows
+
+
+def split_window(start_date, end_date):
+    """Parte un tramo en dos mitades."""
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    middle = (start + (end - start) / 2).isoformat()
+    return [(start_date, middle), (middle, end_date)]
+
+
+def window_days_for(rings):
+    """Tamaño inicial de los tramos según el área del polígono (ver WINDOW_PIXEL_DAYS)."""
+    scale = plan_reduction(rings)["scale"]
+    pixels = max(geodesic_area(rings) / (scale * scale), 1)
+    return int(min(MAX_WINDOW_DAYS, max(MIN_WINDOW_DAYS, WINDOW_PIXEL_DAYS / pixels)))
+
+
+def is_retryable(error):
+    message = str(error)
+    return any(text in message for text in RETRYABLE_ERRORS)
+
+
+def fetch_ndvi_window(region, start_date, end_date, plan, with_histogram=False):
+    """
+    Evalúa daily_ndvi en un tramo. Con with_histogram, el histograma de la unidad de
+    vegetación se pide en la misma consulta. Retorna (filas, histograma o None).
+    """
+    ee = ensure_earth_engine()
+    rows = daily_ndvi(region, start_date, end_date, plan)
+    if not with_histogram:
+        return get_info(rows, 'ee_ndvi'), None
+    query = ee.Dictionary({"ndvi": rows, "histograma": vegetation_histogram(region, plan)})
+    results = get_info(query, 'ee_ndvi_histograma')
+    return results["ndvi"], results["histograma"]
+
+
+def fetch_ndvi_rows(region, rings, start_date, end_date, include_histogram=False):
+    """
+    Serie de daily_ndvi entre start_date y end_date, pedida por tramos.
+
+    El rango se divide en tramos de window_days_for(rings) días que se consultan en paralelo
+    (a lo sumo MAX_PARALLEL_WINDOWS a la vez). Si un tramo falla por tiempo o memoria se parte
+    en dos y se reintentan sólo sus mitades, hasta MIN_WINDOW_DAYS. Los tramos se unen en orden.
+
+    Con include_histogram el histograma de la unidad de vegetación viaja con el primer tramo;
+    si esa consulta falla, el tramo se reintenta solo y el histograma queda en None.
+    Retorna (filas, histograma).
+    """
+    ee = ensure_earth_engine()
+    windows = date_windows(start_date, end_date, window_days_for(rings))
+    plan = plan_reduction(rings)
+    histogram = None
+    if not windows:
+        if include_histogram:
+            try:
+                histogram = get_info(vegetation_histogram(region, plan), 'ee_histograma')
+            except ee.EEException as e:
+                logger.warning("Error al evaluar la región: %s", e)
+        return [], histogram
+
+    rows_by_window = {}
+    pending = [(window, include_histogram and index == 0) for index, window in enumerate(windows)]
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_WINDOWS, len(windows))) as pool:
+        while pending:
+            futures = [
+                (metrics.submit(pool, fetch_ndvi_window, region, *window, plan, with_histogram), window, with_histogram)
+                for window, with_histogram in pending
+            ]
+            pending = []
+            for future, window, with_histogram in futures:
+                try:
+                    rows_by_window[window], window_histogram = future.result()
+                except ee.EEException as e:
+                    if with_histogram:
+                        logger.warning("Error al evaluar la región: %s", e)
+                        pending.append((window, False))
+                        continue
+                    days = (date.fromisoformat(window[1]) - date.fromisoformat(window[0])).days
+                    if not is_retryable(e) or days <= MIN_WINDOW_DAYS:
+                        raise
+                    logger.info("Reintentando en dos partes el tramo %s a %s: %s", window[0], window[1], e)
+                    pending.extend((half, False) for half in split_window(*window))
+                    continue
+                if with_histogram:
+                    histogram = window_histogram
+
+    rows = [row for window in sorted(rows_by_window) for row in rows_by_window[window]]
+    return rows, histogram
+
+
+def parse_ndvi_rows(rows):
+    """Formatea la serie evaluada por daily_ndvi para la respuesta."""
+    return [
+        {"fecha": row['fecha'], "NDVI": row.get('NDVI'), "fraccion_despejada": row.get('q')}
+        for row in rows
+    ]
+
+
+def summarize_vegetation_units(landcover_histogram):
+    """
+    A partir del histograma de Raster_UV ({'b1': {clase: píxeles}}, o None si no se pudo
+    obtener) arma la unidad de vegetación dominante y el porcentaje de cada unidad.
+    """
+    # Ahora evaluamos a qué unidad de vegetación pertenece el polígono.
     regions = []
     try:
-        unidad_vegetacion = ee.Image("projects/proyec2020/assets/Raster_UV")
-        region_mask = unidad_vegetacion.reduceRegion(
-            reducer=ee.Reducer.mode(),
-            geometry=ee.Geometry.Polygon(polygon['coordinates'][0]),
-            scale=50,
-            maxPixels=1e9
-        )
-        region_reduction = unidad_vegetacion.reduceRegion(
-            reducer=ee.Reducer.frequencyHistogram(),
-            geometry=ee.Geometry.Polygon(polygon['coordinates'][0]),
-            scale=30,
-            maxPixels=1e9
-        )
-        landcover_histogram = region_reduction.getInfo()
-        # Ejemplo de impresión para depuración
-        print('Histogram:', landcover_histogram.get('b1').values())
-        print('Total area count:', sum(landcover_histogram.get('b1').values()))
-        if isinstance(landcover_histogram.get('b1'), dict):
-            region_names = {
-                '25.0' : 'Monte Austral o Tipico',
-                '5.0' : 'Delta del Parana',
-                '32.0' : 'Pampa Interior Occidental',
-                '27.0' : 'Campos y Urundayzales',
-                '37.0' : 'Distrito de la Payunia',
-                '38.0' : 'Distrito Subandino-Estepa de coiron blanco',
-                '46.0' : 'Distrito Subandino-Estepa magallanica seca',
-                '49.0' : 'Ecotono de la Peninsula de Valdes',
-                '26.0' : 'Monte Oriental o de Transicion',
-                '4.0' : 'Valle del Parana',
-                '13.0' : 'Chaco Subhumedo',
-                '29.0' : 'Pampa Mesopotamica',
-                '22.0' : 'Caldenal',
-                '30.0' : 'Pampa Ondulada',
-                '1.0' : 'Selva Montana y Bosque de Aliso y Pino del cerro',
-                '24.0' : 'Bolsones Endorreicos',
-                '41.0' : 'Distrito Central-Estepa arbustiva serrana',
-                '6.0' : 'Prepuna',
-                '14.0' : 'Chaco Humedo con Bosques, Pajonales y Palmares de Caranday',
-                '15.0' : 'Chaco Humedo con Bosques y Canadas',
-                '40.0' : 'Distrito Central-Estepa arbustiva de quilenbai',
-                '33.0' : 'Pampa Deprimida',
-                '7.0' : 'Chaco Serrano',
-                '12.0' : 'Chaco Semiarido',
-                '21.0' : 'Algarrobal',
-                '34.0' : 'Pampa Austral',
-                '10.0' : 'Salinas Grandes',
-                '42.0' : 'Distrito Central-Erial',
-                '45.0' : 'Estepa arbustiva de mata negra',
-                '31.0' : 'Pampa Interior Plana',
-                '9.0' : 'Chaco Arido',
-                '17.0' : 'Pajonales y Palmares de Yatay',
-                '23.0' : 'Monte de Sierras y Bolsones',
-                '50.0' : 'Bosques Andino-Patagonicos',
-                '43.0' : 'Distrito del Golfo San Jorge',
-                '3.0' : 'Selva Misionera-Selva Paranaense',
-                '20.0' : 'Espinillar',
-                '11.0' : 'Banados de Mar Chiquita-Espartillares y zampales',
-                '16.0' : 'Bajos Submeridionales-Espartillares',
-                '44.0' : 'Distrito Central',
-                '19.0' : 'Nandubayzal y Selva de Montiel',
-                '48.0' : 'Ecotono Rionegrino',
-                '47.0' : 'Distrito Fueguino-Estepa magallanica humeda',
-                '8.0' : 'Pastizales de Altura',
-                '28.0' : 'Malezales',
-                '39.0' : 'Distrito Occidental',
-                '18.0' : 'Esteros del Ibera',
-                '2.0' : 'Selva de Transicion',
-                '35.0' : 'Puna',
-                '36.0' : 'Provincia Altoandina'
-            }
+        if landcover_histogram is None:
+            dominant_region_name = "Error"
+            dominant_region_percentage = 0
+        elif isinstance(landcover_histogram.get('b1'), dict):
             total_area = sum(landcover_histogram.get('b1').values())
             if total_area > 0:
                 for key, value in landcover_histogram.get('b1').items():
-                    region_name = region_names.get(key, "Unknown")
+                    region_name = unit_name(key)
                     regions.append({
                         "name": region_name,
                         "percentage": (value / total_area) * 100
@@ -176,14 +300,12 @@ def get_ndvi_and_regions(polygon, start_date, end_date):
             dominant_region_percentage = 0
 
     except Exception as e:
-        print("Error al evaluar la región:", e)
+        logger.warning("Error al evaluar la región: %s", e)
         dominant_region_name = "Error"
         dominant_region_percentage = 0
 
-    print(regions)
-    # Devolver NDVI y la región dominante junto con la lista de regiones
+    # Devolver la región dominante junto con la lista de regiones
     return {
-        "ndvi_data": ndvi_results,
         "dominant_region": {
             "name": dominant_region_name,
             "percentage": dominant_region_percentage,
@@ -192,4 +314,152 @@ def get_ndvi_and_regions(polygon, start_date, end_date):
     }
 
 
-        
+def vegetation_histogram(region, plan):
+    """
+    Histograma (todavía no evaluado) de la unidad de vegetación dentro del polígono, a la
+    resolución del ráster o a la escala de plan_reduction si es mayor.
+    """
+    ee = ensure_earth_engine()
+    # Se usa un ráster de cobertura terrestre con las unidades de vegetación.
+    unidad_vegetacion = ee.Image("projects/proyec2020/assets/Raster_UV")
+    return unidad_vegetacion.reduceRegion(
+        reducer=ee.Reducer.frequencyHistogram(),
+        geometry=region,
+        **{**plan, "scale": max(VEGETATION_SCALE, plan["scale"])},
+    )
+
+
+def batch_vegetation_histograms(features, plan):
+    """
+    Histogramas (todavía no evaluados) de la unidad de vegetación de varios polígonos, como un
+    ee.List de pares [feature_id, {clase: píxeles}].
+    """
+    ee = ensure_earth_engine()
+    unidad_vegetacion = ee.Image("projects/proyec2020/assets/Raster_UV")
+    histograms = unidad_vegetacion.reduceRegions(
+        collection=features,
+        reducer=ee.Reducer.frequencyHistogram().setOutputs(['b1']),
+        scale=max(VEGETATION_SCALE, plan["scale"]),
+        tileScale=plan["tileScale"],
+    )
+    return histograms.reduceColumns(ee.Reducer.toList(2), ['feature_id', 'b1']).get('list')
+
+
+def local_vegetation_histogram(rings):
+    """
+    Histograma de la unidad de vegetación calculado con el índice local (ver vegetation_index),
+    con el mismo formato que vegetation_histogram, o None si el índice no está importado.
+    """
+    index = get_vegetation_index()
+    if index is None:
+        return None
+    with metrics.stage('histograma_local'):
+        return {'b1': index.histogram(rings)}
+
+
+def get_vegetation_units(polygon):
+    """Unidad de vegetación dominante y porcentajes del polígono, sin la serie de NDVI."""
+    rings = normalize_polygon(polygon['coordinates'][0])
+    landcover_histogram = local_vegetation_histogram(rings)
+    if landcover_histogram is not None:
+        return summarize_vegetation_units(landcover_histogram)
+
+    ee = ensure_earth_engine()
+    region = ee.Geometry.Polygon(rings)
+    try:
+        landcover_histogram = get_info(vegetation_histogram(region, plan_reduction(rings)), 'ee_histograma')
+    except ee.EEException as e:
+        logger.warning("Error al evaluar la región: %s", e)
+        landcover_histogram = None
+    return summarize_vegetation_units(landcover_histogram)
+
+
+def get_ndvi_and_regions(polygon, start_date, end_date, include_regions=True):
+    """
+    Serie diaria de NDVI del polígono entre start_date (inclusive) y end_date (exclusive) y,
+    si include_regions es verdadero, las unidades de vegetación que abarca. "escala_m" es la
+    escala en metros de las reducciones (ver plan_reduction).
+    """
+    ee = ensure_earth_engine()
+
+    # Polígono validado y simplificado (no cambia si ya viene normalizado desde la vista)
+    rings = normalize_polygon(polygon['coordinates'][0])
+    region = ee.Geometry.Polygon(rings)
+
+    # La serie se pide por tramos en paralelo (ver fetch_ndvi_rows); si no está el índice local
+    # de unidades de vegetación, el histograma viaja con el primer tramo. El centroide ya no hace
+    # falta pedirlo: se calcula localmente (ver geometry.centroid).
+    local_histogram = local_vegetation_histogram(rings) if include_regions else None
+    rows, landcover_histogram = fetch_ndvi_rows(
+        region, rings, start_date, end_date, include_histogram=include_regions and local_histogram is None
+    )
+    if local_histogram is not None:
+        landcover_histogram = local_histogram
+    scale = plan_reduction(rings)["scale"]
+    if not include_regions:
+        return {"ndvi_data": parse_ndvi_rows(rows), "escala_m": scale}
+
+    # Devolver NDVI y la región dominante junto con la lista de regiones
+    return {
+        "ndvi_data": parse_ndvi_rows(rows),
+        **summarize_vegetation_units(landcover_histogram),
+        "escala_m": scale,
+    }
+
+
+def get_batch_ndvi_and_regions(polygons, start_date, end_date):
+    """
+    Igual que get_ndvi_and_regions para varios polígonos { id: anillos } en una sola consulta
+    a GEE. Retorna { id: resultado } con el mismo formato que get_ndvi_and_regions.
+
+    reduceRegions usa una sola escala, así que los polígonos se agrupan por su plan_reduction
+    y cada grupo se reduce por separado dentro de la misma consulta.
+    """
+    ee = ensure_earth_engine()
+    rings_by_feature = {feature_id: normalize_polygon(rings) for feature_id, rings in polygons.items()}
+    plans = {feature_id: plan_reduction(rings) for feature_id, rings in rings_by_feature.items()}
+    groups = {}
+    for feature_id, rings in rings_by_feature.items():
+        plan = plans[feature_id]
+        groups.setdefault((plan["scale"], plan["tileScale"]), []).append(
+            ee.Feature(ee.Geometry.Polygon(rings), {'feature_id': feature_id})
+        )
+    groups = [
+        (ee.FeatureCollection(features), {"scale": scale, "tileScale": tile_scale})
+        for (scale, tile_scale), features in groups.items()
+    ]
+
+    ndvi_rows = ee.List([])
+    for features, plan in groups:
+        ndvi_rows = ndvi_rows.cat(ee.List(batch_daily_ndvi(features, start_date, end_date, plan)))
+    if get_vegetation_index() is not None:
+        results = {"ndvi": get_info(ndvi_rows, 'ee_lote')}
+        histograms = {feature_id: local_vegetation_histogram(rings) for feature_id, rings in rings_by_feature.items()}
+    else:
+        try:
+            histogram_rows = ee.List([])
+            for features, plan in groups:
+                histogram_rows = histogram_rows.cat(ee.List(batch_vegetation_histograms(features, plan)))
+            results = get_info(ee.Dictionary({
+                "ndvi": ndvi_rows,
+                "histogramas": histogram_rows,
+            }), 'ee_lote')
+            histograms = {feature_id: {'b1': histogram} for feature_id, histogram in results["histogramas"]}
+        except ee.EEException as e:
+            # Si falla la consulta conjunta se intenta obtener sólo el NDVI
+            logger.warning("Error al evaluar las regiones: %s", e)
+            results = {"ndvi": get_info(ndvi_rows, 'ee_lote')}
+            histograms = {}
+
+    rows_by_feature = {feature_id: [] for feature_id in polygons}
+    for feature_id, fecha, ndvi, clear_fraction in sorted(results["ndvi"], key=lambda row: row[1]):
+        rows_by_feature[feature_id].append({"fecha": fecha, "NDVI": ndvi, "q": clear_fraction})
+
+    return {
+        feature_id: {
+            "ndvi_data": parse_ndvi_rows(rows),
+            **summarize_vegetation_units(histograms.get(feature_id)),
+            "escala_m": plans[feature_id]["scale"],
+        }
+        for feature_id, rows in rows_by_feature.items()
+    }
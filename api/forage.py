@@ -0,0 +1,213 @@
+import numpy as np
+
+from .climatology import date_axis, to_optional_floats
+from .evaluate import MIN_CLEAR_FRACTION
+from .geometry import geodesic_area
+
+# --- Modelo de Monteith: crecimiento = fPAR × PAR × EUR × f(temperatura) × (1 - leñosas) ---
+
+# fPAR a partir del NDVI (relación lineal usada para pastizales de la región pampeana)
+FPAR_SLOPE = 1.25
+FPAR_INTERCEPT = -0.025
+FPAR_MAX = 0.95
+# g/m² → kg/ha
+G_M2_TO_KG_HA = 10.0
+# POWER da ALLSKY_SFC_PAR_TOT como W/m² medio del día: × 86 400 s / 10⁶ → MJ/m²/día
+W_M2_TO_MJ_M2_DAY = 0.0864
+# Columnas de nasa_power_data con la PAR de cada día: la medida y, si falta (los días más
+# recientes), la media histórica de ese día del año
+PAR_COLUMN = "radiacion_diaria"
+PAR_FALLBACK_STATISTIC = "media"
+PAR_FALLBACK_COLUMN = "radiacion_media"
+
+# Recursos forrajeros: eficiencia en el uso de la radiación (EUR, g de materia seca por MJ de
+# PAR absorbida) y temperaturas base y óptima de crecimiento (°C). Son valores de referencia;
+# conviene calibrarlos con cortes de biomasa de cada zona.
+FORAGE_RESOURCES = {
+    'pastizal_natural': {'eur': 0.5, 't_base': 5.0, 't_opt': 20.0},
+    'pastura_implantada': {'eur': 0.9, 't_base': 5.0, 't_opt': 18.0},
+    'verdeo_invierno': {'eur': 1.1, 't_base': 3.0, 't_opt': 15.0},
+    'verdeo_verano': {'eur': 1.3, 't_base': 10.0, 't_opt': 25.0},
+}
+DEFAULT_RESOURCE = 'pastizal_natural'
+
+# Ajuste de la EUR por unidad de vegetación (ver vegetation_index.VEGETATION_UNIT_NAMES): en las
+# unidades semiáridas y áridas una parte menor de la radiación absorbida termina en forraje
+SEMIARID_UNITS = (
+    'Chaco Semiarido', 'Espinillar', 'Algarrobal', 'Caldenal', 'Pampa Interior Occidental',
+)
+ARID_UNITS = (
+    'Prepuna', 'Chaco Arido', 'Salinas Grandes', 'Monte de Sierras y Bolsones', 'Bolsones Endorreicos',
+    'Monte Austral o Tipico', 'Monte Oriental o de Transicion', 'Puna', 'Provincia Altoandina',
+    'Distrito de la Payunia', 'Distrito Subandino-Estepa de coiron blanco', 'Distrito Occidental',
+    'Distrito Central-Estepa arbustiva de quilenbai', 'Distrito Central-Estepa arbustiva serrana',
+    'Distrito Central-Erial', 'Distrito del Golfo San Jorge', 'Distrito Central',
+    'Estepa arbustiva de mata negra', 'Ecotono Rionegrino', 'Ecotono de la Peninsula de Valdes',
+)
+UNIT_EUR_FACTOR = {**{name: 0.85 for name in SEMIARID_UNITS}, **{name: 0.7 for name in ARID_UNITS}}
+
+
+def interpolate_daily(obs_days, obs_values, n_days):
+    """
+    Interpola linealmente observaciones dispersas a un eje diario, para muchos potreros a la vez.
+
+    `obs_days` y `obs_values` son arreglos potreros × observaciones (días desde el inicio, en
+    orden, con NaN de relleno). Antes de la primera y después de la última observación se
+    repite el valor más cercano; los potreros sin observaciones quedan en NaN. Retorna un
+    arreglo potreros × n_days.
+
+    Se usa un único searchsorted sobre todos los potreros: cada fila se corre `n_days + 1`
+    días para que las filas queden ordenadas una detrás de otra.
+    """
+    obs_days = np.asarray(obs_days, dtype=float)
+    obs_values = np.asarray(obs_values, dtype=float)
+    paddocks, width = obs_days.shape
+    valid = ~(np.isnan(obs_days) | np.isnan(obs_values))
+    counts = valid.sum(axis=1)
+
+    # Observaciones válidas a la izquierda (en su orden) y el relleno al final de cada fila
+    order = np.argsort(~valid, axis=1, kind='stable')
+    days = np.take_along_axis(np.where(valid, np.clip(obs_days, 0, n_days - 1), n_days), order, axis=1)
+    values = np.take_along_axis(obs_values, order, axis=1)
+
+    span = n_days + 1
+    offsets = np.arange(paddocks)[:, None] * span
+    axis = np.arange(n_days, dtype=float)
+    position = np.searchsorted((days + offsets).ravel(), (axis + offsets).ravel(), side='right')
+    position = position.reshape(paddocks, n_days) - np.arange(paddocks)[:, None] * width
+
+    last = np.maximum(counts - 1, 0)[:, None]
+    right = np.minimum(position, last)
+    left = np.minimum(np.maximum(position - 1, 0), last)
+    x0, x1 = np.take_along_axis(days, left, axis=1), np.take_along_axis(days, right, axis=1)
+    y0, y1 = np.take_along_axis(values, left, axis=1), np.take_along_axis(values, right, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(x1 > x0, (axis - x0) / (x1 - x0), 0.0)
+    daily = y0 + fraction * (y1 - y0)
+    daily[counts == 0] = np.nan
+    return daily
+
+
+def fpar_from_ndvi(ndvi):
+    return np.clip(FPAR_SLOPE * ndvi + FPAR_INTERCEPT, 0.0, FPAR_MAX)
+
+
+def temperature_factor(temperature, t_base, t_opt):
+    """0 por debajo de la temperatura base, 1 desde la óptima y lineal entre las dos."""
+    return np.clip((temperature - t_base) / (t_opt - t_base), 0.0, 1.0)
+
+
+def forage_growth(ndvi, par, temperature, eur, t_base, t_opt, woody_fraction):
+    """
+    Crecimiento diario de forraje en kg MS/ha/día a partir del NDVI, la PAR incidente en
+    MJ/m²/día, la temperatura media en °C, la EUR en g MS/MJ, las temperaturas base y óptima en
+    °C y la fracción cubierta por leñosas (0 a 1). Todos los argumentos se combinan con las
+    reglas de broadcasting de NumPy: series potreros × días y parámetros potreros × 1.
+    """
+    absorbed = fpar_from_ndvi(ndvi) * par
+    return absorbed * eur * temperature_factor(temperature, t_base, t_opt) * (1.0 - woody_fraction) * G_M2_TO_KG_HA
+
+
+def resource_eur(resource, regions):
+    """EUR del recurso ajustada por las unidades de vegetación del potrero, ponderadas por su porcentaje."""
+    base = FORAGE_RESOURCES[resource]['eur']
+    total = sum(region['percentage'] for region in regions)
+    if not total:
+        return base
+    factor = sum(region['percentage'] * UNIT_EUR_FACTOR.get(region['name'], 1.0) for region in regions) / total
+    return base * factor
+
+
+def day_offsets(dates, start):
+    """Días desde `start` (datetime64[D]) de fechas "YYYY-MM-DD" o date."""
+    return (np.array([str(value)[:10] for value in dates], dtype='datetime64[D]') - start).astype(float)
+
+
+def stack_inputs(results, start_date, end_date):
+    """
+    Arma las series de todos los potreros sobre un eje diario común: NDVI observado
+    (potreros × observaciones) y PAR en MJ/m²/día y temperatura (potreros × días).
+    """
+    dates = date_axis(start_date, end_date)
+    start, n_days = dates[0], len(dates)
+    observations = []
+    for result in results:
+        # Las escenas con pocos píxeles despejados no se usan para interpolar: el mismo umbral con
+        # que daily_ndvi descarta los días, por si las filas vienen de otro lado (ndvi_store)
+        rows = [
+            row for row in result["ndvi_data"]["ndvi_data"]
+            if row.get("NDVI") is not None
+            and (row.get("fraccion_despejada") is None or row["fraccion_despejada"] >= MIN_CLEAR_FRACTION)
+        ]
+        observations.append((day_offsets([row["fecha"] for row in rows], start), [row["NDVI"] for row in rows]))
+
+    width = max([len(values) for _, values in observations] + [1])
+    obs_days = np.full((len(results), width), np.nan)
+    obs_values = np.full((len(results), width), np.nan)
+    par = np.full((len(results), n_days), np.nan)
+    temperature = np.full((len(results), n_days), np.nan)
+    for row, (result, (days, values)) in enumerate(zip(results, observations)):
+        obs_days[row, :len(values)] = days
+        obs_values[row, :len(values)] = values
+        power = result["nasa_power_data"]
+        if power:
+            index = day_offsets([day["fecha"] for day in power], start).astype(int)
+            inside = (index >= 0) & (index < n_days)
+            radiation = np.array([
+                day.get(PAR_COLUMN) if day.get(PAR_COLUMN) is not None else day.get(PAR_FALLBACK_COLUMN)
+                for day in power
+            ], dtype=float)
+            par[row, index[inside]] = radiation[inside] * W_M2_TO_MJ_M2_DAY
+            temperature[row, index[inside]] = np.array([day["temperatura"] for day in power], dtype=float)[inside]
+    return dates, obs_days, obs_values, par, temperature
+
+
+def forage_availability(paddocks, start_date, end_date):
+    """
+    Producción de forraje de varios potreros en un solo cálculo vectorizado.
+
+    `paddocks` es { id: (anillos, resultado de /api/ndvi/, parámetros) } con los parámetros
+    "recurso_forrajero", "presencia_leñosas" y "porcentaje_leñosas". El NDVI se interpola a
+    diario, se convierte en fPAR y se combina con la PAR y la temperatura diarias de
+    nasa_power_data (ver PAR_COLUMN; los resultados deben pedirse con el estadístico
+    PAR_FALLBACK_STATISTIC). Retorna { id: disponibilidad }.
+    """
+    ids = list(paddocks)
+    results = [paddocks[feature_id][1] for feature_id in ids]
+    dates, obs_days, obs_values, par, temperature = stack_inputs(results, start_date, end_date)
+
+    parameters = [paddocks[feature_id][2] for feature_id in ids]
+    resources = [FORAGE_RESOURCES[p['recurso_forrajero']] for p in parameters]
+    eur = np.array([
+        resource_eur(p['recurso_forrajero'], result["ndvi_data"].get("regions") or [])
+        for p, result in zip(parameters, results)
+    ])[:, None]
+    t_base = np.array([resource['t_base'] for resource in resources])[:, None]
+    t_opt = np.array([resource['t_opt'] for resource in resources])[:, None]
+    woody = np.array([
+        p['porcentaje_leñosas'] / 100.0 if p['presencia_leñosas'] else 0.0 for p in parameters
+    ])[:, None]
+
+    ndvi = interpolate_daily(obs_days, obs_values, len(dates))
+    fpar = fpar_from_ndvi(ndvi)
+    growth = forage_growth(ndvi, par, temperature, eur, t_base, t_opt, woody)
+    totals = np.nansum(growth, axis=1)
+    missing = np.isnan(growth).sum(axis=1)
+
+    fechas = [day.isoformat() for day in dates.tolist()]
+    availability = {}
+    for row, feature_id in enumerate(ids):
+        hectares = geodesic_area(paddocks[feature_id][0]) / 10_000
+        availability[feature_id] = {
+            **parameters[row],
+            "eur": round(float(eur[row, 0]), 4),
+            "superficie_ha": round(hectares, 2),
+            "fecha": fechas,
+            "ndvi": to_optional_floats(ndvi[row]),
+            "fpar": to_optional_floats(fpar[row]),
+            "crecimiento_kg_ms_ha_dia": to_optional_floats(growth[row]),
+            "dias_sin_dato": int(missing[row]),
+            "produccion_kg_ms_ha": float(totals[row]),
+            "produccion_kg_ms": float(totals[row] * hectares),
+        }
+    return availability
@@ -0,0 +1,364 @@
+"""
+Operaciones geométricas locales sobre polígonos en longitud/latitud (EPSG:4326).
+
+Los polígonos se representan como en GeoJSON: una lista de anillos, donde el primero es
+el borde exterior y el resto son huecos, y cada anillo es una lista de [longitud, latitud].
+"""
+import hashlib
+import json
+import math
+import re
+
+# Radio de la esfera usada para áreas y proyecciones (el mismo que usa Leaflet.draw)
+EARTH_RADIUS = 6378137.0
+
+# Vértices como máximo que se aceptan del cliente. La validación y Douglas-Peucker corren en
+# el hilo del pedido y en el peor caso son cuadráticos, así que no conviene subirlo mucho
+MAX_INPUT_VERTICES = 5000
+# Vértices como máximo que se envían a Earth Engine después de simplificar
+MAX_VERTICES = 500
+# Tolerancia inicial de la simplificación, en metros
+SIMPLIFY_TOLERANCE = 1.0
+# Decimales de las coordenadas usados para identificar un polígono (~0,1 m)
+FINGERPRINT_DECIMALS = 6
+# Área mínima y máxima aceptadas, en metros cuadrados
+MIN_AREA = 100.0
+MAX_AREA = 200000 * 10000.0
+
+
+class GeometryError(ValueError):
+    """El polígono recibido no es válido."""
+
+
+def close_ring(ring):
+    """Retorna el anillo cerrado (último vértice igual al primero)."""
+    ring = [list(vertex) for vertex in ring]
+    if ring and ring[0] != ring[-1]:
+        ring.append(list(ring[0]))
+    return ring
+
+
+def planar_signed_area(ring):
+    """Área con signo de un anillo cerrado en grados² (positiva si es antihorario)."""
+    return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:])) / 2.0
+
+
+def orient(ring, counterclockwise=True):
+    """Retorna el anillo cerrado con la orientación pedida."""
+    if (planar_signed_area(ring) > 0) != counterclockwise:
+        return ring[::-1]
+    return ring
+
+
+def canonical_start(ring):
+    """
+    Rota un anillo cerrado para que empiece en su vértice menor (por longitud y luego latitud).
+    Así dos anillos iguales que sólo difieren en el vértice inicial quedan idénticos.
+    """
+    vertices = ring[:-1]
+    start = vertices.index(min(vertices))
+    vertices = vertices[start:] + vertices[:start]
+    return vertices + [vertices[0]]
+
+
+def ring_geodesic_area(ring):
+    """Área de un anillo cerrado sobre la esfera, en metros cuadrados."""
+    total = 0.0
+    for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:]):
+        total += math.radians(lon2 - lon1) * (2 + math.sin(math.radians(lat1)) + math.sin(math.radians(lat2)))
+    return abs(total) * EARTH_RADIUS ** 2 / 2.0
+
+
+def geodesic_area(rings):
+    """Área de un polígono (borde exterior menos huecos), en metros cuadrados."""
+    area = ring_geodesic_area(rings[0])
+    for hole in rings[1:]:
+        area -= ring_geodesic_area(hole)
+    return area
+
+
+class LocalProjection:
+    """Proyección azimutal equivalente de Lambert centrada en un punto, en metros."""
+
+    def __init__(self, longitud, latitud):
+        self.lon0 = math.radians(longitud)
+        self.lat0 = math.radians(latitud)
+        self.sin_lat0 = math.sin(self.lat0)
+        self.cos_lat0 = math.cos(self.lat0)
+
+    def forward(self, longitud, latitud):
+        lon = math.radians(longitud) - self.lon0
+        lat = math.radians(latitud)
+        cos_c = self.sin_lat0 * math.sin(lat) + self.cos_lat0 * math.cos(lat) * math.cos(lon)
+        k = math.sqrt(2 / (1 + cos_c))
+        x = EARTH_RADIUS * k * math.cos(lat) * math.sin(lon)
+        y = EARTH_RADIUS * k * (self.cos_lat0 * math.sin(lat) - self.sin_lat0 * math.cos(lat) * math.cos(lon))
+        return x, y
+
+    def inverse(self, x, y):
+        rho = math.hypot(x, y)
+        if rho == 0:
+            return math.degrees(self.lon0), math.degrees(self.lat0)
+        c = 2 * math.asin(rho / (2 * EARTH_RADIUS))
+        lat = math.asin(math.cos(c) * self.sin_lat0 + y * math.sin(c) * self.cos_lat0 / rho)
+        lon = self.lon0 + math.atan2(x * math.sin(c), rho * self.cos_lat0 * math.cos(c) - y * self.sin_lat0 * math.sin(c))
+        return math.degrees(lon), math.degrees(lat)
+
+
+def projection_for(rings):
+    """Proyección local centrada en el promedio de los vértices del borde exterior."""
+    exterior = rings[0][:-1] or rings[0]
+    longitud = sum(vertex[0] for vertex in exterior) / len(exterior)
+    latitud = sum(vertex[1] for vertex in exterior) / len(exterior)
+    return LocalProjection(longitud, latitud)
+
+
+def centroid(rings):
+    """
+    Centroide de un polígono, calculado en una proyección equivalente centrada en el polígono
+    para que cada parte pese según su área real. Retorna [longitud, latitud].
+    """
+    projection = projection_for(rings)
+    area_sum = cx_sum = cy_sum = 0.0
+    for index, ring in enumerate(rings):
+        points = [projection.forward(lon, lat) for lon, lat in ring]
+        area = cx = cy = 0.0
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            cross = x1 * y2 - x2 * y1
+            area += cross
+            cx += (x1 + x2) * cross
+            cy += (y1 + y2) * cross
+        # Los huecos restan sin importar su orientación
+        sign = 1.0 if index == 0 else -1.0
+        if area < 0:
+            area, cx, cy = -area, -cx, -cy
+        area_sum += sign * area / 2.0
+        cx_sum += sign * cx / 6.0
+        cy_sum += sign * cy / 6.0
+    if area_sum == 0:
+        raise GeometryError("El polígono no tiene área.")
+    return list(projection.inverse(cx_sum / area_sum, cy_sum / area_sum))
+
+
+def perimeter(rings):
+    """Largo de todos los bordes (exterior y huecos) en la proyección local, en metros."""
+    projection = projection_for(rings)
+    total = 0.0
+    for ring in rings:
+        points = [projection.forward(lon, lat) for lon, lat in ring]
+        total += sum(math.hypot(x2 - x1, y2 - y1) for (x1, y1), (x2, y2) in zip(points, points[1:]))
+    return total
+
+
+def _douglas_peucker(points, tolerance):
+    """Índices de los puntos que conserva Douglas-Peucker sobre una línea abierta."""
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        max_distance, max_index = 0.0, None
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length == 0:
+                distance = math.hypot(x - x1, y - y1)
+            else:
+                distance = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / length
+            if distance > max_distance:
+                max_distance, max_index = distance, i
+        if max_index is not None and max_distance > tolerance:
+            keep[max_index] = True
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+    return [i for i, kept in enumerate(keep) if kept]
+
+
+def simplify_ring(ring, projection, tolerance=SIMPLIFY_TOLERANCE, max_vertices=MAX_VERTICES):
+    """
+    Simplifica un anillo cerrado con Douglas-Peucker sobre coordenadas proyectadas (metros).
+    Si quedan más de `max_vertices` vértices, se duplica la tolerancia hasta cumplirlo.
+    """
+    points = [projection.forward(lon, lat) for lon, lat in ring]
+    while True:
+        indices = _douglas_peucker(points, tolerance)
+        if len(indices) <= max_vertices + 1 or len(indices) <= 4:
+            return [ring[i] for i in indices]
+        tolerance *= 2
+
+
+def _segments_cross(a, b, c, d):
+    """Indica si los segmentos ab y cd se cortan (incluye toques y solapamientos)."""
+    def side(p, q, r):
+        value = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+        return (value > 0) - (value < 0)
+
+    def within(p, q, r):
+        return min(p[0], q[0]) <= r[0] <= max(p[0], q[0]) and min(p[1], q[1]) <= r[1] <= max(p[1], q[1])
+
+    s1, s2, s3, s4 = side(a, b, c), side(a, b, d), side(c, d, a), side(c, d, b)
+    if s1 != s2 and s3 != s4 and 0 not in (s1, s2, s3, s4):
+        return True
+    return (
+        (s1 == 0 and within(a, b, c)) or (s2 == 0 and within(a, b, d))
+        or (s3 == 0 and within(c, d, a)) or (s4 == 0 and within(c, d, b))
+    )
+
+
+def _ring_segments(ring, tag=0):
+    return [(min(p[0], q[0]), max(p[0], q[0]), tag, i, p, q) for i, (p, q) in enumerate(zip(ring, ring[1:]))]
+
+
+def _any_crossing(segments, skip):
+    """
+    Indica si algún par de segmentos se corta, salvo los pares para los que `skip` da verdadero.
+    Los segmentos se ordenan por su x mínima y sólo se comparan los que se solapan en x.
+    """
+    segments = sorted(segments, key=lambda segment: segment[0])
+    for n, (_, xmax, tag, i, a, b) in enumerate(segments):
+        for xmin_other, _, other_tag, j, c, d in segments[n + 1:]:
+            if xmin_other > xmax:
+                break
+            if skip(tag, i, other_tag, j):
+                continue
+            if _segments_cross(a, b, c, d):
+                return True
+    return False
+
+
+def self_intersects(ring):
+    """Indica si un anillo cerrado se corta a sí mismo."""
+    count = len(ring) - 1
+    # Los segmentos consecutivos comparten un vértice
+    return _any_crossing(
+        _ring_segments(ring), lambda tag, i, other_tag, j: abs(i - j) == 1 or abs(i - j) == count - 1
+    )
+
+
+def rings_cross(rings):
+    """Indica si dos anillos distintos se cortan o se tocan."""
+    segments = [segment for tag, ring in enumerate(rings) for segment in _ring_segments(ring, tag)]
+    return _any_crossing(segments, lambda tag, i, other_tag, j: tag == other_tag)
+
+
+def point_in_ring(point, ring):
+    """Indica si el punto está dentro del anillo cerrado (regla par-impar)."""
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def ring_problem(rings):
+    """
+    Por qué los anillos no forman un polígono válido, o None si lo forman: ningún anillo se
+    corta a sí mismo, los anillos no se tocan entre sí y los huecos están dentro del borde
+    exterior (como no se cortan, alcanza con mirar un vértice de cada hueco).
+    """
+    if any(len(ring) < 4 or self_intersects(ring) for ring in rings):
+        return "El polígono se corta a sí mismo o no tiene área."
+    if len(rings) > 1:
+        if rings_cross(rings):
+            return "Los huecos no pueden tocar el borde exterior ni a otros huecos."
+        if not all(point_in_ring(hole[0], rings[0]) for hole in rings[1:]):
+            return "Los huecos deben estar dentro del borde exterior."
+    return None
+
+
+def _clean_ring(ring):
+    if not isinstance(ring, (list, tuple)):
+        raise GeometryError("Cada anillo debe ser una lista de vértices.")
+    cleaned = []
+    for vertex in ring:
+        if not isinstance(vertex, (list, tuple)) or len(vertex) < 2:
+            raise GeometryError("Cada vértice debe tener longitud y latitud.")
+        longitud, latitud = float(vertex[0]), float(vertex[1])
+        if not (math.isfinite(longitud) and math.isfinite(latitud)):
+            raise GeometryError("Las coordenadas deben ser números finitos.")
+        if not (-180 <= longitud <= 180 and -90 <= latitud <= 90):
+            raise GeometryError("Las coordenadas deben estar en grados de longitud y latitud.")
+        # Se descartan los vértices repetidos consecutivos
+        if not cleaned or cleaned[-1] != [longitud, latitud]:
+            cleaned.append([longitud, latitud])
+    ring = close_ring(cleaned)
+    if len(ring) < 4:
+        raise GeometryError("Cada anillo necesita al menos tres vértices distintos.")
+    return ring
+
+
+def normalize_polygon(rings):
+    """
+    Valida y normaliza un polígono recibido del cliente:
+      - cierra los anillos y descarta vértices repetidos,
+      - orienta el borde exterior en sentido antihorario y los huecos en sentido horario (RFC 7946),
+        y hace empezar cada anillo en su vértice menor,
+      - verifica que sea válido tal como llegó (ver ring_problem),
+      - simplifica los anillos a lo sumo a MAX_VERTICES vértices y vuelve a verificarlo; si la
+        simplificación lo invalida se usan los anillos sin simplificar, si no pasan el límite,
+      - verifica que su área esté entre MIN_AREA y MAX_AREA.
+
+    Retorna la lista de anillos normalizada o lanza GeometryError.
+    """
+    if not rings:
+        raise GeometryError("El polígono no tiene coordenadas.")
+    if sum(len(ring) for ring in rings) > MAX_INPUT_VERTICES:
+        raise GeometryError(f"El polígono tiene más de {MAX_INPUT_VERTICES} vértices.")
+    rings = [_clean_ring(ring) for ring in rings]
+    rings = [canonical_start(orient(ring, counterclockwise=index == 0)) for index, ring in enumerate(rings)]
+    problem = ring_problem(rings)
+    if problem:
+        raise GeometryError(problem)
+
+    projection = projection_for(rings)
+    normalized = [simplify_ring(ring, projection) for ring in rings]
+    if ring_problem(normalized):
+        if any(len(ring) > MAX_VERTICES + 1 for ring in rings):
+            raise GeometryError(
+                f"El polígono no se puede simplificar a {MAX_VERTICES} vértices sin que se corte; "
+                "envíelo con menos vértices."
+            )
+        normalized = rings
+    area = geodesic_area(normalized)
+    if area < MIN_AREA:
+        raise GeometryError(f"El polígono es demasiado chico (mínimo {MIN_AREA / 10000:g} ha).")
+    if area > MAX_AREA:
+        raise GeometryError(f"El polígono es demasiado grande (máximo {MAX_AREA / 10000:g} ha).")
+    return normalized
+
+
+WKT_POLYGON = re.compile(r'^\s*POLYGON\s*Z?\s*\((.*)\)\s*$', re.IGNORECASE | re.DOTALL)
+WKT_RING = re.compile(r'\(([^()]*)\)')
+
+
+def parse_wkt_polygon(text):
+    """Anillos [[lon, lat], ...] de un POLYGON en WKT (se ignora la coordenada Z)."""
+    match = WKT_POLYGON.match(text or '')
+    if match is None:
+        raise GeometryError("La geometría debe ser un POLYGON en WKT.")
+    try:
+        rings = [
+            [[float(value) for value in point.split()[:2]] for point in ring.split(',')]
+            for ring in WKT_RING.findall(match.group(1))
+        ]
+    except ValueError:
+        raise GeometryError("Coordenadas inválidas en el WKT.")
+    if not rings or any(len(point) != 2 for ring in rings for point in ring):
+        raise GeometryError("Coordenadas inválidas en el WKT.")
+    return rings
+
+
+def fingerprint(rings):
+    """
+    Identificador estable de un polígono: no depende del vértice inicial ni del sentido de
+    los anillos, ni del orden de los huecos. Las coordenadas se redondean a FINGERPRINT_DECIMALS.
+    """
+    canonical = []
+    for index, ring in enumerate(rings):
+        ring = [[round(lon, FINGERPRINT_DECIMALS), round(lat, FINGERPRINT_DECIMALS)] for lon, lat in close_ring(ring)]
+        canonical.append(canonical_start(orient(ring, counterclockwise=index == 0)))
+    canonical = canonical[:1] + sorted(canonical[1:])
+    return hashlib.sha256(json.dumps(canonical).encode()).hexdigest()
@@ -0,0 +1,42 @@
+"""
+Funciones que corren en los procesos del pool de process_inventory.
+
+El pool usa spawn, así que cada proceso importa este módulo antes de que init_worker prepare
+Django: acá no se importa nada de api a nivel de módulo (api.serializer, por ejemplo, carga los
+modelos y fallaría con AppRegistryNotReady).
+"""
+
+
+def init_worker(ee_concurrency, setup=None):
+    """
+    Prepara Django en cada proceso del pool. `setup` es una función (importable sin Django)
+    que se corre después; las pruebas la usan para instalar los dobles de GEE y POWER.
+    """
+    import django
+
+    django.setup()
+
+    from django.conf import settings
+
+    settings.EE_MAX_CONCURRENT = ee_concurrency
+    if setup is not None:
+        setup()
+
+
+def process_paddock(feature_id, rings, start_date, end_date, statistics):
+    """
+    Resultado de /api/ndvi/ de un potrero. Comparte la caché de respuestas y las observaciones
+    guardadas con la API, así que lo ya consultado no se vuelve a pedir a Earth Engine.
+    """
+    from . import metrics, response_cache
+    from .pipeline import run_ndvi_pipeline
+
+    key = response_cache.cache_key(rings, start_date, end_date, estadisticas=statistics)
+    cached = response_cache.get_response(key)
+    if cached is not None:
+        result = cached[0]
+    else:
+        result = run_ndvi_pipeline(rings, start_date, end_date, statistics)
+        response_cache.set_response(key, result, end_date)
+    metrics.flush()
+    return feature_id, result
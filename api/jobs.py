@@ -0,0 +1,130 @@
+import traceback
+from datetime import date, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import response_cache
+from .models import Job
+from .power_client import PowerRequestError
+
+# Un trabajo en curso que no da señales durante LEASE se considera abandonado (por ejemplo,
+# porque se reinició el worker) y vuelve a la cola
+LEASE = timedelta(minutes=2)
+# Intentos como máximo antes de marcar un trabajo como fallido
+MAX_ATTEMPTS = 3
+# Espera antes de reintentar un trabajo que falló; se duplica en cada intento
+RETRY_BACKOFF = timedelta(seconds=30)
+
+ACTIVE_STATUSES = [Job.PENDING, Job.RUNNING]
+
+
+def find_reusable_job(key):
+    """
+    Retorna un trabajo equivalente que se puede reutilizar: uno pendiente o en curso, o uno
+    terminado cuyo resultado sigue vigente en la caché de respuestas.
+    """
+    job = Job.objects.filter(key=key, status__in=ACTIVE_STATUSES).first()
+    if job is None and response_cache.get_response(key) is not None:
+        job = Job.objects.filter(key=key, status=Job.DONE).order_by('-finished_at').first()
+    return job
+
+
+def submit_job(coordinates, start_date, end_date, statistics=()):
+    """
+    Encola una consulta. Retorna (trabajo, creado), reutilizando uno idéntico si existe. Las
+    fechas tienen que venir validadas (YYYY-MM-DD, ver serializer.DateRangeSerializer): un
+    trabajo con fechas inválidas fallaría en todos sus intentos. Lanza ValueError si no lo son.
+    """
+    if date.fromisoformat(end_date) < date.fromisoformat(start_date):
+        raise ValueError("end_date debe ser igual o posterior a start_date.")
+    key = response_cache.cache_key(coordinates, start_date, end_date, estadisticas=list(statistics))
+    request = {
+        'coordinates': coordinates,
+        'start_date': start_date,
+        'end_date': end_date,
+        'estadisticas': list(statistics),
+    }
+    while True:
+        job = find_reusable_job(key)
+        if job is not None:
+            return job, False
+        try:
+            with transaction.atomic():
+                return Job.objects.create(key=key, request=request), True
+        except IntegrityError:
+            # Otro pedido idéntico lo encoló al mismo tiempo; se vuelve a buscar, porque puede
+            # que ya haya terminado (o fallado, y entonces se encola de nuevo)
+            continue
+
+
+def requeue_stale_jobs():
+    """Devuelve a la cola los trabajos abandonados, o los marca como fallidos si agotaron los intentos."""
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - LEASE)
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=Job.FAILED, error="El trabajo se interrumpió demasiadas veces.", finished_at=now
+    )
+    return stale.update(status=Job.PENDING)
+
+
+def retry_delay(attempts):
+    """Espera antes del próximo intento de un trabajo que ya falló `attempts` veces."""
+    return RETRY_BACKOFF * 2 ** (attempts - 1)
+
+
+def claim_next_job():
+    """
+    Toma el trabajo pendiente más antiguo que ya se puede reintentar. La actualización
+    condicional evita que dos workers tomen el mismo.
+    """
+    ready = Q(not_before__isnull=True) | Q(not_before__lte=timezone.now())
+    for job_id in Job.objects.filter(ready, status=Job.PENDING).values_list('id', flat=True)[:20]:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def has_pending_jobs():
+    """Si queda algún trabajo pendiente, aunque todavía esté esperando para reintentarse."""
+    return Job.objects.filter(status=Job.PENDING).exists()
+
+
+def heartbeat(job_ids):
+    """Renueva el latido de los trabajos en curso de este worker."""
+    Job.objects.filter(pk__in=list(job_ids), status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def run_job(job):
+    """Ejecuta un trabajo ya tomado y guarda su resultado (también en la caché de respuestas)."""
+    from .pipeline import run_ndvi_pipeline
+
+    def progress(stage, percent):
+        Job.objects.filter(pk=job.pk).update(stage=stage, progress=percent, heartbeat_at=timezone.now())
+
+    request = job.request
+    try:
+        result = run_ndvi_pipeline(
+            request['coordinates'], request['start_date'], request['end_date'],
+            request['estadisticas'], progress=progress,
+        )
+    except Exception as e:
+        # Si POWER rechazó la consulta, reintentarla no sirve
+        failed = job.attempts >= MAX_ATTEMPTS or isinstance(e, PowerRequestError)
+        now = timezone.now()
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED if failed else Job.PENDING,
+            error=traceback.format_exc(),
+            finished_at=now if failed else None,
+            not_before=None if failed else now + retry_delay(job.attempts),
+        )
+        return
+    response_cache.set_response(job.key, result, request['end_date'])
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE, stage="listo", progress=100, result=result, error="", finished_at=timezone.now()
+    )
@@ -0,0 +1,64 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import compare, run_benchmark
+
+
+def load_json(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError) as e:
+        raise CommandError(f"No se pudo leer {path}: {e}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide /api/ndvi/ sin conexión: Earth Engine y NASA POWER se reemplazan por dobles locales "
+        "con la latencia indicada, y la base y las cachés se crean en una carpeta temporal. "
+        "Informa latencias p50/p95/p99, pedidos por segundo y llamadas a los servicios externos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Pedidos medidos.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Pedidos simultáneos.")
+        parser.add_argument('--distinct', type=int, default=10, help="Polígonos distintos entre los que se rota.")
+        parser.add_argument('--start-date', default='2024-01-01')
+        parser.add_argument('--end-date', default='2024-09-30')
+        parser.add_argument('--warmup', type=int, default=0, help="Pedidos previos sin medir (llenan las cachés).")
+        parser.add_argument('--ee-latency', type=float, default=0.5, help="Segundos por consulta a GEE.")
+        parser.add_argument('--ee-jitter', type=float, default=0.0, help="Desvío estándar de la latencia de GEE.")
+        parser.add_argument('--power-latency', type=float, default=0.2, help="Segundos por consulta a POWER.")
+        parser.add_argument('--ee-fixture', help="Respuestas de GEE grabadas (ver benchmark.record_ee_fixture).")
+        parser.add_argument('--power-fixture', help="Respuesta de POWER grabada (JSON del endpoint diario).")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Archivo donde guardar los resultados en JSON.")
+        parser.add_argument('--compare', help="Resultados de una corrida anterior para comparar.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['distinct'] < 1:
+            raise CommandError("--requests, --concurrency y --distinct deben ser mayores que cero.")
+        previous = load_json(options['compare']) if options['compare'] else None
+
+        results = run_benchmark(
+            requests=options['requests'],
+            concurrency=options['concurrency'],
+            distinct=options['distinct'],
+            start_date=options['start_date'],
+            end_date=options['end_date'],
+            ee_fixture=load_json(options['ee_fixture']) if options['ee_fixture'] else None,
+            ee_latency=options['ee_latency'],
+            ee_jitter=options['ee_jitter'],
+            power_fixture=load_json(options['power_fixture']) if options['power_fixture'] else None,
+            power_latency=options['power_latency'],
+            warmup=options['warmup'],
+            seed=options['seed'],
+        )
+        if previous is not None:
+            results["comparacion_pct"] = compare(results, previous)
+
+        output = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            Path(options['output']).write_text(output)
+        self.stdout.write(output)
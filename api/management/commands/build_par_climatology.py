@@ -0,0 +1,87 @@
+import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.climatology import STATISTICS, climatology_statistics, history_array
+from api.ndvi_script import POWER_MAX_WORKERS, fetch_power_years, history_years_for, radiation_statistics
+from api.par_climatology import ARGENTINA_BBOX, METADATA_FILE, ParGrid, activate, cell_range, window_name
+from api.power_cache import cell_center
+from api.power_client import PowerRequestError, PowerServiceError
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántas celdas se guardan los avances en disco
+CHECKPOINT_CELLS = 50
+
+
+def cell_statistics(cell, years, statistics, base_url=None):
+    """Estadísticos de radiación de una celda a partir de su historia en POWER (o en la caché)."""
+    longitud, latitud = cell_center(cell)
+    by_year = fetch_power_years(longitud, latitud, years, base_url=base_url)
+    return climatology_statistics(history_array(by_year["ALLSKY_SFC_PAR_TOT"], years), statistics)
+
+
+class Command(BaseCommand):
+    help = (
+        "Precalcula la climatología de radiación (ALLSKY_SFC_PAR_TOT) de los últimos años cerrados "
+        "para todas las celdas de POWER del rectángulo indicado (por defecto, la Argentina). "
+        "Se puede interrumpir y volver a correr: sólo calcula las celdas pendientes. Cuando cierra "
+        "un año nuevo arma la grilla de la ventana siguiente, y de POWER sólo se descarga ese año "
+        "(el resto está en la caché). Conviene correrlo una vez por mes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bbox', type=float, nargs=4, metavar=('OESTE', 'SUR', 'ESTE', 'NORTE'),
+                            default=ARGENTINA_BBOX, help="Rectángulo a cubrir, en grados.")
+        parser.add_argument('--statistics', nargs='+', choices=list(STATISTICS), default=list(STATISTICS),
+                            help="Estadísticos a guardar (el p95 se incluye siempre).")
+        parser.add_argument('--workers', type=int, default=POWER_MAX_WORKERS, help="Celdas simultáneas.")
+        parser.add_argument('--power-url', help="Endpoint diario de POWER a usar en lugar de POWER_BASE_URL "
+                                                "(por ejemplo, un servidor local de prueba).")
+        parser.add_argument('--output', default=None, help="Carpeta destino (por defecto PAR_CLIMATOLOGY_DIR).")
+
+    def handle(self, *args, **options):
+        root = Path(options['output'] or settings.PAR_CLIMATOLOGY_DIR)
+        years = history_years_for()
+        statistics = radiation_statistics(options['statistics'])
+        grid = self.open_grid(root / window_name(years), options['bbox'], years, statistics)
+
+        pending = grid.pending()
+        self.stdout.write(
+            f"Años {years[0]}-{years[-1]}: {len(pending)} de {grid.rows * grid.columns} celdas por calcular"
+        )
+        failed = 0
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+                futures = {pool.submit(cell_statistics, cell, years, statistics, options['power_url']): cell for cell in pending}
+                for count, future in enumerate(as_completed(futures), 1):
+                    cell = futures[future]
+                    try:
+                        grid.put(cell, future.result())
+                    except (PowerServiceError, PowerRequestError) as e:
+                        failed += 1
+                        logger.warning("No se pudo calcular la celda %s: %s", cell, e)
+                    if count % CHECKPOINT_CELLS == 0:
+                        grid.flush()
+                        self.stdout.write(f"{count} de {len(pending)} celdas")
+        finally:
+            grid.flush()
+
+        if failed:
+            raise CommandError(f"Fallaron {failed} celdas; vuelva a correr el comando para completarlas.")
+        activate(root, years)
+        self.stdout.write(self.style.SUCCESS(f"Climatología {window_name(years)} publicada en {root}"))
+
+    def open_grid(self, directory, bbox, years, statistics):
+        """Retoma la grilla de la ventana si ya se empezó con la misma configuración, o la crea."""
+        if (directory / METADATA_FILE).exists():
+            grid = ParGrid(directory, mode='r+')
+            if grid.statistics == tuple(statistics) and (grid.col0, grid.row0, grid.columns, grid.rows) == cell_range(bbox):
+                return grid
+            del grid
+            shutil.rmtree(directory)
+        return ParGrid.create(directory, bbox, years, statistics)
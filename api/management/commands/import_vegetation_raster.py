@@ -0,0 +1,83 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.vegetation_index import DEFAULT_TILE_SIZE, write_index
+
+
+class RasterioRows:
+    """Lee un GeoTIFF de a filas, con la misma interfaz (shape y [inicio:fin]) que un arreglo."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = (dataset.height, dataset.width)
+
+    def __getitem__(self, rows):
+        from rasterio.windows import Window
+
+        start, stop, _ = rows.indices(self.shape[0])
+        return self.dataset.read(1, window=Window(0, start, self.shape[1], stop - start))
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa el ráster de unidades de vegetación (Raster_UV exportado de GEE en EPSG:4326) "
+        "como un índice local en teselas, para calcular los histogramas sin consultar a GEE. "
+        "Acepta un GeoTIFF (requiere rasterio) o un arreglo .npy con --origin y --pixel-size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="GeoTIFF o .npy con los códigos de clase.")
+        parser.add_argument('--origin', type=float, nargs=2, metavar=('LON', 'LAT'),
+                            help="Esquina noroeste del .npy, en grados.")
+        parser.add_argument('--pixel-size', type=float, nargs='+', metavar='GRADOS',
+                            help="Tamaño del píxel del .npy en grados (ancho y, opcionalmente, alto).")
+        parser.add_argument('--nodata', type=int, default=None, help="Código sin dato (por defecto el del GeoTIFF o 0).")
+        parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help="Lado de las teselas en píxeles.")
+        parser.add_argument('--output', default=None, help="Carpeta destino (por defecto VEGETATION_INDEX_DIR).")
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.VEGETATION_INDEX_DIR
+        path = options['path']
+        if path.endswith('.npy'):
+            classes, origin, pixel_size, nodata = self.load_npy(path, options)
+        else:
+            dataset = self.open_geotiff(path)
+            transform = dataset.transform
+            classes = RasterioRows(dataset)
+            origin = (transform.c, transform.f)
+            pixel_size = (transform.a, -transform.e)
+            nodata = dataset.nodata
+
+        if options['nodata'] is not None:
+            nodata = options['nodata']
+        nodata = 0 if nodata is None else int(nodata)
+        try:
+            write_index(output, classes, origin, pixel_size, nodata=nodata, tile_size=options['tile_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        height, width = classes.shape
+        self.stdout.write(self.style.SUCCESS(f"Índice de {width} × {height} píxeles guardado en {output}"))
+
+    def load_npy(self, path, options):
+        if options['origin'] is None or options['pixel_size'] is None:
+            raise CommandError("Para un .npy hay que indicar --origin y --pixel-size.")
+        classes = np.load(path, mmap_mode='r')
+        if classes.ndim != 2 or not np.issubdtype(classes.dtype, np.integer):
+            raise CommandError("El .npy debe ser un arreglo 2D de enteros.")
+        pixel_size = options['pixel_size']
+        return classes, tuple(options['origin']), (pixel_size[0], pixel_size[-1]), None
+
+    def open_geotiff(self, path):
+        try:
+            import rasterio
+        except ImportError:
+            raise CommandError("Para importar un GeoTIFF hace falta rasterio (pip install rasterio).")
+        dataset = rasterio.open(path)
+        if dataset.crs is None or not dataset.crs.is_geographic:
+            raise CommandError("El ráster debe estar en coordenadas geográficas (EPSG:4326).")
+        if dataset.transform.b or dataset.transform.d:
+            raise CommandError("El ráster no puede estar rotado.")
+        if not np.issubdtype(np.dtype(dataset.dtypes[0]), np.integer):
+            raise CommandError("El ráster debe tener códigos de clase enteros.")
+        return dataset
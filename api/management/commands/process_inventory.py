@@ -0,0 +1,265 @@
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.climatology import STATISTICS
+from api.geometry import GeometryError, normalize_polygon, parse_wkt_polygon
+from api.inventory_worker import init_worker, process_paddock
+from api.ndvi_script import radiation_column, radiation_statistics
+from api.renderers import NDVI_COLUMNS, daily_rows
+from api.serializer import get_feature_id
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos potreros terminados se guarda una parte del resultado
+CHECKPOINT_PADDOCKS = 50
+PARTS_SUFFIX = '.partes'
+CONFIG_FILE = 'configuracion.json'
+FORMATS = ('csv', 'parquet')
+
+
+def read_inventory(path):
+    """
+    Potreros de un GeoJSON (FeatureCollection de Polygon) o de un CSV con las columnas "id" y
+    "wkt" (POLYGON), como lo exporta QGIS. Retorna ({ id: anillos normalizados }, { id: error }).
+    """
+    if path.suffix.lower() == '.csv':
+        # Los WKT de polígonos con muchos vértices superan el límite por defecto de un campo
+        csv.field_size_limit(2 ** 31 - 1)
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            rows = [{key.strip().lower(): value for key, value in row.items() if key} for row in csv.DictReader(f)]
+        features = [(row.get('id') or str(index), row.get('wkt')) for index, row in enumerate(rows)]
+        parse = parse_wkt_polygon
+    else:
+        with open(path, encoding='utf-8') as f:
+            collection = json.load(f)
+        features = [
+            (get_feature_id(feature, index), feature) for index, feature in enumerate(collection.get('features') or [])
+        ]
+        parse = geojson_rings
+
+    polygons, errors = {}, {}
+    for feature_id, geometry in features:
+        if feature_id in polygons or feature_id in errors:
+            errors[feature_id] = "Hay más de un potrero con este id."
+            continue
+        try:
+            polygons[feature_id] = normalize_polygon(parse(geometry))
+        except GeometryError as e:
+            errors[feature_id] = str(e)
+    for feature_id in errors:
+        polygons.pop(feature_id, None)
+    return polygons, errors
+
+
+def geojson_rings(feature):
+    geometry = feature.get('geometry') or {}
+    if geometry.get('type') != 'Polygon':
+        raise GeometryError("La geometría debe ser de tipo Polygon.")
+    return geometry.get('coordinates')
+
+
+class Output:
+    """
+    Resultado en partes dentro de `<salida>.partes/`: cada parte se escribe completa (a un
+    temporal que después se renombra), así que lo guardado sobrevive a una interrupción.
+    Al terminar, las partes se unen en el archivo final.
+    """
+
+    def __init__(self, path, file_format, columns):
+        self.path = path
+        self.format = file_format
+        self.columns = columns
+        self.directory = path.with_name(path.name + PARTS_SUFFIX)
+
+    def open(self, config):
+        """Crea la carpeta de partes, o la reinicia si era de una corrida con otra configuración."""
+        config_path = self.directory / CONFIG_FILE
+        if config_path.exists():
+            with open(config_path) as f:
+                if json.load(f) == config:
+                    return False
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True)
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+        return True
+
+    def parts(self):
+        return sorted(self.directory.glob(f'parte-*.{self.format}'))
+
+    def done_ids(self):
+        """Ids de los potreros que ya están en alguna parte."""
+        ids = set()
+        for part in self.parts():
+            if self.format == 'csv':
+                with open(part, newline='', encoding='utf-8') as f:
+                    ids.update(row['id'] for row in csv.DictReader(f))
+            else:
+                import pyarrow.parquet as pq
+
+                ids.update(pq.read_table(part, columns=['id']).column('id').to_pylist())
+        return ids
+
+    def write_part(self, rows):
+        path = self.directory / f'parte-{len(self.parts()) + 1:05d}.{self.format}'
+        tmp_path = path.with_name(path.name + '.tmp')
+        if self.format == 'csv':
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=self.columns)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            import pyarrow.parquet as pq
+
+            pq.write_table(self.to_table(rows), tmp_path)
+        os.replace(tmp_path, path)
+
+    def to_table(self, rows):
+        import pyarrow as pa
+
+        types = {'id': pa.string(), 'fecha': pa.date32(), 'unidad_vegetacion': pa.string(), 'escala_m': pa.int32()}
+        return pa.table({
+            name: pa.array([row[name] for row in rows], types.get(name, pa.float64())) for name in self.columns
+        })
+
+    def finish(self):
+        """Une las partes en el archivo final (de a una parte por vez) y borra la carpeta."""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        if self.format == 'csv':
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as out:
+                writer = csv.DictWriter(out, fieldnames=self.columns)
+                writer.writeheader()
+                for part in self.parts():
+                    with open(part, newline='', encoding='utf-8') as f:
+                        writer.writerows(csv.DictReader(f))
+        else:
+            import pyarrow.parquet as pq
+
+            with pq.ParquetWriter(tmp_path, self.to_table([]).schema) as writer:
+                for part in self.parts():
+                    writer.write_table(pq.read_table(part))
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.directory)
+
+
+def paddock_rows(feature_id, result, power_names):
+    """Filas de un potrero en la salida: una por día, con su unidad de vegetación y escala."""
+    ndvi_data = result["ndvi_data"]
+    unit = (ndvi_data.get("dominant_region") or {}).get("name")
+    for row in daily_rows(result, power_names):
+        yield {"id": feature_id, **row, "unidad_vegetacion": unit, "escala_m": ndvi_data.get("escala_m")}
+
+
+class Command(BaseCommand):
+    help = (
+        "Calcula NDVI, unidad de vegetación y clima de todos los potreros de un inventario "
+        "(GeoJSON o CSV con columnas id y wkt) con un pool de procesos, y guarda una fila por "
+        "potrero y día en CSV o Parquet. Las consultas a Earth Engine respetan el límite "
+        "compartido con la API (EE_MAX_CONCURRENT). Si se interrumpe, al volver a correrlo con "
+        "los mismos argumentos sigue con los potreros que faltan."
+    )
+    # Función que cada proceso del pool corre después de django.setup() (ver
+    # inventory_worker.init_worker); las pruebas instalan con ella los dobles de GEE y POWER
+    worker_setup = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('inventory', help="Archivo .geojson/.json o .csv con los potreros.")
+        parser.add_argument('output', help="Archivo de salida .csv o .parquet.")
+        parser.add_argument('--start-date', required=True, help="Primer día (YYYY-MM-DD).")
+        parser.add_argument('--end-date', required=True, help="Último día (YYYY-MM-DD).")
+        parser.add_argument('--statistics', nargs='+', choices=list(STATISTICS), default=[],
+                            help="Estadísticos de radiación adicionales al p95.")
+        parser.add_argument('--format', choices=FORMATS, help="Formato de salida (por defecto, según la extensión).")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="Procesos simultáneos.")
+        parser.add_argument('--ee-concurrency', type=int, default=settings.EE_MAX_CONCURRENT,
+                            help="Evaluaciones de Earth Engine simultáneas entre todos los procesos.")
+
+    def handle(self, *args, **options):
+        inventory, path = Path(options['inventory']), Path(options['output'])
+        file_format = options['format'] or path.suffix.lower().lstrip('.')
+        if file_format not in FORMATS:
+            raise CommandError("Indique --format csv o parquet.")
+        try:
+            start, end = date.fromisoformat(options['start_date']), date.fromisoformat(options['end_date'])
+        except ValueError:
+            raise CommandError("Las fechas deben tener el formato YYYY-MM-DD.")
+        if end < start:
+            raise CommandError("--end-date debe ser igual o posterior a --start-date.")
+        if file_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise CommandError("Para escribir Parquet hace falta instalar pyarrow.")
+
+        polygons, invalid = read_inventory(inventory)
+        for feature_id, error in invalid.items():
+            logger.warning("Se omite el potrero %s: %s", feature_id, error)
+        statistics = options['statistics']
+        power_names = ['temperatura'] + [radiation_column(name) for name in radiation_statistics(statistics)]
+        output = Output(path, file_format, ['id', *NDVI_COLUMNS, *power_names, 'unidad_vegetacion', 'escala_m'])
+        config = {
+            'inventario': str(inventory.resolve()),
+            'desde': options['start_date'],
+            'hasta': options['end_date'],
+            'estadisticas': statistics,
+        }
+        if not output.open(config):
+            self.stdout.write(f"Retomando la corrida en {output.directory}")
+
+        done = output.done_ids()
+        pending = {feature_id: rings for feature_id, rings in polygons.items() if feature_id not in done}
+        self.stdout.write(
+            f"{len(pending)} de {len(polygons)} potreros por calcular ({len(invalid)} con geometría inválida)"
+        )
+        failed = self.run(pending, output, power_names, options)
+        if failed:
+            raise CommandError(f"Fallaron {failed} potreros; vuelva a correr el comando para completarlos.")
+        output.finish()
+        self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {path}"))
+
+    def run(self, pending, output, power_names, options):
+        """Calcula los potreros pendientes y guarda una parte cada CHECKPOINT_PADDOCKS. Retorna las fallas."""
+        rows, buffered, failed = [], 0, 0
+        # spawn: cada proceso arranca limpio, sin heredar conexiones ni hilos del principal
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(
+            max_workers=max(1, options['workers']), mp_context=context,
+            initializer=init_worker, initargs=(options['ee_concurrency'], self.worker_setup),
+        )
+        try:
+            futures = {
+                pool.submit(process_paddock, feature_id, rings, options['start_date'], options['end_date'],
+                            options['statistics']): feature_id
+                for feature_id, rings in pending.items()
+            }
+            for count, future in enumerate(as_completed(futures), 1):
+                try:
+                    feature_id, result = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.warning("No se pudo calcular el potrero %s: %s", futures[future], e)
+                    continue
+                rows.extend(paddock_rows(feature_id, result, power_names))
+                buffered += 1
+                if buffered >= CHECKPOINT_PADDOCKS:
+                    output.write_part(rows)
+                    rows, buffered = [], 0
+                    self.stdout.write(f"{count} de {len(pending)} potreros")
+        except KeyboardInterrupt:
+            self.stdout.write("Interrumpido: se guardan los potreros terminados")
+            raise
+        finally:
+            if buffered:
+                output.write_part(rows)
+            pool.shutdown(wait=False, cancel_futures=True)
+        return failed
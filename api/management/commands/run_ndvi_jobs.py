@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import metrics
+from api.jobs import LEASE, claim_next_job, has_pending_jobs, heartbeat, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Procesa los trabajos de NDVI encolados con un pool acotado de hilos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Trabajos simultáneos como máximo.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Segundos entre consultas a la cola.")
+        parser.add_argument('--once', action='store_true', help="Termina cuando no quedan trabajos pendientes.")
+
+    def run(self, job):
+        try:
+            run_job(job)
+        finally:
+            # Cada hilo usa su propia conexión a la base
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        running = {}
+        last_beat = 0.0
+        self.stdout.write(f"Procesando trabajos con {workers} hilos")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                while True:
+                    for future in [future for future in running if future.done()]:
+                        running.pop(future)
+                    metrics.flush()
+                    if time.monotonic() - last_beat > LEASE.total_seconds() / 4:
+                        heartbeat(running.values())
+                        requeue_stale_jobs()
+                        last_beat = time.monotonic()
+
+                    job = claim_next_job() if len(running) < workers else None
+                    if job is not None:
+                        self.stdout.write(f"Trabajo {job.pk} (intento {job.attempts})")
+                        running[pool.submit(self.run, job)] = job.pk
+                        continue
+                    if options['once'] and not running and not has_pending_jobs():
+                        break
+                    time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                # Los trabajos que queden en curso vuelven a la cola cuando vence su latido
+                self.stdout.write("Deteniendo: se esperan los trabajos en curso")
+        metrics.flush(force=True)
@@ -0,0 +1,287 @@
+import contextvars
+import hmac
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+# Límites (en segundos) de los buckets de los histogramas de latencia
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Cada proceso vuelca sus métricas a METRICS_DIR como mucho cada FLUSH_INTERVAL segundos
+FLUSH_INTERVAL = 5
+
+METRICS = {
+    'ndvi_stage_seconds': ('histogram', "Duración de cada etapa del pipeline."),
+    'ndvi_http_request_seconds': ('histogram', "Duración de los pedidos HTTP por vista."),
+    'ndvi_upstream_calls_total': ('counter', "Llamadas a servicios externos por resultado."),
+    'ndvi_errors_total': ('counter', "Errores por etapa."),
+    'ndvi_cache_requests_total': ('counter', "Consultas a las cachés por resultado (hit o miss)."),
+}
+
+# Tiempos de las etapas del pedido en curso, para el encabezado Server-Timing
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Registry:
+    """Contadores e histogramas del proceso, con etiquetas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, amount=1, **labels):
+        key = self.key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, dict(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+
+registry = Registry()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def count_cache(cache, hit, amount=1):
+    registry.inc('ndvi_cache_requests_total', amount, cache=cache, result='hit' if hit else 'miss')
+
+
+def count_upstream(service, ok):
+    registry.inc('ndvi_upstream_calls_total', service=service, outcome='ok' if ok else 'error')
+
+
+@contextmanager
+def stage(name):
+    """
+    Mide una etapa: la suma al histograma ndvi_stage_seconds y al Server-Timing del pedido en
+    curso. Si la etapa lanza una excepción se cuenta en ndvi_errors_total.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc('ndvi_errors_total', stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe('ndvi_stage_seconds', elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def submit(pool, function, *args, **kwargs):
+    """pool.submit que conserva el contexto, para que las etapas del hilo cuenten en el pedido."""
+    return pool.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+def server_timing(timings):
+    """Encabezado Server-Timing; las etapas repetidas (tramos, consultas paralelas) se suman."""
+    totals = {}
+    for name, elapsed in timings:
+        duration, count = totals.get(name, (0.0, 0))
+        totals[name] = (duration + elapsed, count + 1)
+    entries = []
+    for name, (duration, count) in totals.items():
+        entry = f"{name};dur={duration * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="{count}"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+def flush(force=False):
+    """Vuelca las métricas del proceso a METRICS_DIR/<pid>.json (como mucho cada FLUSH_INTERVAL)."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    with _flush_lock:
+        _last_flush = now
+        directory = settings.METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+
+def reset():
+    """Borra las métricas volcadas; gunicorn lo llama al arrancar (ver gunicorn.conf.py)."""
+    directory = settings.METRICS_DIR
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith('.json') or filename.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """
+    Suma las métricas volcadas por todos los procesos vivos (workers de gunicorn y
+    run_ndvi_jobs). Los archivos de procesos que ya terminaron se borran.
+    """
+    from .ee_session import process_alive
+
+    flush(force=True)
+    counters, histograms = {}, {}
+    directory = settings.METRICS_DIR
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        pid = filename[:-len('.json')]
+        if pid.isdigit() and not process_alive(int(pid)):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot['counters']:
+            key = Registry.key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = Registry.key(name, labels)
+            current = histograms.get(key)
+            histograms[key] = values if current is None else [a + b for a, b in zip(current, values)]
+    return counters, histograms
+
+
+def format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def render(counters, histograms):
+    """Métricas en el formato de texto de Prometheus."""
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        else:
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(BUCKETS, values):
+                    lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {values[-1]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {values[-2]}")
+                lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+
+    # Proporción de aciertos de cada caché, calculada desde el inicio
+    lines += [
+        "# HELP ndvi_cache_hit_ratio Proporción de consultas a la caché resueltas sin recalcular.",
+        "# TYPE ndvi_cache_hit_ratio gauge",
+    ]
+    totals = {}
+    for (metric, labels), value in counters.items():
+        if metric == 'ndvi_cache_requests_total':
+            labels = dict(labels)
+            hits, total = totals.get(labels['cache'], (0, 0))
+            totals[labels['cache']] = (hits + (value if labels['result'] == 'hit' else 0), total + value)
+    for cache, (hits, total) in sorted(totals.items()):
+        ratio = hits / total if total else math.nan
+        lines.append(f'ndvi_cache_hit_ratio{{cache="{cache}"}} {ratio}')
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Endpoint /metrics para Prometheus. Sólo responde con METRICS_ENABLED y, si está definido
+    METRICS_TOKEN, a los pedidos con "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.strip(), token):
+            response = HttpResponse(status=401)
+            response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+            return response
+    return HttpResponse(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ServerTimingMiddleware:
+    """
+    Mide cada pedido, junta los tiempos de las etapas (ver stage) y los envía en el encabezado
+    Server-Timing. En las respuestas por streaming el encabezado sale antes de que terminen las
+    etapas, así que sólo lleva lo que pasó en la vista. Funciona con vistas síncronas y asíncronas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'otra'
+        registry.observe('ndvi_http_request_seconds', elapsed, view=view, method=request.method)
+        response['Server-Timing'] = server_timing(timings + [('total', elapsed)])
+        flush()
+        return response
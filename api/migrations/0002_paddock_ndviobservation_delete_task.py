@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NDVIObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('ndvi', models.FloatField(null=True)),
+                ('clear_fraction', models.FloatField(null=True)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Paddock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True)),
+                ('coordinates', models.JSONField()),
+                ('covered_from', models.DateField(blank=True, null=True)),
+                ('covered_until', models.DateField(blank=True, null=True)),
+                ('vegetation_units', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='Task',
+        ),
+        migrations.AddField(
+            model_name='ndviobservation',
+            name='paddock',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='api.paddock'),
+        ),
+        migrations.AddConstraint(
+            model_name='ndviobservation',
+            constraint=models.UniqueConstraint(fields=('paddock', 'date'), name='unique_paddock_date'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
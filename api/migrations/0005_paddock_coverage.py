@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+def copy_coverage(apps, schema_editor):
+    Paddock = apps.get_model('api', 'Paddock')
+    for paddock in Paddock.objects.exclude(covered_from=None).exclude(covered_until=None):
+        if paddock.covered_from < paddock.covered_until:
+            paddock.coverage = [[paddock.covered_from.isoformat(), paddock.covered_until.isoformat()]]
+            paddock.save(update_fields=['coverage'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_job_not_before'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paddock',
+            name='coverage',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(copy_coverage, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='paddock',
+            name='covered_from',
+        ),
+        migrations.RemoveField(
+            model_name='paddock',
+            name='covered_until',
+        ),
+    ]
@@ -1,10 +1,89 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 # Create your models here.
-class Task(models.Model):
-    title = models.CharField(max_length=200)
-    description = models.TextField(blank=True)
-    done = models.BooleanField(default=False)
-    
-    def __str__(self): 
-        return self.title
\ No newline at end of file
+class Paddock(models.Model):
+    """
+    Potrero identificado por la huella de su geometría (ver geometry.fingerprint).
+
+    Guarda los tramos de fechas que ya se consultaron a Earth Engine, como lista ordenada de
+    pares ["YYYY-MM-DD", "YYYY-MM-DD"] (fin exclusivo) que no se tocan entre sí, para pedir sólo
+    las fechas que faltan, y las unidades de vegetación, que no cambian.
+    """
+    fingerprint = models.CharField(max_length=64, unique=True)
+    coordinates = models.JSONField()
+    coverage = models.JSONField(default=list, blank=True)
+    vegetation_units = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.fingerprint[:12]
+
+
+class NDVIObservation(models.Model):
+    """NDVI medio de un potrero en un día con suficientes píxeles sin nubes."""
+    paddock = models.ForeignKey(Paddock, on_delete=models.CASCADE, related_name='observations')
+    date = models.DateField()
+    ndvi = models.FloatField(null=True)
+    clear_fraction = models.FloatField(null=True)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['paddock', 'date'], name='unique_paddock_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.paddock} {self.date}"
+
+
+class Job(models.Model):
+    """
+    Consulta a /api/ndvi/ ejecutada en segundo plano (ver api/jobs.py).
+
+    La cola vive en la base de datos del proyecto: los trabajos pendientes sobreviven a los
+    reinicios y `key` permite reutilizar un trabajo idéntico ya enviado.
+    """
+    PENDING = 'pendiente'
+    RUNNING = 'en_curso'
+    DONE = 'terminado'
+    FAILED = 'fallido'
+    STATUS_CHOICES = [
+        (PENDING, 'Pendiente'),
+        (RUNNING, 'En curso'),
+        (DONE, 'Terminado'),
+        (FAILED, 'Fallido'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    key = models.CharField(max_length=80, db_index=True)
+    request = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    stage = models.CharField(max_length=20, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Después de un intento fallido el trabajo no se vuelve a tomar antes de esta hora
+    not_before = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        constraints = [
+            # Un solo trabajo activo por consulta
+            models.UniqueConstraint(
+                fields=['key'],
+                condition=models.Q(status__in=['pendiente', 'en_curso']),
+                name='unique_active_job_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
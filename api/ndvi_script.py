@@ -1,236 +1,315 @@
-import ee
-import json
-from google.oauth2 import service_account
-import os
-import requests
-from datetime import datetime, timedelta
-import numpy as np
-
-def initialize_earth_engine():
-    service_account = 'api-monitoreo-forrajero@proyec2020.iam.gserviceaccount.com'
-    credentials = ee.ServiceAccountCredentials(service_account, '/etc/secrets/GOOGLE_APPLICATION_CREDENTIALS')
-    ee.Initialize(credentials)
-
-# Función para calcular el centroide del polígono
+import asyncio
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics, par_climatology, power_client
+from .climatology import (
+    climatology_statistics, date_axis, history_array, leap_day_index, series_to_array, to_optional_floats,
+)
+from .geometry import centroid
+from .power_cache import cell_center, get_power_cache, last_closed_year, snap_to_cell
+
+
+# Función para calcular el centroide del polígono (localmente, sin consultar a GEE)
 def calculate_centroid(polygon):
-    # Inicializar GEE
-    initialize_earth_engine()
-    
-    ee_polygon = ee.Geometry.Polygon(polygon['coordinates'][0])
-    centroid = ee_polygon.centroid().coordinates().getInfo()
-    return centroid  # [longitude, latitude]
+    return centroid(polygon['coordinates'][0])  # [longitude, latitude]
+
+# --- Consultas a NASA POWER (ver power_client) ---
+POWER_PARAMETERS = ("T2M", "ALLSKY_SFC_PAR_TOT")
+POWER_COMMUNITY = "AG"
+# Valor que usa POWER para los días sin dato
+POWER_FILL_VALUE = -999.0
+# Cantidad máxima de años que se piden en una sola consulta
+POWER_MAX_SPAN_YEARS = 20
+# Consultas simultáneas como máximo por cada llamada a get_nasa_power_data
+POWER_MAX_WORKERS = 4
+# Años cerrados usados para la climatología de radiación
+HISTORICAL_YEARS = 10
+
+
+def plan_power_requests(years, max_span_years=POWER_MAX_SPAN_YEARS):
+    """
+    Agrupa los años necesarios en tramos contiguos para pedirlos a POWER en la menor
+    cantidad de consultas posible. Cada tramo abarca como máximo `max_span_years` años.
+
+    Retorna una lista de tuplas (año_inicio, año_fin), ordenada.
+    """
+    spans = []
+    for year in sorted(set(years)):
+        if spans and year == spans[-1][1] + 1 and year - spans[-1][0] < max_span_years:
+            spans[-1][1] = year
+        else:
+            spans.append([year, year])
+    return [tuple(span) for span in spans]
+
+
+def power_request_params(longitud, latitud, start, end, parameters=POWER_PARAMETERS):
+    """Parámetros de la consulta a POWER entre `start` y `end` (objetos date)."""
+    return {
+        "parameters": ",".join(parameters),
+        "community": POWER_COMMUNITY,
+        "longitude": longitud,
+        "latitude": latitud,
+        "start": start.strftime("%Y%m%d"),
+        "end": end.strftime("%Y%m%d"),
+        "format": "JSON",
+    }
+
+
+def parse_power_response(data, parameters=POWER_PARAMETERS):
+    """Retorna { parámetro: { "YYYYMMDD": valor } } a partir del JSON de POWER, con None en los días sin dato."""
+    data = data.get("properties", {}).get("parameter", {})
+    series = {}
+    for parameter in parameters:
+        series[parameter] = {}
+        for date_str, value in data.get(parameter, {}).items():
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                value = None
+            if value == POWER_FILL_VALUE:
+                value = None
+            series[parameter][date_str] = value
+    return series
+
+
+def fetch_power_span(longitud, latitud, start, end, parameters=POWER_PARAMETERS, base_url=None):
+    """
+    Descarga de POWER los parámetros indicados entre `start` y `end` (objetos date), del
+    endpoint `base_url` (por defecto settings.POWER_BASE_URL).
+
+    Retorna { parámetro: { "YYYYMMDD": valor } }, con None en los días sin dato. Si POWER
+    no responde después de los reintentos lanza power_client.PowerServiceError.
+    """
+    params = power_request_params(longitud, latitud, start, end, parameters)
+    return parse_power_response(power_client.get_json(params, base_url), parameters)
+
+
+async def fetch_power_span_async(client, longitud, latitud, start, end, parameters=POWER_PARAMETERS):
+    """Igual que fetch_power_span, pero con un cliente de power_client.async_client."""
+    params = power_request_params(longitud, latitud, start, end, parameters)
+    return parse_power_response(await power_client.get_json_async(client, params), parameters)
+
+
+def plan_power_years(longitud, latitud, years, today):
+    """
+    Busca en la caché los años pedidos y arma los tramos que faltan descargar.
+
+    Retorna (celda, { parámetro: { año: valores } } con lo que ya está en caché, [(inicio, fin)]).
+    """
+    years = {year for year in years if year <= today.year}
+    cell = snap_to_cell(longitud, latitud)
+    by_year = get_power_cache().get_years(cell, POWER_PARAMETERS, years)
+
+    missing = {year for year in years if any(year not in by_year[p] for p in POWER_PARAMETERS)}
+    metrics.count_cache('power', hit=True, amount=len(years) - len(missing))
+    metrics.count_cache('power', hit=False, amount=len(missing))
+    spans = []
+    for first_year, last_year in plan_power_requests(missing):
+        span_start = datetime(first_year, 1, 1).date()
+        span_end = min(datetime(last_year, 12, 31).date(), today)
+        spans.append((span_start, span_end))
+    return cell, by_year, spans
+
+
+def merge_power_spans(cell, by_year, span_results, today):
+    """Separa por año en memoria los tramos descargados, los guarda en caché y los suma a `by_year`."""
+    fetched = {parameter: {} for parameter in POWER_PARAMETERS}
+    for series in span_results:
+        for parameter, values in series.items():
+            for date_str, value in values.items():
+                fetched[parameter].setdefault(int(date_str[:4]), {})[date_str] = value
+
+    get_power_cache().put_years(cell, fetched, today)
+    for parameter, values in fetched.items():
+        by_year[parameter].update(values)
+    return by_year
+
+
+def fetch_power_years(longitud, latitud, years, today=None, base_url=None):
+    """
+    Obtiene los años completos indicados para todos los parámetros de POWER_PARAMETERS.
+
+    El punto se ajusta al centro de su celda de la grilla de POWER (ver power_cache), de modo
+    que todos los potreros de la misma celda comparten la caché en disco. Sólo se descargan los
+    años que no están en caché: se agrupan con plan_power_requests y los tramos se piden en
+    paralelo con un pool acotado a POWER_MAX_WORKERS hilos. El año en curso se pide sólo hasta hoy.
+    `base_url` es el endpoint de POWER (por defecto settings.POWER_BASE_URL).
+
+    Retorna { parámetro: { año: { "YYYYMMDD": valor } } }.
+    """
+    today = today or datetime.now().date()
+    cell, by_year, spans = plan_power_years(longitud, latitud, years, today)
+    if not spans:
+        return by_year
+
+    cell_longitud, cell_latitud = cell_center(cell)
+    with ThreadPoolExecutor(max_workers=min(POWER_MAX_WORKERS, len(spans))) as pool:
+        futures = [
+            metrics.submit(pool, fetch_power_span, cell_longitud, cell_latitud, s, e, base_url=base_url)
+            for s, e in spans
+        ]
+        span_results = [future.result() for future in futures]
+    return merge_power_spans(cell, by_year, span_results, today)
+
 
-def get_nasa_power_data(centroid, start_date, end_date):
+async def fetch_power_years_async(longitud, latitud, years, today=None):
+    """
+    Igual que fetch_power_years, pero sin bloquear: los tramos se descargan a la vez con
+    httpx y la caché (SQLite) se consulta en un hilo aparte.
+    """
+    today = today or datetime.now().date()
+    cell, by_year, spans = await asyncio.to_thread(plan_power_years, longitud, latitud, years, today)
+    if not spans:
+        return by_year
+
+    cell_longitud, cell_latitud = cell_center(cell)
+    async with power_client.async_client() as client:
+        span_results = await asyncio.gather(*[
+            fetch_power_span_async(client, cell_longitud, cell_latitud, s, e) for s, e in spans
+        ])
+    return await asyncio.to_thread(merge_power_spans, cell, by_year, span_results, today)
+
+
+def history_years_for(today=None):
+    """
+    Años de historia de la climatología: los últimos HISTORICAL_YEARS años cerrados (ver
+    power_cache.is_closed). Si el último cerrado es 2023, se usan de 2014 a 2023. Con años
+    cerrados la climatología no cambia en todo el año y se puede precalcular (ver par_climatology).
+    """
+    last_year = last_closed_year(today)
+    return range(last_year - (HISTORICAL_YEARS - 1), last_year + 1)
+
+
+def power_years_for(start_date, end_date):
+    """
+    Retorna (eje de fechas del rango, años de historia para la climatología, años del rango).
+    """
+    dates = date_axis(start_date, end_date)
+    user_years = dates.astype("datetime64[Y]").astype(int) + 1970
+    return dates, history_years_for(), set(user_years.tolist())
+
+
+def radiation_statistics(statistics):
+    """El p95 (la columna "radiacion") siempre, más los estadísticos adicionales pedidos."""
+    return ["p95"] + [name for name in statistics if name != "p95"]
+
+
+def radiation_column(name):
+    """Columna de nasa_power_data con el estadístico de radiación `name`."""
+    return "radiacion" if name == "p95" else f"radiacion_{name}"
+
+
+def plan_climatology(longitud, latitud, start_date, end_date, statistics):
+    """
+    Retorna (fechas, años de historia, climatología precalculada o None, años a pedir a POWER).
+
+    Si la celda está en la grilla precalculada (ver par_climatology) sólo hace falta la
+    temperatura de los años del rango; si no, también se piden los años de historia.
+    """
+    dates, history_years, user_years = power_years_for(start_date, end_date)
+    climatology = par_climatology.lookup(longitud, latitud, history_years, radiation_statistics(statistics))
+    years = user_years if climatology is not None else user_years | set(history_years)
+    return dates, history_years, climatology, years
+
+
+def build_power_results(power_data, dates, history_years, latitud, statistics=("p95",), climatology=None):
+    """
+    Arma la serie diaria de get_nasa_power_data a partir de los años descargados y, si se
+    indica, de la climatología precalculada { estadístico: 366 valores }.
+    """
+    with metrics.stage('climatologia'):
+        temperature_data = {}
+        for values in power_data["T2M"].values():
+            temperature_data.update(values)
+        temperatures = to_optional_floats(series_to_array(temperature_data, dates))
+        radiation_data = {}
+        for values in power_data["ALLSKY_SFC_PAR_TOT"].values():
+            radiation_data.update(values)
+        daily_radiation = to_optional_floats(series_to_array(radiation_data, dates))
+
+        # --- Estadísticos de radiación para cada día del rango solicitado ---
+        statistics = radiation_statistics(statistics)
+        if climatology is None:
+            history = history_array(power_data["ALLSKY_SFC_PAR_TOT"], history_years)
+            climatology = climatology_statistics(history, statistics)
+        day_index = leap_day_index(dates)
+        columns = {}
+        for name in statistics:
+            values = climatology[name]
+            columns[radiation_column(name)] = to_optional_floats(values[day_index])
+
+        results = []
+        for i, fecha in enumerate(dates.tolist()):
+            row = {
+                "fecha": fecha,
+                "temperatura": temperatures[i],
+                "radiacion_diaria": daily_radiation[i],
+            }
+            for key, values in columns.items():
+                row[key] = values[i]
+            row["latitud"] = latitud
+            results.append(row)
+        return results
+
+
+def get_nasa_power_data(centroid, start_date, end_date, statistics=("p95",)):
     """
     Obtiene los datos de NASA POWER con el siguiente enfoque:
-      1. Se consulta la temperatura (T2M) en el rango de fecha solicitado.
-      2. Para cada uno de los últimos 10 años se consulta la radiación (ALLSKY_SFC_PAR_TOT)
-         en el rango solicitado. Si el rango abarca varios años se segmenta por cada año
-         (o parte de año) de la consulta del usuario y se realizan las consultas históricas
-         usando los límites de mes y día de cada segmento.
-      3. Se calcula el percentil 95 para cada fecha (usando el mes y día como clave) en cada segmento.
-      4. Se filtran los resultados según los días correspondientes del rango solicitado.
+      1. Se determinan los años necesarios: los del rango solicitado y los últimos 10 años
+         cerrados de historia para la radiación (ALLSKY_SFC_PAR_TOT). Si la celda está en la
+         grilla precalculada (ver par_climatology) la historia no se pide: los estadísticos
+         se leen de ahí.
+      2. Se piden temperatura (T2M) y radiación para todos esos años juntos, en la menor
+         cantidad de consultas posible (ver plan_power_requests), y se separan por año en memoria.
+      3. La historia de radiación se arma como un arreglo años × día del año (ver climatology)
+         y se calculan los estadísticos pedidos para cada día en una sola pasada.
+      4. Se arma el eje de fechas del rango solicitado y se toman los valores de cada día.
     
     Retorna una lista de diccionarios con:
        - "fecha": fecha (YYYY-MM-DD)
        - "temperatura": valor de T2M para ese día (según consulta actual)
+       - "radiacion_diaria": radiación (ALLSKY_SFC_PAR_TOT, W/m² medio del día) medida ese día,
+         o None si POWER todavía no la tiene
        - "radiacion": percentil 95 de la radiación para ese día calculado con datos históricos
+       - "radiacion_<estadístico>": uno por cada estadístico adicional pedido en `statistics`
+         (ver climatology.STATISTICS)
     """
     longitud, latitud = centroid
+    dates, history_years, climatology, years = plan_climatology(longitud, latitud, start_date, end_date, statistics)
+    power_data = fetch_power_years(longitud, latitud, years)
+    return build_power_results(power_data, dates, history_years, latitud, statistics, climatology)
 
-    # --- Consulta de temperatura para el rango solicitado ---
-    iniAAAAMMDD = start_date.replace('-', '')
-    finAAAAMMDD = end_date.replace('-', '')
-    base_url_temp = (
-        "https://power.larc.nasa.gov/api/temporal/daily/point"
-        "?parameters=T2M&community=RE"
-        "&longitude={longitude}&latitude={latitude}&start={start}&end={end}&format=JSON"
-    )
-    api_temp_url = base_url_temp.format(
-        longitude=longitud, latitude=latitud,
-        start=iniAAAAMMDD, end=finAAAAMMDD
-    )
-    response_temp = requests.get(url=api_temp_url, verify=True, timeout=30.00)
-    temperature_data = {}
-    if response_temp.status_code == 200:
-        data_temp = response_temp.json()
-        daily_data_temp = data_temp.get("properties", {}).get("parameter", {})
-        temperature_data = daily_data_temp.get("T2M", {})
-    else:
-        print(f"Error en la consulta de temperatura: {response_temp.status_code}")
-
-    # --- Descarga de datos históricos de radiación en el rango solicitado ---
-    current_year = datetime.now().year
-    # Usamos los últimos 10 años: si current_year es 2023, usamos de 2014 a 2023.
-    start_year = current_year - 9
-    end_year = current_year
-
-    user_start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    user_end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-
-    # Generar segmentos según el rango de años del usuario.
-    # Cada segmento corresponde a:
-    # - Primer año: desde la fecha de inicio hasta el 31 de diciembre.
-    # - Años intermedios: desde 01-01 hasta 31-12.
-    # - Último año: desde 01-01 hasta la fecha de fin.
-    segments = []
-    if user_start_dt.year == user_end_dt.year:
-        segments.append((user_start_dt.year, user_start_dt, user_end_dt))
-    else:
-        for y in range(user_start_dt.year, user_end_dt.year + 1):
-            if y == user_start_dt.year:
-                seg_start = user_start_dt
-                seg_end = datetime(year=y, month=12, day=31)
-            elif y == user_end_dt.year:
-                seg_start = datetime(year=y, month=1, day=1)
-                seg_end = user_end_dt
-            else:
-                seg_start = datetime(year=y, month=1, day=1)
-                seg_end = datetime(year=y, month=12, day=31)
-            segments.append((y, seg_start, seg_end))
-
-    # Diccionario para almacenar los datos históricos por segmento (año del usuario)
-    # Estructura: { user_year: { "MM-DD": [valores de radiación] } }
-    radiation_by_year = {}
-    for seg in segments:
-        user_year, seg_start, seg_end = seg
-        radiation_by_year[user_year] = {}
-        # Formateamos los límites del segmento (solo mes y día)
-        md_start = seg_start.strftime("%m-%d")
-        md_end = seg_end.strftime("%m-%d")
-        
-        # Para cada uno de los últimos 10 años históricos se consulta el API usando los límites del segmento.
-        for hist_year in range(start_year, end_year + 1):
-            hist_start_date = f"{hist_year}-{md_start}"  # Ejemplo: "2014-03-01"
-            hist_end_date = f"{hist_year}-{md_end}"        # Ejemplo: "2014-12-31" o "2014-09-30"
-            hist_start_str = hist_start_date.replace('-', '')
-            hist_end_str = hist_end_date.replace('-', '')
-            base_url_hist = (
-                "https://power.larc.nasa.gov/api/temporal/daily/point"
-                "?parameters=ALLSKY_SFC_PAR_TOT&community=AG"
-                "&longitude={longitude}&latitude={latitude}&start={start}&end={end}&format=JSON"
-            )
-            hist_api_url = base_url_hist.format(
-                longitude=longitud, latitude=latitud,
-                start=hist_start_str, end=hist_end_str
-            )
-            response_hist = requests.get(url=hist_api_url, verify=True, timeout=30.00)
-            if response_hist.status_code == 200:
-                hist_data = response_hist.json()
-                radiation_data = hist_data.get("properties", {}).get("parameter", {}).get("ALLSKY_SFC_PAR_TOT", {})
-                for date_str, value in radiation_data.items():
-                    try:
-                        date_obj = datetime.strptime(date_str, "%Y%m%d")
-                    except Exception as e:
-                        print(f"Error al convertir la fecha {date_str}: {e}")
-                        continue
-                    # Usamos la clave mes-día (por ejemplo, "03-15")
-                    md_key = date_obj.strftime("%m-%d")
-                    try:
-                        rad_val = float(value)
-                    except Exception as e:
-                        print(f"Error al convertir el valor de radiación para {date_str}: {e}")
-                        continue
-                    radiation_by_year[user_year].setdefault(md_key, []).append(rad_val)
-            else:
-                print(f"Error en la consulta histórica para el año {hist_year} en el segmento {user_year}: {response_hist.status_code}")
-
-    # --- Cálculo del percentil 95 para cada mes-día en cada segmento ---
-    percentil95_by_year = {}
-    for user_year, data in radiation_by_year.items():
-        percentil95_by_year[user_year] = {}
-        for md_key, values in data.items():
-            if values:
-                percentil95_by_year[user_year][md_key] = np.percentile(values, 95)
-
-    # --- Filtrado de resultados según el rango solicitado ---
-    results = []
-    current = user_start_dt
-    while current <= user_end_dt:
-        date_str = current.strftime("%Y%m%d")
-        # Obtener la temperatura para la fecha solicitada
-        temp_value = temperature_data.get(date_str, None)
-        try:
-            temp_value = float(temp_value) if temp_value is not None else None
-        except Exception as e:
-            print(f"Error al convertir la temperatura para {date_str}: {e}")
-            temp_value = None
-        
-        # Se determina a qué segmento (año del usuario) pertenece la fecha actual y se usa la clave mes-día
-        user_year = current.year
-        md_key = current.strftime("%m-%d")
-        rad_percentil_95 = percentil95_by_year.get(user_year, {}).get(md_key, None)
-
-        results.append({
-            "fecha": current.date(),
-            "temperatura": temp_value,
-            "radiacion": rad_percentil_95,
-            "latitud": latitud
-        })
-        current += timedelta(days=1)
 
-    return results
+async def get_nasa_power_data_async(centroid, start_date, end_date, statistics=("p95",)):
+    """Igual que get_nasa_power_data, pero las descargas no bloquean el event loop."""
+    longitud, latitud = centroid
+    dates, history_years, climatology, years = plan_climatology(longitud, latitud, start_date, end_date, statistics)
+    power_data = await fetch_power_years_async(longitud, latitud, years)
+    return build_power_results(power_data, dates, history_years, latitud, statistics, climatology)
 
-# Función principal para obtener NDVI y datos de NASA POWER
-def get_ndvi(polygon, start_date='2024-01-01', end_date='2024-09-30', recurso_forrajero=None, presencia_leñosas=False, porcentaje_leñosas=0):
-    ee.Authenticate()
-    ee.Initialize(project="proyec2020")
 
-    def maskcloud(img):
-        q = img.select("MSK_CLDPRB").lt(1).rename('q')
-        return img.updateMask(q).addBands(q)
-    
-    dataset = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
-        .filterDate(start_date, end_date) \
-        .filterBounds(ee.Geometry.Polygon(polygon['coordinates'][0])) \
-        .select("B4", "B8", "MSK_CLDPRB") \
-        .filterMetadata("CLOUDY_PIXEL_PERCENTAGE", "less_than", 10) \
-        .map(maskcloud)
-
-    def NDVI(img):
-        ndvi = img.normalizedDifference(["B8", "B4"]).rename("NDVI")
-        return img.addBands(ndvi).clip(ee.Geometry.Polygon(polygon['coordinates'][0]))
-
-    ndvi = dataset.map(NDVI).select('NDVI')
-
-    def get_image_dates(image):
-        return image.set('fecha', image.date().format())
-
-    dates_list = ndvi.map(get_image_dates).aggregate_array('fecha')
-
-    def get_average_ndvi(date):
-        daily_ndvi = ndvi.filterDate(date, ee.Date(date).advance(1, 'day')).select('NDVI')
-        mean_ndvi = daily_ndvi.mean().rename('mean_NDVI')
-        mean_ndvi_roi = mean_ndvi.reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=ee.Geometry.Polygon(polygon['coordinates'][0]),
-            scale=30,
-            maxPixels=1e9
-        )
-        return mean_ndvi_roi.set('date', date)
-
-    daily_ndvi_collection = ee.List(dates_list.map(get_average_ndvi))
-    results_ndvi = daily_ndvi_collection.getInfo()
-
-    json_results = []
-    for item in results_ndvi:
-        result_item = {
-            "fecha": item['date'],
-            "NDVI": item.get('mean_NDVI', None)
-        }
-        result_item.update({
-            "recurso_forrajero": recurso_forrajero,
-            "presencia_leñosas": presencia_leñosas,
-            "porcentaje_leñosas": porcentaje_leñosas if presencia_leñosas else 0
-        })
-        json_results.append(result_item)
-
-    centroid = calculate_centroid(polygon)
-    nasa_power_results = get_nasa_power_data(centroid, start_date, end_date)
-
-    combined_results = {
-        "nasa_power_data": nasa_power_results
-    }
-    json_output = json.dumps(combined_results, indent=4)
-    return json_output
+def get_nasa_power_data_batch(centroids, start_date, end_date, statistics=("p95",)):
+    """
+    get_nasa_power_data para varios centroides { id: (longitud, latitud) }.
 
+    Los centroides se agrupan por celda de la grilla de POWER (ver power_cache) y se consulta
+    una sola vez por celda; cada id recibe la serie de su celda con su propia latitud.
+    """
+    by_cell = {}
+    for feature_id, (longitud, latitud) in centroids.items():
+        by_cell.setdefault(snap_to_cell(longitud, latitud), []).append(feature_id)
+
+    cell_ids = list(by_cell.values())
+    with ThreadPoolExecutor(max_workers=max(1, min(POWER_MAX_WORKERS, len(cell_ids)))) as pool:
+        futures = [
+            metrics.submit(pool, get_nasa_power_data, centroids[ids[0]], start_date, end_date, statistics)
+            for ids in cell_ids
+        ]
+        cell_results = [future.result() for future in futures]
+
+    results = {}
+    for ids, rows in zip(cell_ids, cell_results):
+        for feature_id in ids:
+            latitud = centroids[feature_id][1]
+            results[feature_id] = [dict(row, latitud=latitud) for row in rows]
+    return results
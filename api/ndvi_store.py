@@ -0,0 +1,171 @@
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from . import evaluate, metrics
+from .geometry import fingerprint
+from .models import NDVIObservation, Paddock
+
+# Las escenas de los últimos SETTLED_DAYS días todavía pueden aparecer en Earth Engine, así que
+# ese tramo no se marca como consultado y se vuelve a pedir en cada consulta
+SETTLED_DAYS = 5
+
+
+def covered_ranges(paddock):
+    """Tramos [inicio, fin) ya consultados del potrero, ordenados y sin solaparse."""
+    return [(date.fromisoformat(start), date.fromisoformat(end)) for start, end in paddock.coverage]
+
+
+def merge_ranges(ranges):
+    """Une los tramos [inicio, fin) que se solapan o se tocan; los retorna ordenados."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(paddock, start, end):
+    """Tramos [inicio, fin) de [start, end) que todavía no se consultaron a Earth Engine."""
+    ranges = []
+    for covered_start, covered_end in covered_ranges(paddock):
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            ranges.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        ranges.append((start, end))
+    return ranges
+
+
+def store_observations(paddock, ndvi_rows):
+    """Guarda (o actualiza) las observaciones de NDVI devueltas por evaluate."""
+    NDVIObservation.objects.bulk_create(
+        [
+            NDVIObservation(
+                paddock=paddock,
+                date=date.fromisoformat(row['fecha']),
+                ndvi=row['NDVI'],
+                clear_fraction=row.get('fraccion_despejada'),
+            )
+            for row in ndvi_rows
+        ],
+        update_conflicts=True,
+        unique_fields=['paddock', 'date'],
+        update_fields=['ndvi', 'clear_fraction'],
+    )
+
+
+def extend_coverage(paddock, start, end, vegetation_units=None, today=None):
+    """
+    Marca [start, end) como consultado, sin incluir los últimos SETTLED_DAYS días. El tramo se
+    une a los ya consultados que toca; si no toca ninguno queda como un tramo aparte.
+    """
+    today = today or date.today()
+    end = min(end, today - timedelta(days=SETTLED_DAYS))
+    with transaction.atomic():
+        paddock = Paddock.objects.select_for_update().get(pk=paddock.pk)
+        if start < end:
+            paddock.coverage = [
+                [range_start.isoformat(), range_end.isoformat()]
+                for range_start, range_end in merge_ranges(covered_ranges(paddock) + [(start, end)])
+            ]
+        if vegetation_units is not None:
+            paddock.vegetation_units = vegetation_units
+        paddock.save()
+    return paddock
+
+
+def get_ndvi_and_regions(polygon, start_date, end_date):
+    """
+    Igual que evaluate.get_ndvi_and_regions, pero usando las observaciones guardadas del
+    potrero: a Earth Engine sólo se le piden las fechas que todavía no se consultaron, y las
+    unidades de vegetación sólo la primera vez.
+    """
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    paddock = get_paddock(polygon)
+
+    vegetation_units = paddock.vegetation_units
+    ranges = missing_ranges(paddock, start, end)
+    metrics.count_cache('observaciones', hit=not ranges)
+    for range_start, range_end in ranges:
+        result = evaluate.get_ndvi_and_regions(
+            polygon, range_start.isoformat(), range_end.isoformat(), include_regions=vegetation_units is None
+        )
+        store_observations(paddock, result['ndvi_data'])
+        if vegetation_units is None:
+            vegetation_units = {key: result[key] for key in ('dominant_region', 'regions')}
+        # Si falló la unidad de vegetación no se guarda, para reintentarla en la próxima consulta
+        saved_units = vegetation_units if vegetation_units['dominant_region']['name'] != "Error" else None
+        extend_coverage(paddock, range_start, range_end, saved_units)
+
+    if vegetation_units is None:
+        vegetation_units = evaluate.get_vegetation_units(polygon)
+        if vegetation_units['dominant_region']['name'] != "Error":
+            extend_coverage(paddock, start, start, vegetation_units)
+
+    return {
+        "ndvi_data": stored_series(paddock, start, end),
+        **vegetation_units,
+        "escala_m": evaluate.plan_reduction(polygon['coordinates'][0])["scale"],
+    }
+
+
+def stored_series(paddock, start, end):
+    """Observaciones guardadas del potrero en [start, end), con el formato de evaluate."""
+    observations = paddock.observations.filter(date__gte=start, date__lt=end)
+    return [
+        {"fecha": obs.date.isoformat(), "NDVI": obs.ndvi, "fraccion_despejada": obs.clear_fraction}
+        for obs in observations
+    ]
+
+
+def get_paddock(polygon):
+    rings = polygon['coordinates'][0]
+    paddock, _ = Paddock.objects.get_or_create(fingerprint=fingerprint(rings), defaults={'coordinates': rings})
+    return paddock
+
+
+def get_ndvi_series(polygon, start_date, end_date):
+    """Sólo la serie de NDVI de get_ndvi_and_regions, sin las unidades de vegetación."""
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    paddock = get_paddock(polygon)
+    ranges = missing_ranges(paddock, start, end)
+    metrics.count_cache('observaciones', hit=not ranges)
+    for range_start, range_end in ranges:
+        result = evaluate.get_ndvi_and_regions(
+            polygon, range_start.isoformat(), range_end.isoformat(), include_regions=False
+        )
+        store_observations(paddock, result['ndvi_data'])
+        paddock = extend_coverage(paddock, range_start, range_end)
+    return stored_series(paddock, start, end)
+
+
+def get_vegetation_units(polygon):
+    """Sólo las unidades de vegetación de get_ndvi_and_regions; se consultan a GEE la primera vez."""
+    paddock = get_paddock(polygon)
+    if paddock.vegetation_units is not None:
+        return paddock.vegetation_units
+    vegetation_units = evaluate.get_vegetation_units(polygon)
+    if vegetation_units['dominant_region']['name'] != "Error":
+        extend_coverage(paddock, date.today(), date.today(), vegetation_units)
+    return vegetation_units
+
+
+def store_result(rings, start_date, end_date, result):
+    """
+    Guarda el resultado de evaluate.get_ndvi_and_regions para [start_date, end_date), para que
+    las consultas siguientes del mismo potrero lo tomen de la base (ver /api/ndvi/lote/).
+    """
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    paddock, _ = Paddock.objects.get_or_create(fingerprint=fingerprint(rings), defaults={'coordinates': rings})
+    store_observations(paddock, result['ndvi_data'])
+    vegetation_units = {key: result[key] for key in ('dominant_region', 'regions')}
+    if vegetation_units['dominant_region']['name'] == "Error":
+        vegetation_units = None
+    extend_coverage(paddock, start, end, vegetation_units)
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .climatology import DAYS_IN_LEAP_YEAR
+from .power_cache import GRID_RESOLUTION, snap_to_cell
+
+# Rectángulo (oeste, sur, este, norte) en grados que cubre la Argentina continental e insular
+ARGENTINA_BBOX = (-73.6, -55.1, -53.6, -21.7)
+
+DATA_FILE = 'par.npy'
+CELLS_FILE = 'celdas.npy'
+METADATA_FILE = 'metadata.json'
+# Archivo con el nombre de la carpeta de la grilla vigente (ver activate)
+ACTIVE_FILE = 'ACTIVA'
+
+
+def cell_range(bbox, resolution=GRID_RESOLUTION):
+    """(columna0, fila0, columnas, filas) de las celdas de POWER que cubren el rectángulo."""
+    west, south, east, north = bbox
+    col0, row0 = snap_to_cell(west, south, resolution)
+    col1, row1 = snap_to_cell(east, north, resolution)
+    return col0, row0, col1 - col0 + 1, row1 - row0 + 1
+
+
+class ParGrid:
+    """
+    Climatología de radiación (ALLSKY_SFC_PAR_TOT) precalculada para todas las celdas de un
+    rectángulo: un arreglo filas × columnas × estadísticos × 366 días en disco, mapeado en
+    memoria, y una máscara con las celdas ya calculadas. Cada grilla corresponde a una ventana
+    de años fija; cuando cierra un año nuevo se arma otra (ver build_par_climatology).
+    """
+
+    def __init__(self, directory, mode='r'):
+        self.directory = str(directory)
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.col0, self.row0 = metadata['celda_origen']
+        self.columns, self.rows = metadata['columnas'], metadata['filas']
+        self.resolution = metadata['resolucion']
+        self.years = tuple(metadata['anios'])
+        self.statistics = tuple(metadata['estadisticos'])
+        self.values = np.load(os.path.join(directory, DATA_FILE), mmap_mode=mode)
+        self.done = np.load(os.path.join(directory, CELLS_FILE), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, directory, bbox, years, statistics, resolution=GRID_RESOLUTION):
+        """Crea una grilla vacía (todas las celdas pendientes) y la abre para escribir."""
+        col0, row0, columns, rows = cell_range(bbox, resolution)
+        os.makedirs(directory, exist_ok=True)
+        np.lib.format.open_memmap(
+            os.path.join(directory, DATA_FILE), mode='w+', dtype=np.float32,
+            shape=(rows, columns, len(statistics), DAYS_IN_LEAP_YEAR),
+        )[:] = np.nan
+        np.lib.format.open_memmap(
+            os.path.join(directory, CELLS_FILE), mode='w+', dtype=np.bool_, shape=(rows, columns)
+        )[:] = False
+        metadata = {
+            'celda_origen': [col0, row0],
+            'columnas': columns,
+            'filas': rows,
+            'resolucion': resolution,
+            'anios': [years[0], years[-1]],
+            'estadisticos': list(statistics),
+            'parametro': 'ALLSKY_SFC_PAR_TOT',
+        }
+        with open(os.path.join(directory, METADATA_FILE), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        return cls(directory, mode='r+')
+
+    def index(self, cell):
+        """(fila, columna) de la celda en el arreglo, o None si queda afuera de la grilla."""
+        row, col = cell[1] - self.row0, cell[0] - self.col0
+        if 0 <= row < self.rows and 0 <= col < self.columns:
+            return row, col
+        return None
+
+    def cells(self):
+        """Todas las celdas de la grilla, como (columna, fila) de POWER."""
+        return [(self.col0 + col, self.row0 + row) for row in range(self.rows) for col in range(self.columns)]
+
+    def pending(self):
+        return [cell for cell in self.cells() if not self.done[self.index(cell)]]
+
+    def put(self, cell, by_statistic):
+        """Guarda los estadísticos { nombre: 366 valores } de una celda y la marca como calculada."""
+        row, col = self.index(cell)
+        self.values[row, col] = np.stack([by_statistic[name] for name in self.statistics])
+        self.done[row, col] = True
+
+    def flush(self):
+        self.values.flush()
+        self.done.flush()
+
+    def lookup(self, longitud, latitud, statistics):
+        """{ estadístico: 366 valores } de la celda del punto, o None si no está en la grilla."""
+        if self.resolution != GRID_RESOLUTION or any(name not in self.statistics for name in statistics):
+            return None
+        position = self.index(snap_to_cell(longitud, latitud, self.resolution))
+        if position is None or not self.done[position]:
+            return None
+        values = self.values[position]
+        # Se guarda en float32: se redondea a lo que esa precisión representa bien
+        return {name: np.round(values[self.statistics.index(name)].astype(float), 4) for name in statistics}
+
+
+def window_name(years):
+    return f"{years[0]}-{years[-1]}"
+
+
+def activate(root, years):
+    """Publica la grilla de la ventana `years` y borra las anteriores."""
+    name = window_name(years)
+    tmp_path = os.path.join(root, ACTIVE_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(name)
+    os.replace(tmp_path, os.path.join(root, ACTIVE_FILE))
+    for entry in os.listdir(root):
+        path = os.path.join(root, entry)
+        if entry != name and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_grid = None
+_grid_path = None
+_grid_lock = threading.Lock()
+
+
+def get_par_grid():
+    """
+    Grilla vigente del proceso, o None si todavía no se armó ninguna. Si el comando publica
+    una grilla nueva, la próxima consulta la abre.
+    """
+    global _grid, _grid_path
+    root = settings.PAR_CLIMATOLOGY_DIR
+    try:
+        with open(os.path.join(root, ACTIVE_FILE)) as f:
+            path = os.path.join(root, f.read().strip())
+    except FileNotFoundError:
+        return None
+    if path != _grid_path:
+        with _grid_lock:
+            if path != _grid_path:
+                _grid = ParGrid(path)
+                _grid_path = path
+    return _grid
+
+
+def lookup(longitud, latitud, years, statistics):
+    """
+    Estadísticos de radiación precalculados para el punto, o None si no hay grilla para la
+    ventana de años `years` o el punto no está cubierto (entonces se calculan como antes).
+    """
+    grid = get_par_grid()
+    years = list(years)
+    if grid is None or grid.years != (years[0], years[-1]):
+        return None
+    return grid.lookup(longitud, latitud, statistics)
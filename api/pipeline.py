@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import geojson
+from django.db import connections
+
+from . import evaluate, metrics
+from .geometry import centroid
+from .ndvi_script import (
+    calculate_centroid, get_nasa_power_data, get_nasa_power_data_async, get_nasa_power_data_batch,
+)
+from . import ndvi_store
+from .ndvi_store import get_ndvi_and_regions, store_result
+
+logger = logging.getLogger(__name__)
+
+# Hilos para las consultas a Earth Engine de la versión asíncrona del pipeline
+EE_EXECUTOR_WORKERS = 8
+_ee_executor = ThreadPoolExecutor(max_workers=EE_EXECUTOR_WORKERS, thread_name_prefix='ee')
+# Días de NDVI que se envían en cada evento de stream_ndvi_pipeline
+STREAM_WINDOW_DAYS = 90
+
+
+def run_ndvi_pipeline(coordinates, start_date, end_date, statistics=(), progress=None):
+    """
+    Ejecuta el pipeline completo para un polígono ya normalizado (ver geometry.normalize_polygon):
+    NDVI y unidad de vegetación desde Earth Engine y temperatura y radiación desde NASA POWER.
+
+    `progress`, si se indica, se llama como progress(etapa, porcentaje) al avanzar cada etapa.
+    Retorna el mismo diccionario que responde /api/ndvi/.
+    """
+    progress = progress or (lambda stage, percent: None)
+    polygon = geojson.Polygon([coordinates])
+
+    # Obtener los datos de NDVI (sólo se consultan a GEE las fechas que no están guardadas)
+    progress("ndvi", 0)
+    with metrics.stage('ndvi'):
+        ndvi_data = get_ndvi_and_regions(polygon, start_date, end_date)
+
+    # Calcular el centroide del polígono
+    with metrics.stage('centroide'):
+        centroid = calculate_centroid(polygon)
+
+    # Obtener datos de NASA POWER (temperatura y radiación)
+    progress("clima", 70)
+    with metrics.stage('clima'):
+        nasa_power_data = get_nasa_power_data(
+            centroid, start_date, end_date, statistics=statistics
+        )
+    progress("listo", 100)
+
+    # Combinar los resultados de NDVI y NASA POWER
+    return {
+        "ndvi_data": ndvi_data,
+        "nasa_power_data": nasa_power_data
+    }
+
+
+def run_batch_pipeline(polygons, start_date, end_date, statistics=()):
+    """
+    run_ndvi_pipeline para varios potreros { id: anillos normalizados } a la vez.
+
+    El NDVI y las unidades de vegetación de todos los potreros se piden a GEE en una sola
+    consulta (ver evaluate.get_batch_ndvi_and_regions) y NASA POWER se consulta una vez por
+    celda de la grilla. Los resultados se guardan por potrero para las consultas siguientes.
+    Retorna { id: resultado de run_ndvi_pipeline }.
+    """
+    ndvi_by_feature = evaluate.get_batch_ndvi_and_regions(polygons, start_date, end_date)
+    for feature_id, rings in polygons.items():
+        store_result(rings, start_date, end_date, ndvi_by_feature[feature_id])
+
+    centroids = {feature_id: centroid(rings) for feature_id, rings in polygons.items()}
+    power_by_feature = get_nasa_power_data_batch(centroids, start_date, end_date, statistics=statistics)
+
+    return {
+        feature_id: {
+            "ndvi_data": ndvi_by_feature[feature_id],
+            "nasa_power_data": power_by_feature[feature_id],
+        }
+        for feature_id in polygons
+    }
+
+
+def _ndvi_in_thread(polygon, start_date, end_date):
+    try:
+        return get_ndvi_and_regions(polygon, start_date, end_date)
+    finally:
+        # Los hilos del executor no pasan por el ciclo de pedidos de Django
+        connections.close_all()
+
+
+async def run_ndvi_pipeline_async(coordinates, start_date, end_date, statistics=()):
+    """
+    Versión asíncrona de run_ndvi_pipeline: la rama de Earth Engine corre en un executor y la de
+    NASA POWER con un cliente HTTP no bloqueante, las dos al mismo tiempo.
+
+    Si el pedido se cancela (por ejemplo, porque el cliente se desconectó) se cancelan las
+    descargas de POWER pendientes. La consulta a Earth Engine que ya empezó no se puede
+    interrumpir; termina en su hilo y sus observaciones quedan guardadas para el próximo pedido.
+    """
+    polygon = geojson.Polygon([coordinates])
+    loop = asyncio.get_running_loop()
+    # El hilo corre con el contexto del pedido, así sus etapas salen en el Server-Timing
+    ndvi_future = loop.run_in_executor(
+        _ee_executor, contextvars.copy_context().run, _ndvi_in_thread, polygon, start_date, end_date
+    )
+    power_task = asyncio.ensure_future(
+        get_nasa_power_data_async(calculate_centroid(polygon), start_date, end_date, statistics=statistics)
+    )
+    try:
+        ndvi_data, nasa_power_data = await asyncio.gather(ndvi_future, power_task)
+    except BaseException:
+        # Error en una rama o cancelación: no se deja la otra corriendo
+        ndvi_future.cancel()
+        power_task.cancel()
+        raise
+
+    return {
+        "ndvi_data": ndvi_data,
+        "nasa_power_data": nasa_power_data
+    }
+
+
+def stream_ndvi_pipeline(coordinates, start_date, end_date, statistics=()):
+    """
+    Versión incremental de run_ndvi_pipeline: genera tuplas (evento, datos) a medida que cada
+    parte está lista, para que el cliente pueda ir dibujando.
+
+    La unidad de vegetación, la serie de NASA POWER y la serie de NDVI se calculan en hilos
+    separados. El NDVI se pide por tramos de STREAM_WINDOW_DAYS días en orden cronológico (así
+    cada tramo queda guardado antes de pedir el siguiente, ver ndvi_store). Los eventos son:
+      - "unidad_vegetacion": {"dominant_region", "regions"}
+      - "clima": la lista de get_nasa_power_data
+      - "ndvi": {"desde", "hasta", "ndvi_data", "escala_m"}, uno por tramo
+      - "error": {"etapa", "detalle"} si falla alguna parte; las demás siguen
+      - "fin": {} al terminar
+    Si se deja de consumir el generador, el NDVI no pide los tramos que faltan.
+    """
+    polygon = geojson.Polygon([coordinates])
+    events = queue.Queue()
+    stopped = threading.Event()
+
+    def run(stage, work):
+        try:
+            work()
+        except Exception as e:
+            logger.warning("Error en la etapa %s: %s", stage, e)
+            events.put(("error", {"etapa": stage, "detalle": str(e)}))
+        finally:
+            connections.close_all()
+            events.put(None)
+
+    def vegetation_units():
+        events.put(("unidad_vegetacion", ndvi_store.get_vegetation_units(polygon)))
+
+    def climate():
+        centroid = calculate_centroid(polygon)
+        events.put(("clima", get_nasa_power_data(centroid, start_date, end_date, statistics=statistics)))
+
+    def ndvi():
+        scale = evaluate.plan_reduction(coordinates)["scale"]
+        for window_start, window_end in evaluate.date_windows(start_date, end_date, STREAM_WINDOW_DAYS):
+            if stopped.is_set():
+                return
+            series = ndvi_store.get_ndvi_series(polygon, window_start, window_end)
+            events.put(("ndvi", {
+                "desde": window_start, "hasta": window_end, "ndvi_data": series,
+                "escala_m": scale,
+            }))
+
+    stages = [("unidad_vegetacion", vegetation_units), ("clima", climate), ("ndvi", ndvi)]
+    pool = ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix='stream')
+    try:
+        for stage, work in stages:
+            pool.submit(run, stage, work)
+        pending = len(stages)
+        while pending:
+            event = events.get()
+            if event is None:
+                pending -= 1
+            else:
+                yield event
+        yield ("fin", {})
+    finally:
+        stopped.set()
+        pool.shutdown(wait=False)
@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+
+# Resolución (en grados) de la grilla usada para agrupar los pedidos a NASA POWER.
+# Todos los potreros de una misma celda comparten los mismos datos.
+GRID_RESOLUTION = 0.5
+# Días que POWER puede seguir corrigiendo después de publicados
+PROVISIONAL_DAYS = 30
+# Vigencia de los años que todavía tienen días provisorios
+RECENT_TTL = 6 * 3600
+
+
+def snap_to_cell(longitud, latitud, resolution=GRID_RESOLUTION):
+    """Retorna el índice (columna, fila) de la celda de la grilla que contiene al punto."""
+    return (math.floor(longitud / resolution), math.floor(latitud / resolution))
+
+
+def cell_center(cell, resolution=GRID_RESOLUTION):
+    """Retorna (longitud, latitud) del centro de la celda."""
+    col, row = cell
+    return ((col + 0.5) * resolution, (row + 0.5) * resolution)
+
+
+def is_closed(year, today=None):
+    """Un año está cerrado cuando ya pasaron PROVISIONAL_DAYS desde su último día."""
+    today = today or date.today()
+    return date(year, 12, 31) + timedelta(days=PROVISIONAL_DAYS) < today
+
+
+def last_closed_year(today=None):
+    """Último año cerrado (ver is_closed): el anterior, o el previo en enero."""
+    today = today or date.today()
+    year = today.year - 1
+    return year if is_closed(year, today) else year - 1
+
+
+class PowerCache:
+    """
+    Caché persistente de respuestas de NASA POWER en SQLite.
+
+    Cada fila guarda un año de un parámetro para una celda de la grilla. Los años
+    cerrados no vencen nunca; los que tienen días provisorios vencen a las RECENT_TTL
+    segundos. La base usa WAL para que varios procesos (workers de gunicorn) puedan
+    leer y escribir a la vez.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS power_year ("
+                " cell_lon INTEGER NOT NULL,"
+                " cell_lat INTEGER NOT NULL,"
+                " parameter TEXT NOT NULL,"
+                " year INTEGER NOT NULL,"
+                " data TEXT NOT NULL,"
+                " expires_at REAL,"
+                " PRIMARY KEY (cell_lon, cell_lat, parameter, year))"
+            )
+            self._local.connection = connection
+        return connection
+
+    def get_years(self, cell, parameters, years):
+        """
+        Retorna { parámetro: { año: { "YYYYMMDD": valor } } } con los años vigentes en caché.
+        """
+        found = {parameter: {} for parameter in parameters}
+        years = sorted(set(years))
+        if not years:
+            return found
+        rows = self._connection().execute(
+            "SELECT parameter, year, data FROM power_year"
+            " WHERE cell_lon = ? AND cell_lat = ? AND year BETWEEN ? AND ?"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (cell[0], cell[1], years[0], years[-1], time.time()),
+        )
+        for parameter, year, data in rows:
+            if parameter in found and year in years:
+                found[parameter][year] = json.loads(data)
+        return found
+
+    def put_years(self, cell, by_year, today=None):
+        """Guarda { parámetro: { año: valores } } y elimina las filas vencidas."""
+        now = time.time()
+        rows = []
+        for parameter, years in by_year.items():
+            for year, values in years.items():
+                expires_at = None if is_closed(year, today) else now + RECENT_TTL
+                rows.append((cell[0], cell[1], parameter, year, json.dumps(values), expires_at))
+        if not rows:
+            return
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT OR REPLACE INTO power_year VALUES (?, ?, ?, ?, ?, ?)", rows)
+            connection.execute("DELETE FROM power_year WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_power_cache():
+    """Retorna la caché de POWER del proceso, creándola la primera vez."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PowerCache(settings.POWER_CACHE_PATH)
+    return _cache
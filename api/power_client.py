@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+POWER_TIMEOUT = 60.00
+# Conexiones abiertas con POWER por proceso (se reutilizan entre consultas)
+POOL_SIZE = 8
+HEADERS = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+# Intentos por consulta, contando el primero
+MAX_ATTEMPTS = 4
+# Espera antes del primer reintento; se duplica en cada uno, hasta BACKOFF_MAX segundos
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Fallas seguidas que abren el circuito, y segundos que queda abierto antes de volver a probar
+CIRCUIT_FAILURES = 5
+CIRCUIT_COOLDOWN = 60.0
+
+
+class PowerServiceError(Exception):
+    """
+    NASA POWER no está disponible: se agotaron los reintentos, el circuito está abierto o no
+    hay cupo para consultar a tiempo. `retry_after` son los segundos sugeridos antes de volver
+    a intentar (o None).
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PowerRequestError(Exception):
+    """
+    POWER rechazó la consulta con un error que no se arregla reintentando (un 4xx que no es
+    429: parámetros inválidos, punto fuera de cobertura). `detail` es el mensaje de POWER.
+    """
+
+    def __init__(self, message, status_code, detail=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def error_detail(body):
+    """Mensaje de error de una respuesta de POWER ("messages" o "detail" del JSON, o el texto)."""
+    if not body:
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body[:500]
+    if isinstance(data, dict):
+        messages = data.get("messages") or data.get("detail") or data.get("message")
+        if messages:
+            return "; ".join(str(message) for message in messages) if isinstance(messages, list) else str(messages)
+    return body[:500]
+
+
+class PowerLimiter:
+    """
+    Límite de consultas a POWER y circuit breaker compartidos por todos los procesos.
+
+    El estado vive en una fila de SQLite: un token bucket que se recarga a `rate` consultas por
+    segundo hasta `burst`, y la cuenta de fallas seguidas. Con CIRCUIT_FAILURES fallas el
+    circuito se abre y las consultas fallan enseguida durante CIRCUIT_COOLDOWN segundos; después
+    pasa una sola consulta de prueba, que lo cierra si POWER responde (aunque sea con un 4xx) o
+    lo vuelve a abrir si hay un error de red o un 5xx.
+    """
+
+    def __init__(self, path, rate, burst):
+        self.path = str(path)
+        self.rate = rate
+        self.burst = burst
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS power_limiter ("
+                " id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " tokens REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " failures INTEGER NOT NULL,"
+                " open_until REAL NOT NULL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO power_limiter VALUES (0, ?, ?, 0, 0)", (self.burst, time.time())
+            )
+            self._local.connection = connection
+        return connection
+
+    def try_acquire(self):
+        """
+        Toma un token. Retorna 0 si lo consiguió o los segundos que faltan para el próximo;
+        lanza PowerServiceError si el circuito está abierto.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            tokens, updated_at, failures, open_until = connection.execute(
+                "SELECT tokens, updated_at, failures, open_until FROM power_limiter WHERE id = 0"
+            ).fetchone()
+            now = time.time()
+            if open_until > now:
+                raise PowerServiceError("NASA POWER no responde; se reintentará más tarde.", open_until - now)
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+                if failures >= CIRCUIT_FAILURES:
+                    # Consulta de prueba: las demás siguen fallando rápido hasta que se resuelva
+                    open_until = now + CIRCUIT_COOLDOWN
+            connection.execute(
+                "UPDATE power_limiter SET tokens = ?, updated_at = ?, open_until = ? WHERE id = 0",
+                (tokens, now, open_until),
+            )
+        return wait
+
+    def acquire(self, timeout=POWER_TIMEOUT):
+        """Espera un token como mucho `timeout` segundos."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise PowerServiceError("Se alcanzó el límite de consultas a NASA POWER.", wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=POWER_TIMEOUT):
+        """Igual que acquire, sin bloquear el event loop."""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                raise PowerServiceError("Se alcanzó el límite de consultas a NASA POWER.", wait)
+            await asyncio.sleep(wait)
+
+    def record(self, ok):
+        """Registra el resultado de una consulta: un éxito cierra el circuito, una falla suma."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if ok:
+                connection.execute("UPDATE power_limiter SET failures = 0, open_until = 0 WHERE id = 0")
+                return
+            failures, = connection.execute(
+                "UPDATE power_limiter SET failures = failures + 1 WHERE id = 0 RETURNING failures"
+            ).fetchone()
+            if failures >= CIRCUIT_FAILURES:
+                connection.execute(
+                    "UPDATE power_limiter SET open_until = ? WHERE id = 0", (time.time() + CIRCUIT_COOLDOWN,)
+                )
+        if failures == CIRCUIT_FAILURES:
+            logger.warning("NASA POWER falló %s veces seguidas; se deja de consultar por %s s",
+                           failures, CIRCUIT_COOLDOWN)
+
+
+_limiter = None
+_session = None
+_lock = threading.Lock()
+
+
+def get_limiter():
+    """Retorna el limitador de POWER del proceso, creándolo la primera vez."""
+    global _limiter
+    if _limiter is None:
+        with _lock:
+            if _limiter is None:
+                _limiter = PowerLimiter(settings.POWER_LIMITER_PATH, settings.POWER_RATE_LIMIT,
+                                        settings.POWER_RATE_BURST)
+    return _limiter
+
+
+def get_session():
+    """Sesión HTTP del proceso, con un pool de conexiones persistentes a POWER."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                # Los reintentos los maneja check_attempt, que respeta el límite compartido
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def async_client():
+    """Cliente httpx para las consultas asíncronas, con el mismo pool y encabezados."""
+    return httpx.AsyncClient(
+        headers=HEADERS, timeout=POWER_TIMEOUT, limits=httpx.Limits(max_connections=POOL_SIZE)
+    )
+
+
+def backoff(attempt, retry_after=None):
+    """Segundos antes del reintento `attempt` (desde 0): Retry-After si viene, si no exponencial con jitter."""
+    try:
+        return min(float(retry_after), BACKOFF_MAX)
+    except (TypeError, ValueError):
+        delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def check_attempt(limiter, attempt, status_code, headers, error, body=None):
+    """
+    Decide qué hacer con un intento. Retorna None si la respuesta sirve o los segundos a esperar
+    antes de reintentar. Lanza PowerRequestError si POWER rechazó la consulta (4xx que no es
+    429, con el mensaje de `body`) y PowerServiceError si no quedan intentos.
+    """
+    ok = error is None and status_code == 200
+    metrics.count_upstream("nasa_power", ok=ok)
+    # Cualquier respuesta HTTP que no sea un 5xx (también un 429 u otro 4xx) indica que POWER
+    # funciona y cierra el circuito; sólo los errores de red y los 5xx cuentan como fallas
+    limiter.record(ok=error is None and status_code < 500)
+    if ok:
+        return None
+
+    detail = f"{type(error).__name__}: {error}" if error is not None else f"HTTP {status_code}"
+    if error is None and 400 <= status_code < 500 and status_code not in RETRY_STATUSES:
+        message = error_detail(body)
+        logger.warning("NASA POWER rechazó la consulta (%s): %s", detail, message)
+        raise PowerRequestError(f"NASA POWER rechazó la consulta ({detail}): {message}", status_code, message)
+    retryable = error is not None or status_code in RETRY_STATUSES
+    if not retryable or attempt + 1 >= MAX_ATTEMPTS:
+        logger.warning("Error en la consulta a NASA POWER (%s intentos): %s", attempt + 1, detail)
+        raise PowerServiceError(f"NASA POWER no respondió ({detail}).", CIRCUIT_COOLDOWN if retryable else None)
+    delay = backoff(attempt, headers.get("Retry-After") if headers else None)
+    logger.info("NASA POWER respondió %s; reintento %s en %.1f s", detail, attempt + 1, delay)
+    return delay
+
+
+def decode_json(response):
+    """JSON de una respuesta 200 de POWER; lanza PowerServiceError si el cuerpo no es JSON válido."""
+    try:
+        return response.json()
+    except ValueError as e:
+        logger.warning("NASA POWER respondió 200 con un cuerpo que no es JSON: %s", e)
+        raise PowerServiceError("NASA POWER respondió con datos ilegibles.") from e
+
+
+def get_json(params, base_url=None):
+    """
+    Consulta POWER con `params` y retorna el JSON de la respuesta. `base_url` es el endpoint
+    (por defecto settings.POWER_BASE_URL). Cada intento toma un token del límite compartido;
+    los errores de red, 429 y 5xx se reintentan con espera exponencial, y los demás 4xx lanzan
+    PowerRequestError sin reintentar.
+    """
+    base_url = base_url or settings.POWER_BASE_URL
+    limiter, session = get_limiter(), get_session()
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire()
+        response = error = None
+        with metrics.stage("power"):
+            try:
+                response = session.get(base_url, params=params, timeout=POWER_TIMEOUT)
+            except requests.RequestException as e:
+                error = e
+        status_code, headers = (response.status_code, response.headers) if response is not None else (None, None)
+        body = response.text if response is not None and status_code != 200 else None
+        delay = check_attempt(limiter, attempt, status_code, headers, error, body)
+        if delay is None:
+            return decode_json(response)
+        time.sleep(delay)
+
+
+async def get_json_async(client, params):
+    """Igual que get_json, con un cliente de async_client."""
+    limiter = get_limiter()
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.acquire_async()
+        response = error = None
+        with metrics.stage("power"):
+            try:
+                response = await client.get(settings.POWER_BASE_URL, params=params)
+            except httpx.HTTPError as e:
+                error = e
+        status_code, headers = (response.status_code, response.headers) if response is not None else (None, None)
+        body = response.text if response is not None and status_code != 200 else None
+        delay = await asyncio.to_thread(check_attempt, limiter, attempt, status_code, headers, error, body)
+        if delay is None:
+            return decode_json(response)
+        await asyncio.sleep(delay)
@@ -0,0 +1,204 @@
+import json
+from datetime import date
+from importlib.util import find_spec
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+NDVI_COLUMNS = ("fecha", "NDVI", "fraccion_despejada")
+
+
+def is_result(data):
+    """El dato es una respuesta de /api/ndvi/ (ver pipeline.run_ndvi_pipeline)."""
+    return isinstance(data, dict) and "ndvi_data" in data and "nasa_power_data" in data
+
+
+def columns(rows, names):
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def power_columns(rows):
+    """Columnas de nasa_power_data: todas las de la primera fila salvo la latitud, que es una sola."""
+    return [name for name in rows[0] if name != "latitud"] if rows else ["fecha"]
+
+
+def to_columnar(result):
+    """
+    Respuesta de /api/ndvi/ como arreglos paralelos:
+    {"ndvi": {"fecha": [...], "NDVI": [...], ...}, "dominant_region", "regions", "escala_m",
+     "clima": {"latitud": x, "fecha": [...], "temperatura": [...], "radiacion": [...], ...}}
+    """
+    ndvi_data = result["ndvi_data"]
+    power = result["nasa_power_data"]
+    return {
+        "ndvi": columns(ndvi_data["ndvi_data"], NDVI_COLUMNS),
+        "dominant_region": ndvi_data.get("dominant_region"),
+        "regions": ndvi_data.get("regions"),
+        "escala_m": ndvi_data.get("escala_m"),
+        "clima": {
+            "latitud": power[0]["latitud"] if power else None,
+            **columns(power, power_columns(power)),
+        },
+    }
+
+
+def is_batch(data):
+    """El dato es una respuesta de /api/ndvi/lote/: { id: respuesta de /api/ndvi/ }."""
+    return isinstance(data, dict) and bool(data) and all(is_result(value) for value in data.values())
+
+
+def columnar_payload(data):
+    """to_columnar para una respuesta de /api/ndvi/ o para cada potrero de /api/ndvi/lote/."""
+    if is_result(data):
+        return to_columnar(data)
+    if is_batch(data):
+        return {feature_id: to_columnar(result) for feature_id, result in data.items()}
+    return data
+
+
+def daily_rows(result, power_names):
+    """
+    Una fila por día de una respuesta de /api/ndvi/: la fecha (date), NDVI y fraccion_despejada
+    (None los días sin escena) y las columnas `power_names` de nasa_power_data.
+    """
+    ndvi_by_date = {str(row["fecha"]): row for row in result["ndvi_data"]["ndvi_data"]}
+    power_by_date = {str(row["fecha"]): row for row in result["nasa_power_data"]}
+    for day in sorted(ndvi_by_date.keys() | power_by_date.keys()):
+        ndvi, power = ndvi_by_date.get(day, {}), power_by_date.get(day, {})
+        yield {
+            "fecha": date.fromisoformat(day),
+            **{name: ndvi.get(name) for name in NDVI_COLUMNS[1:]},
+            **{name: power.get(name) for name in power_names},
+        }
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """JSON con las series en columnas (ver to_columnar). Se pide con ?format=columnar."""
+    media_type = "application/vnd.ndvi.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(columnar_payload(data), accepted_media_type, renderer_context)
+
+
+class BinaryRenderer(BaseRenderer):
+    """
+    Base de los formatos binarios: los errores (400, 503) se envían igual como JSON, para que
+    el cliente pueda leerlos sin decodificar el formato pedido.
+    """
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not (is_result(data) or is_batch(data)):
+            response = (renderer_context or {}).get("response")
+            if response is not None:
+                response["Content-Type"] = "application/json"
+            return json.dumps(data, cls=DjangoJSONEncoder).encode()
+        return self.encode(data)
+
+
+class MessagePackRenderer(BinaryRenderer):
+    """El formato columnar codificado en MessagePack (requiere msgpack). Se pide con ?format=msgpack."""
+    media_type = "application/msgpack"
+    format = "msgpack"
+
+    def encode(self, data):
+        import msgpack
+
+        return msgpack.packb(columnar_payload(data), default=encode_date, use_bin_type=True)
+
+
+def encode_date(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"No se puede codificar {type(value).__name__}")
+
+
+class ArrowRenderer(BinaryRenderer):
+    """
+    Una tabla Arrow IPC (stream) con una fila por día: la fecha, NDVI y fraccion_despejada
+    (nulos los días sin escena) y las columnas de nasa_power_data. En /api/ndvi/lote/ se agrega
+    la columna "id". La unidad de vegetación, la escala y la latitud van en los metadatos del esquema.
+    Requiere pyarrow; se pide con ?format=arrow.
+    """
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+
+    def encode(self, data):
+        import pyarrow as pa
+
+        batch = is_batch(data)
+        results = data if batch else {None: data}
+        power_names = []
+        for result in results.values():
+            for name in power_columns(result["nasa_power_data"]):
+                if name != "fecha" and name not in power_names:
+                    power_names.append(name)
+
+        table = {"id": [], "fecha": [], **{name: [] for name in NDVI_COLUMNS[1:] + tuple(power_names)}}
+        metadata = {}
+        for feature_id, result in results.items():
+            for row in daily_rows(result, power_names):
+                table["id"].append(feature_id)
+                for name, value in row.items():
+                    table[name].append(value)
+            power = result["nasa_power_data"]
+            metadata[feature_id] = {
+                "dominant_region": result["ndvi_data"].get("dominant_region"),
+                "regions": result["ndvi_data"].get("regions"),
+                "escala_m": result["ndvi_data"].get("escala_m"),
+                "latitud": power[0]["latitud"] if power else None,
+            }
+
+        arrays = {"fecha": pa.array(table.pop("fecha"), pa.date32())}
+        ids = table.pop("id")
+        if batch:
+            arrays = {"id": pa.array([str(feature_id) for feature_id in ids], pa.string()), **arrays}
+        arrays.update({name: pa.array(values, pa.float64()) for name, values in table.items()})
+        schema_metadata = (
+            {"potreros": json.dumps({str(key): value for key, value in metadata.items()})} if batch
+            else {key: json.dumps(value) for key, value in metadata[None].items()}
+        )
+        arrow_table = pa.table(arrays).replace_schema_metadata(schema_metadata)
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        return sink.getvalue().to_pybytes()
+
+
+def optional_renderers():
+    """Renderers binarios cuyas dependencias están instaladas (se importan recién al usarlos)."""
+    return [
+        renderer for module, renderer in (("msgpack", MessagePackRenderer), ("pyarrow", ArrowRenderer))
+        if find_spec(module) is not None
+    ]
+
+
+# Formatos de las vistas de NDVI: el JSON de siempre primero (es el que se usa si el cliente no
+# pide otro), después el columnar y los binarios disponibles
+NDVI_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer, *optional_renderers()]
+
+
+def variant_etag(etag, renderer):
+    """ETag de la respuesta en el formato elegido: cada formato es una representación distinta."""
+    if renderer.format in ("json", "api"):
+        return etag
+    return f'{etag[:-1]}-{renderer.format}"'
+
+
+def negotiate(request):
+    """
+    Elige el renderer para una vista de Django sin DRF (ver NDVIAsyncView), con las mismas
+    reglas que las vistas de DRF: ?format= o el encabezado Accept. Lanza NotAcceptable si
+    no hay ninguno que sirva.
+    """
+    renderers = [renderer() for renderer in NDVI_RENDERERS if renderer.format != "api"]
+    renderer, media_type = DefaultContentNegotiation().select_renderer(Request(request), renderers)
+    return renderer, media_type
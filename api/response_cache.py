@@ -0,0 +1,68 @@
+import hashlib
+import json
+from datetime import date, timedelta
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import parse_etags
+
+from . import metrics
+from .geometry import fingerprint
+
+# Alias de settings.CACHES usado para las respuestas de /api/ndvi/
+CACHE_ALIAS = 'ndvi'
+# Si el rango llega hasta alguno de los últimos RECENT_DAYS días todavía pueden aparecer
+# escenas nuevas, así que la respuesta dura sólo RECENT_TIMEOUT segundos
+RECENT_DAYS = 5
+RECENT_TIMEOUT = 60 * 60
+HISTORICAL_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def cache_key(rings, start_date, end_date, **options):
+    """
+    Clave de la respuesta: huella del polígono, rango de fechas y opciones del pedido. Las
+    opciones que son listas (estadisticas) no dependen del orden ni de los repetidos.
+    """
+    options = {
+        name: sorted(set(value)) if isinstance(value, (list, tuple, set)) else value
+        for name, value in options.items()
+    }
+    request = json.dumps([start_date, end_date, options], sort_keys=True)
+    digest = hashlib.sha256(f"{fingerprint(rings)}:{request}".encode()).hexdigest()
+    return f"ndvi:{digest}"
+
+
+def timeout_for(end_date, today=None):
+    today = today or date.today()
+    if date.fromisoformat(str(end_date)) >= today - timedelta(days=RECENT_DAYS):
+        return RECENT_TIMEOUT
+    return HISTORICAL_TIMEOUT
+
+
+def make_etag(payload):
+    """ETag fuerte calculado sobre el contenido de la respuesta."""
+    body = json.dumps(payload, cls=DjangoJSONEncoder, sort_keys=True)
+    return '"%s"' % hashlib.sha256(body.encode()).hexdigest()[:32]
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Comparación débil de If-None-Match (RFC 9110): ignora el W/ que agrega la compresión
+    (ver compression.CompressionMiddleware). "*" coincide con cualquier respuesta.
+    """
+    tags = {tag.removeprefix('W/') for tag in parse_etags(if_none_match)}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def get_response(key):
+    """Retorna (payload, etag) si la respuesta está en caché, o None."""
+    cached = caches[CACHE_ALIAS].get(key)
+    metrics.count_cache('respuestas', hit=cached is not None)
+    return cached
+
+
+def set_response(key, payload, end_date):
+    """Guarda la respuesta con la vigencia que corresponde al rango y retorna su ETag."""
+    etag = make_etag(payload)
+    caches[CACHE_ALIAS].set(key, (payload, etag), timeout_for(end_date))
+    return etag
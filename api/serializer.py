@@ -1,12 +1,133 @@
+from datetime import date
+
 from rest_framework import serializers
-from .models import Task
+from .geometry import GeometryError, normalize_polygon
+from .models import Job
 
-class TaskSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Task
-        fields = ('id','title','description','done')
-        # una opción para colocar todos los campos es fields = '__all__'
+# Cantidad máxima de potreros en un pedido a /api/ndvi/lote/
+MAX_BATCH_FEATURES = 200
+
+
+def validate_statistics(value):
+    # climatology importa numpy, por eso se carga recién al validar
+    from .climatology import STATISTICS
+    invalid = [name for name in value if name not in STATISTICS]
+    if invalid:
+        raise serializers.ValidationError(f"Estadísticos no disponibles: {', '.join(invalid)}")
+    return value
+
+
+class DateRangeSerializer(serializers.Serializer):
+    """
+    Rango de fechas de la consulta (YYYY-MM-DD). En validated_data quedan como texto ISO, que es
+    lo que usan la caché de respuestas, ndvi_store y el pipeline.
+    """
+    start_date = serializers.DateField(required=False, default=date(2024, 1, 1))
+    end_date = serializers.DateField(required=False, default=date(2024, 9, 30))
 
-class PolygonSerializer(serializers.Serializer):
+    def validate(self, data):
+        data = super().validate(data)
+        if data['end_date'] < data['start_date']:
+            raise serializers.ValidationError({'end_date': "Debe ser igual o posterior a start_date."})
+        data['start_date'] = data['start_date'].isoformat()
+        data['end_date'] = data['end_date'].isoformat()
+        return data
+
+
+class PolygonSerializer(DateRangeSerializer):
     coordinates = serializers.ListField(child=serializers.ListField(child=serializers.ListField(child=serializers.FloatField())))
-    
\ No newline at end of file
+    # Estadísticos de radiación adicionales al percentil 95 (ver climatology.STATISTICS)
+    estadisticas = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+
+    def validate_coordinates(self, value):
+        # Se rechazan polígonos degenerados o enormes antes de llegar a Earth Engine
+        try:
+            return normalize_polygon(value)
+        except GeometryError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate_estadisticas(self, value):
+        return validate_statistics(value)
+
+
+def get_feature_id(feature, index):
+    """Id de un Feature: su "id", properties.id o, si no tiene, su posición."""
+    properties = feature.get('properties') or {}
+    return str(feature.get('id', properties.get('id', index)))
+
+
+class FeatureCollectionSerializer(DateRangeSerializer):
+    """
+    FeatureCollection de GeoJSON con los potreros de un establecimiento. Cada Feature debe ser un
+    Polygon; se identifica por su "id" (o properties.id) y, si no tiene, por su posición.
+    """
+    type = serializers.ChoiceField(choices=['FeatureCollection'])
+    features = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_BATCH_FEATURES)
+    estadisticas = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+
+    def validate_features(self, value):
+        """Retorna { id: anillos normalizados } en el orden recibido."""
+        polygons = {}
+        errors = {}
+        for index, feature in enumerate(value):
+            feature_id = get_feature_id(feature, index)
+            geometry = feature.get('geometry') or {}
+            if feature_id in polygons:
+                errors[feature_id] = ["Hay más de un potrero con este id."]
+            elif geometry.get('type') != 'Polygon':
+                errors[feature_id] = ["La geometría debe ser de tipo Polygon."]
+            else:
+                polygon = PolygonSerializer(data={'coordinates': geometry.get('coordinates')})
+                if polygon.is_valid():
+                    polygons[feature_id] = polygon.validated_data['coordinates']
+                else:
+                    errors[feature_id] = polygon.errors['coordinates']
+        if errors:
+            raise serializers.ValidationError(errors)
+        return polygons
+
+    def validate_estadisticas(self, value):
+        return validate_statistics(value)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ('id', 'status', 'stage', 'progress', 'error', 'created_at', 'started_at', 'finished_at', 'result')
+
+
+class ForageParametersSerializer(serializers.Serializer):
+    """Parámetros de un potrero para forage.forage_availability."""
+    # Las claves de forage.FORAGE_RESOURCES (forage importa numpy, por eso se repiten acá)
+    recurso_forrajero = serializers.ChoiceField(
+        choices=['pastizal_natural', 'pastura_implantada', 'verdeo_invierno', 'verdeo_verano'],
+        required=False, default='pastizal_natural',
+    )
+    presencia_leñosas = serializers.BooleanField(required=False, default=False)
+    porcentaje_leñosas = serializers.FloatField(required=False, default=0, min_value=0, max_value=100)
+
+
+class PastureAvailabilitySerializer(ForageParametersSerializer, FeatureCollectionSerializer):
+    """
+    FeatureCollection para /api/disponibilidad/. recurso_forrajero, presencia_leñosas y
+    porcentaje_leñosas valen para todos los potreros, salvo los que los traigan en sus properties.
+    """
+
+    def validate(self, data):
+        """Agrega { id: parámetros del potrero } en "parametros"."""
+        data = super().validate(data)
+        defaults = {name: data[name] for name in ForageParametersSerializer().fields}
+        parameters = {}
+        errors = {}
+        for index, feature in enumerate(self.initial_data.get('features')):
+            properties = feature.get('properties') or {}
+            overrides = {name: properties[name] for name in defaults if name in properties}
+            serializer = ForageParametersSerializer(data={**defaults, **overrides})
+            if serializer.is_valid():
+                parameters[get_feature_id(feature, index)] = serializer.validated_data
+            else:
+                errors[get_feature_id(feature, index)] = serializer.errors
+        if errors:
+            raise serializers.ValidationError({'features': errors})
+        data['parametros'] = parameters
+        return data
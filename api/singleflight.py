@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no se agrupan pedidos entre procesos, cada uno calcula el suyo
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Los candados son archivos en SINGLEFLIGHT_DIR, uno por clave mientras alguien la calcula
+POLL_INTERVAL = 0.1
+# Si quien calcula tarda más que esto, el que espera deja de esperarlo y calcula por su cuenta
+WAIT_TIMEOUT = 300.0
+
+
+class KeyLock:
+    """
+    Candado exclusivo entre procesos (y entre hilos) para una clave, con flock sobre un archivo
+    propio de la clave que se borra al soltarlo.
+    """
+
+    def __init__(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        self.path = os.path.join(settings.SINGLEFLIGHT_DIR, f"{digest}.lock")
+        self._file = None
+
+    def try_acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        file = open(self.path, 'a+b')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        # Quien lo tenía pudo borrar el archivo entre el open y el flock: entonces el candado
+        # tomado es el de un archivo que ya no está y hay que volver a intentarlo
+        locked = os.fstat(file.fileno())
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if current is None or (current.st_dev, current.st_ino) != (locked.st_dev, locked.st_ino):
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            # Se borra antes de soltarlo, así quien llegue después crea uno nuevo
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def do(key, lookup, compute, timeout=WAIT_TIMEOUT):
+    """
+    Ejecuta `compute()` una sola vez aunque lleguen al mismo tiempo varios pedidos con la misma
+    `key`, desde cualquier worker. El primero calcula; los demás esperan a que termine y
+    retornan `lookup()` (la respuesta que dejó en la caché). Si el primero falla, o `lookup()`
+    no encuentra nada, el siguiente en la fila calcula.
+    """
+    if fcntl is None:
+        return compute()
+    lock = KeyLock(key)
+    deadline = time.monotonic() + timeout
+    waited = False
+    while not lock.try_acquire():
+        waited = True
+        if time.monotonic() > deadline:
+            logger.warning("Se dejó de esperar el cálculo en curso de %s", key)
+            return compute()
+        time.sleep(POLL_INTERVAL)
+    try:
+        if waited:
+            value = lookup()
+            if value is not None:
+                metrics.count_cache('en_curso', hit=True)
+                return value
+        metrics.count_cache('en_curso', hit=False)
+        return compute()
+    finally:
+        lock.release()
+
+
+async def do_async(key, lookup, compute, timeout=WAIT_TIMEOUT):
+    """Igual que do, sin bloquear el event loop: `lookup` es sincrónica y `compute` una corrutina."""
+    if fcntl is None:
+        return await compute()
+    lock = KeyLock(key)
+    deadline = time.monotonic() + timeout
+    waited = False
+    while not await asyncio.to_thread(lock.try_acquire):
+        waited = True
+        if time.monotonic() > deadline:
+            logger.warning("Se dejó de esperar el cálculo en curso de %s", key)
+            return await compute()
+        await asyncio.sleep(POLL_INTERVAL)
+    try:
+        if waited:
+            value = await asyncio.to_thread(lookup)
+            if value is not None:
+                metrics.count_cache('en_curso', hit=True)
+                return value
+        metrics.count_cache('en_curso', hit=False)
+        return await compute()
+    finally:
+        lock.release()
@@ -0,0 +1,33 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+SSE_CONTENT_TYPE = 'text/event-stream'
+
+
+def wants_sse(request):
+    """El cliente pide Server-Sent Events (EventSource envía Accept: text/event-stream)."""
+    return SSE_CONTENT_TYPE in request.headers.get('Accept', '')
+
+
+def encode_ndjson(event, data):
+    """Una línea JSON por evento: {"tipo": evento, "datos": datos}."""
+    return json.dumps({"tipo": event, "datos": data}, cls=DjangoJSONEncoder) + "\n"
+
+
+def encode_sse(event, data):
+    """Un evento con nombre de Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def cached_events(payload, start_date, end_date):
+    """Eventos equivalentes a una respuesta de /api/ndvi/ que ya estaba en caché."""
+    ndvi_data = payload["ndvi_data"]
+    yield ("unidad_vegetacion", {key: ndvi_data[key] for key in ("dominant_region", "regions")})
+    yield ("clima", payload["nasa_power_data"])
+    yield ("ndvi", {
+        "desde": start_date, "hasta": end_date, "ndvi_data": ndvi_data["ndvi_data"],
+        "escala_m": ndvi_data.get("escala_m"),
+    })
+    yield ("fin", {})
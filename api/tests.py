@@ -1,3 +1,1086 @@
-from django.test import TestCase
+from datetime import date
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from .models import Job, Paddock
+from .ndvi_store import extend_coverage, missing_ranges
+
+
+class PaddockCoverageTests(TestCase):
+    """Tramos consultados de un potrero (ndvi_store)."""
+
+    today = date(2026, 1, 1)
+
+    def setUp(self):
+        self.paddock = Paddock.objects.create(fingerprint='potrero', coordinates=[])
+
+    def test_disjoint_ranges_are_kept(self):
+        paddock = extend_coverage(self.paddock, date(2024, 1, 1), date(2024, 3, 1), today=self.today)
+        paddock = extend_coverage(paddock, date(2024, 6, 1), date(2024, 7, 1), today=self.today)
+        self.assertEqual(paddock.coverage, [['2024-01-01', '2024-03-01'], ['2024-06-01', '2024-07-01']])
+        self.assertEqual(
+            missing_ranges(paddock, date(2023, 12, 1), date(2024, 8, 1)),
+            [
+                (date(2023, 12, 1), date(2024, 1, 1)),
+                (date(2024, 3, 1), date(2024, 6, 1)),
+                (date(2024, 7, 1), date(2024, 8, 1)),
+            ],
+        )
+        self.assertEqual(missing_ranges(paddock, date(2024, 1, 15), date(2024, 2, 1)), [])
+
+    def test_touching_ranges_are_merged(self):
+        paddock = extend_coverage(self.paddock, date(2024, 1, 1), date(2024, 3, 1), today=self.today)
+        paddock = extend_coverage(paddock, date(2024, 6, 1), date(2024, 7, 1), today=self.today)
+        paddock = extend_coverage(paddock, date(2024, 3, 1), date(2024, 6, 1), today=self.today)
+        self.assertEqual(paddock.coverage, [['2024-01-01', '2024-07-01']])
+
+    def test_recent_days_are_not_covered(self):
+        paddock = extend_coverage(self.paddock, date(2025, 12, 1), date(2026, 1, 1), today=self.today)
+        self.assertEqual(paddock.coverage, [['2025-12-01', '2025-12-27']])
+        self.assertEqual(
+            missing_ranges(paddock, date(2025, 12, 1), date(2026, 1, 1)),
+            [(date(2025, 12, 27), date(2026, 1, 1))],
+        )
+
+
+class GeometryTests(SimpleTestCase):
+    """Validación y normalización de polígonos (geometry)."""
+
+    # Un cuadrado de 0,01° de lado en La Pampa
+    square = [[-64.3, -36.6], [-64.29, -36.6], [-64.29, -36.59], [-64.3, -36.59], [-64.3, -36.6]]
+
+    def test_bow_tie_is_rejected(self):
+        from .geometry import GeometryError, normalize_polygon
+
+        bow_tie = [[-64.3, -36.6], [-64.29, -36.59], [-64.29, -36.6], [-64.3, -36.59]]
+        with self.assertRaisesMessage(GeometryError, "se corta a sí mismo"):
+            normalize_polygon([bow_tie])
+
+    def test_hole_outside_shell_is_rejected(self):
+        from .geometry import GeometryError, normalize_polygon
+
+        hole = [[-64.28, -36.6], [-64.275, -36.6], [-64.275, -36.595], [-64.28, -36.595]]
+        with self.assertRaisesMessage(GeometryError, "dentro del borde exterior"):
+            normalize_polygon([self.square, hole])
+
+    def test_simplification_respects_max_vertices(self):
+        import math
+
+        from .geometry import MAX_VERTICES, LocalProjection, normalize_polygon
+
+        # Un círculo de 1 km de radio con un borde dentado de 10 m: Douglas-Peucker con la
+        # tolerancia inicial no puede sacar ningún vértice
+        projection = LocalProjection(-64.3, -36.6)
+        count = 4 * MAX_VERTICES
+        ring = []
+        for i in range(count):
+            radius, angle = 1000 - 10 * (i % 2), 2 * math.pi * i / count
+            ring.append(list(projection.inverse(radius * math.cos(angle), radius * math.sin(angle))))
+        rings = normalize_polygon([ring])
+        self.assertLessEqual(len(rings[0]) - 1, MAX_VERTICES)
+        self.assertEqual(rings[0][0], rings[0][-1])
+
+    def test_square_area(self):
+        import math
+
+        from .geometry import EARTH_RADIUS, geodesic_area, normalize_polygon
+
+        # Un rectángulo en longitud y latitud sobre la esfera: R² · Δλ · (sen φ2 − sen φ1)
+        expected = EARTH_RADIUS ** 2 * math.radians(0.01) * (math.sin(math.radians(-36.59)) - math.sin(math.radians(-36.6)))
+        self.assertAlmostEqual(geodesic_area(normalize_polygon([self.square])), expected, delta=0.01)
+        # Unas 99,5 ha
+        self.assertAlmostEqual(expected / 10000, 99.5, delta=0.1)
+
+    def test_fingerprint_ignores_start_and_orientation(self):
+        from .geometry import fingerprint
+
+        hole = [[-64.298, -36.598], [-64.298, -36.596], [-64.296, -36.596], [-64.296, -36.598], [-64.298, -36.598]]
+        rotated = self.square[2:-1] + self.square[:3]
+        reversed_hole = hole[::-1]
+        self.assertEqual(fingerprint([self.square, hole]), fingerprint([rotated[::-1], reversed_hole]))
+        # Sin cerrar el anillo también
+        self.assertEqual(fingerprint([self.square]), fingerprint([rotated[:-1]]))
+        self.assertNotEqual(fingerprint([self.square]), fingerprint([self.square, hole]))
+
+
+class PlanReductionTests(SimpleTestCase):
+    """Escala de las reducciones según el tamaño del polígono (evaluate.plan_reduction)."""
+
+    def rectangle(self, width, height):
+        from .geometry import LocalProjection
+
+        projection = LocalProjection(-64.3, -36.6)
+        corners = [(0, 0), (width, 0), (width, height), (0, height), (0, 0)]
+        return [[list(projection.inverse(x, y)) for x, y in corners]]
+
+    def plan(self, width, height):
+        from .evaluate import plan_reduction
+        from .geometry import geodesic_area
+
+        rings = self.rectangle(width, height)
+        plan = plan_reduction(rings)
+        return plan["scale"], round(geodesic_area(rings) / plan["scale"] ** 2), plan["tileScale"]
+
+    def test_scale_by_size(self):
+        # Chico (5 ha) y mediano (500 ha): la escala de siempre
+        self.assertEqual(self.plan(224, 224), (30, 56, 1))
+        self.assertEqual(self.plan(2236, 2236), (30, 5555, 1))
+        # Grande (50.000 ha): los píxeles de borde son el 2 % del área, con unos 40.000 píxeles
+        self.assertEqual(self.plan(22360, 22360), (112, 39857, 1))
+        # El más grande que se acepta (200.000 ha): la misma cantidad de píxeles
+        self.assertEqual(self.plan(44721, 44721), (224, 39859, 1))
+        # Grande y angosto (50.000 ha en 100 × 5 km): más píxeles, repartidos en más tiles
+        self.assertEqual(self.plan(100_000, 5000), (48, 217010, 4))
+
+    def test_edge_fraction(self):
+        from .evaluate import MAX_EDGE_FRACTION
+
+        for width, height in ((22360, 22360), (100_000, 5000), (30_000, 5000)):
+            scale, _, _ = self.plan(width, height)
+            edge_fraction = 2 * (width + height) * scale / (width * height)
+            self.assertAlmostEqual(edge_fraction, MAX_EDGE_FRACTION, delta=0.001)
+
+
+class ForageTests(TestCase):
+    """Modelo de crecimiento de forraje (forage)."""
+
+    def test_interpolate_daily_edges_and_gaps(self):
+        import numpy as np
+
+        from .forage import interpolate_daily
+
+        nan = np.nan
+        daily = interpolate_daily(
+            [[2, 6, nan], [nan, 3, nan], [nan, nan, nan]],
+            [[0.2, 0.6, nan], [0.5, 0.4, nan], [nan, nan, nan]],
+            8,
+        )
+        # Antes de la primera y después de la última observación se repite el valor más cercano
+        np.testing.assert_allclose(daily[0], [0.2, 0.2, 0.2, 0.3, 0.4, 0.5, 0.6, 0.6])
+        # Las observaciones sin día no cuentan
+        np.testing.assert_allclose(daily[1], [0.4] * 8)
+        self.assertTrue(np.isnan(daily[2]).all())
+
+    def test_fpar_is_clipped(self):
+        import numpy as np
+
+        from .forage import FPAR_MAX, fpar_from_ndvi
+
+        np.testing.assert_allclose(fpar_from_ndvi(np.array([-0.2, 0.5, 0.95])), [0.0, 0.6, FPAR_MAX])
+
+    def test_temperature_factor(self):
+        import numpy as np
+
+        from .forage import temperature_factor
+
+        np.testing.assert_allclose(temperature_factor(np.array([0.0, 5.0, 12.5, 20.0, 30.0]), 5.0, 20.0),
+                                   [0.0, 0.0, 0.5, 1.0, 1.0])
+
+    def test_forage_growth_by_hand(self):
+        from .forage import W_M2_TO_MJ_M2_DAY, forage_growth
+
+        # 200 W/m² = 17,28 MJ/m²/día; fPAR 0,6 × 17,28 × EUR 1 × f(T) 0,5 × (1 - 0,2)
+        # = 4,1472 g/m² = 41,472 kg/ha por día
+        par = 200 * W_M2_TO_MJ_M2_DAY
+        self.assertAlmostEqual(float(forage_growth(0.5, par, 12.5, 1.0, 5.0, 20.0, 0.2)), 41.472)
+
+    def test_stack_inputs_uses_daily_radiation(self):
+        import numpy as np
+
+        from .forage import stack_inputs
+
+        result = {
+            "ndvi_data": {"ndvi_data": []},
+            "nasa_power_data": [
+                {"fecha": "2024-01-01", "temperatura": 20.0, "radiacion_diaria": 100.0,
+                 "radiacion": 150.0, "radiacion_media": 90.0},
+                {"fecha": "2024-01-02", "temperatura": 21.0, "radiacion_diaria": None,
+                 "radiacion": 150.0, "radiacion_media": 90.0},
+            ],
+        }
+        _, _, _, par, temperature = stack_inputs([result], "2024-01-01", "2024-01-02")
+        np.testing.assert_allclose(par[0], [8.64, 7.776])
+        np.testing.assert_allclose(temperature[0], [20.0, 21.0])
+
+
+class OfflineViewTests(TransactionTestCase):
+    """
+    /api/ndvi/, /api/ndvi/lote/ y /api/ndvi/stream/ de punta a punta, con los dobles de Earth
+    Engine y de NASA POWER del banco de pruebas (ver benchmark), sin salir a la red. Las etapas
+    corren en otros hilos, que no verían los datos de la transacción de un TestCase.
+    """
+
+    def setUp(self):
+        import tempfile
+
+        from . import benchmark
+
+        self.fake_ee = benchmark.FakeEarthEngine(benchmark.synthetic_ee_fixture())
+        self.fake_power = benchmark.FakePowerServer()
+        directory = tempfile.TemporaryDirectory(prefix='tests-ndvi-')
+        self.addCleanup(directory.cleanup)
+        services = benchmark.offline_services(self.fake_ee, self.fake_power, directory.name)
+        services.__enter__()
+        self.addCleanup(services.__exit__, None, None, None)
+        self.polygons = benchmark.sample_polygons(2, seed=1)
+
+    def post(self, path, payload, **extra):
+        import json
+
+        return self.client.post(path, json.dumps(payload), content_type='application/json', **extra)
+
+    def test_ndvi(self):
+        payload = {"coordinates": self.polygons[0], "start_date": "2024-01-01", "end_date": "2024-02-01"}
+        response = self.post('/api/ndvi/', payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["ndvi_data"]["dominant_region"]["name"], "Caldenal")
+        self.assertEqual([row["fecha"] for row in data["ndvi_data"]["ndvi_data"]][:2], ["2024-01-01", "2024-01-06"])
+        self.assertEqual(len(data["nasa_power_data"]), 32)
+        self.assertIsNotNone(data["nasa_power_data"][0]["radiacion_diaria"])
+
+        # La segunda vez sale de la caché de respuestas
+        calls = self.fake_ee.calls.count, self.fake_power.calls.count
+        self.assertEqual(self.post('/api/ndvi/', payload).status_code, 200)
+        self.assertEqual((self.fake_ee.calls.count, self.fake_power.calls.count), calls)
+
+    def test_batch(self):
+        features = [
+            {"type": "Feature", "id": f"potrero-{index}", "geometry": {"type": "Polygon", "coordinates": rings}}
+            for index, rings in enumerate(self.polygons)
+        ]
+        response = self.post('/api/ndvi/lote/', {
+            "type": "FeatureCollection", "features": features, "start_date": "2024-01-01", "end_date": "2024-02-01",
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(list(data), ["potrero-0", "potrero-1"])
+        for result in data.values():
+            self.assertEqual(result["ndvi_data"]["dominant_region"]["name"], "Caldenal")
+            self.assertTrue(result["ndvi_data"]["ndvi_data"])
+
+    def test_batch_local_histogram_uses_normalized_rings(self):
+        from unittest import mock
+
+        from .evaluate import get_batch_ndvi_and_regions
+        from .geometry import normalize_polygon
+
+        # Sin cerrar y en sentido horario: el índice local tiene que recibirlo normalizado
+        ring = self.polygons[0][0][:-1][::-1]
+        index = mock.Mock()
+        index.histogram.return_value = {22: 10}
+        with mock.patch('api.evaluate.get_vegetation_index', return_value=index):
+            results = get_batch_ndvi_and_regions({'potrero': [ring]}, '2024-01-01', '2024-02-01')
+        index.histogram.assert_called_once_with(normalize_polygon([ring]))
+        self.assertTrue(results['potrero']['ndvi_data'])
+
+    def test_stream(self):
+        import json
+
+        payload = {"coordinates": self.polygons[0], "start_date": "2024-01-01", "end_date": "2024-02-01"}
+        response = self.post('/api/ndvi/stream/', payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept', response['Vary'])
+        events = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        kinds = [event["tipo"] for event in events]
+        self.assertNotIn("error", kinds)
+        self.assertEqual({"unidad_vegetacion", "clima", "ndvi", "fin"}, set(kinds))
+        self.assertEqual(kinds[-1], "fin")
+
+
+class VegetationIndexTests(SimpleTestCase):
+    """
+    Índice local de unidades de vegetación (vegetation_index) sobre un ráster sintético de
+    10 × 10 píxeles de 0,01° en teselas de 4 × 4: clase 22 en las columnas 0 a 4, clase 31 en
+    las demás y la fila 0 sin dato.
+    """
+
+    origin = (-60.0, -35.0)
+    pixel_size = (0.01, 0.01)
+
+    def setUp(self):
+        import tempfile
+
+        import numpy as np
+
+        from .vegetation_index import VegetationIndex, write_index
+
+        directory = tempfile.TemporaryDirectory(prefix='tests-uv-')
+        self.addCleanup(directory.cleanup)
+        classes = np.full((10, 10), 22, dtype=np.uint8)
+        classes[:, 5:] = 31
+        classes[0] = 0
+        write_index(directory.name, classes, self.origin, self.pixel_size, nodata=0, tile_size=4)
+        self.index = VegetationIndex(directory.name)
+
+    def ring(self, col0, row0, col1, row1):
+        """Anillo del rectángulo entre los bordes de píxel indicados."""
+        (lon0, lat0), (dx, dy) = self.origin, self.pixel_size
+        west, east = lon0 + col0 * dx, lon0 + col1 * dx
+        north, south = lat0 - row0 * dy, lat0 - row1 * dy
+        return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+    def test_tiles_are_read_back(self):
+        self.assertEqual(self.index.read((0, 10, 0, 10)).shape, (10, 10))
+        self.assertEqual(self.index.class_at(-59.995, -35.055), 22)
+        self.assertEqual(self.index.class_at(-59.935, -35.095), 31)
+
+    def test_polygon_across_tiles(self):
+        # Columnas 1 a 6 y filas 2 a 7: cruza los bordes de tesela de la fila 4 y la columna 4
+        self.assertEqual(self.index.histogram([self.ring(1, 2, 7, 8)]), {22: 24, 31: 12})
+
+    def test_polygon_with_hole(self):
+        rings = [self.ring(1, 2, 7, 8), self.ring(2, 3, 4, 5)[::-1]]
+        self.assertEqual(self.index.histogram(rings), {22: 20, 31: 12})
+
+    def test_rasterize_leaves_hole_out(self):
+        from .vegetation_index import rasterize
+
+        mask = rasterize([self.ring(1, 2, 7, 8), self.ring(2, 3, 4, 5)], self.origin, self.pixel_size, (0, 10, 0, 10))
+        self.assertEqual(int(mask.sum()), 32)
+        self.assertFalse(mask[3:5, 2:4].any())
+        self.assertTrue(mask[2, 1] and mask[7, 6])
+        self.assertFalse(mask[1, 1] or mask[2, 7])
+
+    def test_nodata_is_excluded(self):
+        self.assertEqual(self.index.histogram([self.ring(0, 0, 2, 2)]), {22: 2})
+
+    def test_polygon_smaller_than_a_pixel(self):
+        (lon0, lat0), (dx, dy) = self.origin, self.pixel_size
+        # Un cuadrado de 0,2 píxeles dentro del píxel (fila 5, columna 6), lejos de su centro
+        west, north = lon0 + 6.1 * dx, lat0 - 5.1 * dy
+        tiny = [[west, north - 0.2 * dy], [west + 0.2 * dx, north - 0.2 * dy], [west + 0.2 * dx, north],
+                [west, north], [west, north - 0.2 * dy]]
+        self.assertEqual(self.index.histogram([tiny]), {31: 1})
+        # Si el centroide cae en un píxel sin dato no hay clase
+        west, north = lon0 + 6.1 * dx, lat0 - 0.1 * dy
+        tiny = [[west, north - 0.2 * dy], [west + 0.2 * dx, north - 0.2 * dy], [west + 0.2 * dx, north],
+                [west, north], [west, north - 0.2 * dy]]
+        self.assertEqual(self.index.histogram([tiny]), {})
+
+    def test_class_codes_above_255_are_rejected(self):
+        import os
+        import tempfile
+
+        import numpy as np
+
+        from .vegetation_index import write_index
+
+        classes = np.full((6, 6), 22, dtype=np.int32)
+        classes[5, 5] = 300
+        with tempfile.TemporaryDirectory(prefix='tests-uv-') as directory:
+            with self.assertRaises(ValueError):
+                write_index(directory, classes, self.origin, self.pixel_size, tile_size=4)
+            # No queda un índice a medio escribir
+            self.assertEqual(os.listdir(directory), [])
+
+
+class BuildParClimatologyTests(SimpleTestCase):
+    """build_par_climatology sobre una grilla de 2 × 2 celdas servida por FakePowerServer."""
+
+    # Celdas (-122, -72) a (-121, -71) de la grilla de 0,5° de POWER
+    bbox = ('-60.9', '-35.9', '-60.1', '-35.1')
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+
+        from . import benchmark, par_climatology
+
+        directory = tempfile.TemporaryDirectory(prefix='tests-par-')
+        self.addCleanup(directory.cleanup)
+        services = benchmark.offline_services(
+            benchmark.FakeEarthEngine(benchmark.synthetic_ee_fixture()), benchmark.FakePowerServer(), directory.name
+        )
+        services.__enter__()
+        self.addCleanup(services.__exit__, None, None, None)
+        for name in ('_grid', '_grid_path'):
+            patcher = mock.patch.object(par_climatology, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # --power-url apunta a otro servidor, para comprobar que se usa en lugar de POWER_BASE_URL
+        self.power = benchmark.FakePowerServer().start()
+        self.addCleanup(self.power.stop)
+
+    def build(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        output = StringIO()
+        call_command('build_par_climatology', '--bbox', *self.bbox, '--power-url', self.power.url,
+                     '--workers', '2', stdout=output)
+        return output.getvalue()
+
+    def test_resume_and_activate(self):
+        import os
+        from pathlib import Path
+        from unittest import mock
+
+        from django.conf import settings
+        from django.core.management import CommandError
+
+        from . import par_climatology
+        from .management.commands import build_par_climatology
+        from .ndvi_script import history_years_for
+        from .power_cache import cell_center
+        from .power_client import PowerServiceError
+
+        root = Path(settings.PAR_CLIMATOLOGY_DIR)
+        (root / '2000-2009').mkdir(parents=True)
+        (root / par_climatology.ACTIVE_FILE).write_text('2000-2009')
+        years = history_years_for()
+        cells = [(-122, -72), (-121, -72), (-122, -71), (-121, -71)]
+
+        # Primera corrida: una celda falla, la grilla queda a medias y no se publica
+        original = build_par_climatology.cell_statistics
+
+        def failing(cell, *args):
+            if cell == cells[0]:
+                raise PowerServiceError("NASA POWER no respondió.")
+            return original(cell, *args)
+
+        with mock.patch.object(build_par_climatology, 'cell_statistics', failing):
+            with self.assertRaises(CommandError):
+                self.build()
+        self.assertEqual((root / par_climatology.ACTIVE_FILE).read_text(), '2000-2009')
+        self.assertEqual(self.power.calls.count, 3)
+
+        # Segunda corrida: sólo se calcula la celda que faltaba y se publica la grilla nueva
+        output = self.build()
+        self.assertIn("1 de 4 celdas por calcular", output)
+        self.assertEqual(self.power.calls.count, 4)
+        self.assertEqual((root / par_climatology.ACTIVE_FILE).read_text(), par_climatology.window_name(years))
+        # La grilla vieja se borra
+        self.assertEqual(set(os.listdir(root)), {par_climatology.ACTIVE_FILE, par_climatology.window_name(years)})
+        for cell in cells:
+            climatology = par_climatology.lookup(*cell_center(cell), years, ['p95'])
+            self.assertIsNotNone(climatology)
+            self.assertEqual(len(climatology['p95']), 366)
+
+
+class ProcessInventoryTests(TransactionTestCase):
+    """
+    process_inventory de punta a punta con un pool de procesos de verdad (spawn), cada uno con
+    los dobles de GEE y POWER (ver benchmark.install_fake_services).
+    """
+
+    def setUp(self):
+        import json
+        import tempfile
+        from functools import partial
+        from pathlib import Path
+        from unittest import mock
+
+        from . import benchmark
+        from .management.commands.process_inventory import Command
+
+        directory = tempfile.TemporaryDirectory(prefix='tests-inventario-')
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.fake_power = benchmark.FakePowerServer()
+        services = benchmark.offline_services(
+            benchmark.FakeEarthEngine(benchmark.synthetic_ee_fixture()), self.fake_power, directory.name
+        )
+        services.__enter__()
+        self.addCleanup(services.__exit__, None, None, None)
+        worker_setup = partial(benchmark.install_fake_services, directory.name, self.fake_power.url)
+        patcher = mock.patch.object(Command, 'worker_setup', worker_setup)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        features = [
+            {"type": "Feature", "id": f"potrero-{index}", "geometry": {"type": "Polygon", "coordinates": rings}}
+            for index, rings in enumerate(benchmark.sample_polygons(2, seed=3))
+        ]
+        features.append({"type": "Feature", "id": "punto", "geometry": {"type": "Point", "coordinates": [0, 0]}})
+        self.inventory = self.directory / 'inventario.geojson'
+        self.inventory.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+
+    def run_command(self, output, *args):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        stdout = StringIO()
+        call_command('process_inventory', str(self.inventory), str(output), '--start-date', '2024-01-01',
+                     '--end-date', '2024-01-31', '--workers', '1', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_csv(self):
+        import csv
+
+        output = self.directory / 'salida.csv'
+        stdout = self.run_command(output)
+        self.assertIn("2 de 2 potreros por calcular (1 con geometría inválida)", stdout)
+        with open(output, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual({row['id'] for row in rows}, {'potrero-0', 'potrero-1'})
+        # Una fila por potrero y día
+        self.assertEqual(len(rows), 2 * 31)
+        self.assertEqual({row['unidad_vegetacion'] for row in rows}, {'Caldenal'})
+        self.assertFalse((self.directory / 'salida.csv.partes').exists())
+        self.assertGreater(self.fake_power.calls.count, 0)
+
+    def test_invalid_dates(self):
+        from django.core.management import CommandError
+
+        with self.assertRaisesMessage(CommandError, "YYYY-MM-DD"):
+            self.run_command(self.directory / 'salida.csv', '--start-date', '2024-13-01')
+        with self.assertRaisesMessage(CommandError, "--end-date"):
+            self.run_command(self.directory / 'salida.csv', '--start-date', '2024-02-01')
+
+
+class RendererTests(SimpleTestCase):
+    """Formatos de las respuestas de NDVI (renderers) y su compresión (compression)."""
+
+    result = {
+        "ndvi_data": {
+            "ndvi_data": [
+                {"fecha": "2024-01-01", "NDVI": 0.5, "fraccion_despejada": 1.0},
+                {"fecha": "2024-01-06", "NDVI": 0.6, "fraccion_despejada": 0.9},
+            ],
+            "dominant_region": {"name": "Caldenal"},
+            "regions": [],
+            "escala_m": 10,
+        },
+        "nasa_power_data": [
+            {"fecha": "2024-01-01", "latitud": -36.5, "temperatura": 20.0},
+            {"fecha": "2024-01-02", "latitud": -36.5, "temperatura": 21.0},
+        ],
+    }
+
+    def test_to_columnar(self):
+        from .renderers import to_columnar
+
+        columnar = to_columnar(self.result)
+        self.assertEqual(columnar["ndvi"], {
+            "fecha": ["2024-01-01", "2024-01-06"], "NDVI": [0.5, 0.6], "fraccion_despejada": [1.0, 0.9],
+        })
+        self.assertEqual(columnar["clima"], {
+            "latitud": -36.5, "fecha": ["2024-01-01", "2024-01-02"], "temperatura": [20.0, 21.0],
+        })
+        self.assertEqual(columnar["escala_m"], 10)
+        # Sin datos de clima queda la columna de fechas vacía
+        empty = to_columnar({**self.result, "nasa_power_data": []})
+        self.assertEqual(empty["clima"], {"latitud": None, "fecha": []})
+
+    def test_variant_etag(self):
+        from .renderers import ArrowRenderer, ColumnarJSONRenderer, JSONRenderer, variant_etag
+
+        self.assertEqual(variant_etag('"abc"', JSONRenderer()), '"abc"')
+        self.assertEqual(variant_etag('"abc"', ColumnarJSONRenderer()), '"abc-columnar"')
+        self.assertEqual(variant_etag('"abc"', ArrowRenderer()), '"abc-arrow"')
+
+    def test_negotiate(self):
+        from django.test import RequestFactory
+        from rest_framework.exceptions import NotAcceptable
+
+        from .renderers import negotiate
+
+        factory = RequestFactory()
+        self.assertEqual(negotiate(factory.post('/api/ndvi/'))[0].format, "json")
+        self.assertEqual(negotiate(factory.post('/api/ndvi/?format=msgpack'))[0].format, "msgpack")
+        renderer, media_type = negotiate(factory.post('/api/ndvi/', HTTP_ACCEPT='application/vnd.apache.arrow.stream'))
+        self.assertEqual((renderer.format, media_type), ("arrow", "application/vnd.apache.arrow.stream"))
+        # La interfaz navegable de DRF no se ofrece en las vistas sin DRF
+        self.assertEqual(negotiate(factory.post('/api/ndvi/', HTTP_ACCEPT='text/html, */*'))[0].format, "json")
+        with self.assertRaises(NotAcceptable):
+            negotiate(factory.post('/api/ndvi/', HTTP_ACCEPT='text/csv'))
+
+    def compress(self, accept_encoding, content=b'{"NDVI": 0.5}' * 100, content_type='application/json'):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+
+        from .compression import CompressionMiddleware
+
+        response = HttpResponse(content, content_type=content_type, headers={'ETag': '"abc"'})
+        request = RequestFactory().get('/api/ndvi/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_brotli(self):
+        import brotli
+
+        response = self.compress('gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), b'{"NDVI": 0.5}' * 100)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_gzip(self):
+        import gzip
+
+        # br con q=0 no se acepta
+        response = self.compress('br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'{"NDVI": 0.5}' * 100)
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_not_compressed(self):
+        self.assertFalse(self.compress('identity').has_header('Content-Encoding'))
+        short = self.compress('gzip, br', content=b'{}')
+        self.assertFalse(short.has_header('Content-Encoding'))
+        self.assertEqual(short['ETag'], '"abc"')
+        image = self.compress('gzip, br', content_type='image/png')
+        self.assertFalse(image.has_header('Content-Encoding'))
+
+
+class PowerClientTests(SimpleTestCase):
+    """Reintentos, límite de consultas y circuit breaker del cliente de NASA POWER (power_client)."""
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+
+        from .power_client import PowerLimiter
+
+        directory = tempfile.TemporaryDirectory(prefix='tests-power-')
+        self.addCleanup(directory.cleanup)
+        self.now = 1_000_000.0
+        for patcher in (mock.patch('api.power_client.time.time', lambda: self.now),
+                        mock.patch('api.power_client.logger')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.limiter = PowerLimiter(f'{directory.name}/limiter.sqlite3', rate=1.0, burst=2)
+
+    def state(self):
+        return self.limiter._connection().execute(
+            "SELECT failures, open_until FROM power_limiter WHERE id = 0"
+        ).fetchone()
+
+    def test_backoff(self):
+        from .power_client import BACKOFF_BASE, BACKOFF_MAX, backoff
+
+        self.assertEqual(backoff(0, "7"), 7.0)
+        self.assertEqual(backoff(0, "3600"), BACKOFF_MAX)
+        for attempt in range(8):
+            delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+            # Un Retry-After que no es un número (p. ej. una fecha) se ignora
+            self.assertTrue(delay / 2 <= backoff(attempt, "mañana") <= delay)
+
+    def test_check_attempt(self):
+        import requests
+
+        from .power_client import MAX_ATTEMPTS, PowerRequestError, PowerServiceError, check_attempt
+
+        self.assertIsNone(check_attempt(self.limiter, 0, 200, {}, None))
+        self.assertEqual(check_attempt(self.limiter, 0, 503, {"Retry-After": "2"}, None), 2.0)
+        self.assertGreater(check_attempt(self.limiter, 0, None, None, requests.ConnectionError("caída")), 0)
+        self.assertEqual(self.state()[0], 2)
+        # Un 429 se reintenta pero no es una falla de POWER
+        self.assertEqual(check_attempt(self.limiter, 1, 429, {"Retry-After": "1"}, None), 1.0)
+        self.assertEqual(self.state(), (0, 0))
+
+        with self.assertRaises(PowerRequestError) as raised:
+            check_attempt(self.limiter, 0, 422, {}, None, '{"messages": ["Fuera de rango"]}')
+        self.assertEqual((raised.exception.status_code, raised.exception.detail), (422, "Fuera de rango"))
+        with self.assertRaises(PowerServiceError) as raised:
+            check_attempt(self.limiter, MAX_ATTEMPTS - 1, 502, {}, None)
+        self.assertIsNotNone(raised.exception.retry_after)
+
+    def test_token_bucket(self):
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.assertAlmostEqual(self.limiter.try_acquire(), 1.0)
+        self.now += 0.5
+        self.assertAlmostEqual(self.limiter.try_acquire(), 0.5)
+        self.now += 0.5
+        self.assertEqual(self.limiter.try_acquire(), 0)
+
+    def test_circuit(self):
+        from .power_client import CIRCUIT_COOLDOWN, CIRCUIT_FAILURES, PowerRequestError, PowerServiceError, check_attempt
+
+        for _ in range(CIRCUIT_FAILURES):
+            self.limiter.record(ok=False)
+        with self.assertRaises(PowerServiceError) as raised:
+            self.limiter.try_acquire()
+        self.assertAlmostEqual(raised.exception.retry_after, CIRCUIT_COOLDOWN)
+
+        # Pasado el tiempo sale una sola consulta de prueba
+        self.now += CIRCUIT_COOLDOWN + 1
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        with self.assertRaises(PowerServiceError):
+            self.limiter.try_acquire()
+        # POWER respondió, aunque sea con un 4xx: el circuito se cierra
+        with self.assertRaises(PowerRequestError):
+            check_attempt(self.limiter, 0, 400, {}, None, "parámetros inválidos")
+        self.assertEqual(self.state(), (0, 0))
+        self.assertEqual(self.limiter.try_acquire(), 0)
+
+        # Una prueba que falla lo vuelve a abrir
+        for _ in range(CIRCUIT_FAILURES):
+            self.limiter.record(ok=False)
+        self.now += CIRCUIT_COOLDOWN + 1
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        check_attempt(self.limiter, 0, 503, {}, None)
+        with self.assertRaises(PowerServiceError):
+            self.limiter.try_acquire()
+
+    def test_invalid_json(self):
+        from unittest import mock
+
+        from .power_client import PowerServiceError, get_json
+
+        response = mock.Mock(status_code=200, headers={}, text="<html>")
+        response.json.side_effect = ValueError("Expecting value")
+        session = mock.Mock(get=mock.Mock(return_value=response))
+        with mock.patch('api.power_client.get_limiter', return_value=self.limiter), \
+                mock.patch('api.power_client.get_session', return_value=session):
+            with self.assertRaises(PowerServiceError):
+                get_json({}, base_url='http://power.invalid/')
+
+
+class JobTests(TestCase):
+    """Cola de trabajos en segundo plano (jobs)."""
+
+    rings = [[[-64.3, -36.6], [-64.29, -36.6], [-64.29, -36.59], [-64.3, -36.59], [-64.3, -36.6]]]
+
+    def setUp(self):
+        from django.core.cache import caches
+        from django.test import override_settings
+
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-trabajos'}
+        cache_settings = override_settings(CACHES={'default': locmem, 'ndvi': locmem})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.addCleanup(caches['ndvi'].clear)
+
+    def submit(self, end_date='2024-02-01'):
+        from .jobs import submit_job
+
+        return submit_job(self.rings, '2024-01-01', end_date)
+
+    def test_identical_job_is_reused(self):
+        job, created = self.submit()
+        self.assertTrue(created)
+        self.assertEqual(self.submit(), (job, False))
+        self.assertTrue(self.submit(end_date='2024-03-01')[1])
+
+    def submit_racing(self, winner, status):
+        """
+        submit_job con otro pedido idéntico (`winner`) que la primera búsqueda no ve, de modo
+        que el INSERT falla, y que termina con `status` antes de la búsqueda siguiente.
+        """
+        from unittest import mock
+
+        from . import jobs, response_cache
+
+        real_find = jobs.find_reusable_job
+        searches = []
+
+        def find(key):
+            searches.append(key)
+            if len(searches) == 1:
+                return None
+            if len(searches) == 2:
+                Job.objects.filter(pk=winner.pk).update(status=status)
+                if status == Job.DONE:
+                    response_cache.set_response(key, {'ndvi_data': {}}, '2024-02-01')
+            return real_find(key)
+
+        with mock.patch.object(jobs, 'find_reusable_job', find):
+            return self.submit()
+
+    def test_race_with_finished_job(self):
+        winner, _ = self.submit()
+        self.assertEqual(self.submit_racing(winner, Job.DONE), (winner, False))
+
+    def test_race_with_failed_job(self):
+        # Sin resultado que reutilizar, se encola de nuevo
+        winner, _ = self.submit()
+        job, created = self.submit_racing(winner, Job.FAILED)
+        self.assertTrue(created)
+        self.assertNotEqual(job.pk, winner.pk)
+
+    def test_claim_takes_oldest_ready_job(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from .jobs import claim_next_job
+
+        first, _ = self.submit()
+        second, _ = self.submit(end_date='2024-03-01')
+        Job.objects.filter(pk=first.pk).update(not_before=timezone.now() + timedelta(minutes=1))
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, second.pk)
+        self.assertEqual((claimed.status, claimed.attempts), (Job.RUNNING, 1))
+        self.assertIsNotNone(claimed.heartbeat_at)
+        # El otro todavía espera su reintento
+        self.assertIsNone(claim_next_job())
+
+    def test_heartbeat_and_requeue(self):
+        from django.utils import timezone
+
+        from .jobs import LEASE, MAX_ATTEMPTS, claim_next_job, heartbeat, requeue_stale_jobs
+
+        alive, _ = self.submit()
+        stale, _ = self.submit(end_date='2024-03-01')
+        exhausted, _ = self.submit(end_date='2024-04-01')
+        for _ in range(3):
+            claim_next_job()
+        Job.objects.filter(pk=exhausted.pk).update(attempts=MAX_ATTEMPTS)
+        Job.objects.update(heartbeat_at=timezone.now() - LEASE * 2)
+        heartbeat([alive.pk])
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {alive.pk: Job.RUNNING, stale.pk: Job.PENDING, exhausted.pk: Job.FAILED})
+
+    def test_retry_delay(self):
+        from .jobs import RETRY_BACKOFF, retry_delay
+
+        self.assertEqual([retry_delay(attempts) for attempts in (1, 2, 3)],
+                         [RETRY_BACKOFF, RETRY_BACKOFF * 2, RETRY_BACKOFF * 4])
+
+
+class SingleflightTests(SimpleTestCase):
+    """Pedidos iguales simultáneos (singleflight) y turnos de Earth Engine (ee_session)."""
+
+    def setUp(self):
+        import tempfile
+
+        from django.test import override_settings
+
+        directory = tempfile.TemporaryDirectory(prefix='tests-en-curso-')
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        overridden = override_settings(SINGLEFLIGHT_DIR=directory.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def test_waiter_reuses_result(self):
+        import os
+        import threading
+        from unittest import mock
+
+        from . import singleflight
+
+        cache, computed, started, finish = {}, [], threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            finish.wait(5)
+            computed.append(1)
+            cache['clave'] = 'resultado'
+            return cache['clave']
+
+        real_try_acquire, blocked = singleflight.KeyLock.try_acquire, threading.Event()
+
+        def try_acquire(lock):
+            acquired = real_try_acquire(lock)
+            if not acquired:
+                blocked.set()
+            return acquired
+
+        first = threading.Thread(target=singleflight.do, args=('clave', lambda: cache.get('clave'), compute))
+        first.start()
+        started.wait(5)
+        results = []
+        second = threading.Thread(
+            target=lambda: results.append(singleflight.do('clave', lambda: cache.get('clave'), compute))
+        )
+        with mock.patch.object(singleflight.KeyLock, 'try_acquire', try_acquire):
+            second.start()
+            # El primero termina recién cuando el segundo ya lo está esperando
+            blocked.wait(5)
+            finish.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual((results, computed), (['resultado'], [1]))
+        # El archivo del candado no queda
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_other_keys_do_not_wait(self):
+        import threading
+        import time
+
+        from . import singleflight
+
+        started, finish = threading.Event(), threading.Event()
+        holder = threading.Thread(target=singleflight.do, args=(
+            'una', lambda: None, lambda: (started.set(), finish.wait(10)),
+        ))
+        holder.start()
+        started.wait(5)
+        try:
+            # (con 1024 candados compartidos, 'una' y 'otra-643' caían en el mismo)
+            started_at = time.monotonic()
+            self.assertEqual(singleflight.do('otra-643', lambda: None, lambda: 'calculado'), 'calculado')
+            self.assertLess(time.monotonic() - started_at, 1)
+        finally:
+            finish.set()
+            holder.join(5)
+
+    def test_waiter_computes_if_lookup_misses_or_times_out(self):
+        from unittest import mock
+
+        from . import singleflight
+
+        lock = singleflight.KeyLock('clave')
+        self.assertTrue(lock.try_acquire())
+        try:
+            # Quien calculaba sigue ocupado: pasado el plazo se calcula igual
+            with mock.patch('api.singleflight.logger'):
+                self.assertEqual(singleflight.do('clave', lambda: 'viejo', lambda: 'nuevo', timeout=0.2), 'nuevo')
+        finally:
+            lock.release()
+        self.assertEqual(singleflight.do('clave', lambda: None, lambda: 'nuevo'), 'nuevo')
+
+    def test_lock_on_removed_file_is_retried(self):
+        import os
+        from unittest import mock
+
+        from . import singleflight
+
+        # Entre el open y el flock de `late`, quien tenía el candado lo soltó y borró el archivo,
+        # y otro creó uno nuevo y lo tomó
+        holder, late, newcomer = (singleflight.KeyLock('clave') for _ in range(3))
+        self.assertTrue(holder.try_acquire())
+        stale_file = open(late.path, 'a+b')
+        holder.release()
+        self.assertTrue(newcomer.try_acquire())
+        with mock.patch('api.singleflight.open', create=True, return_value=stale_file):
+            self.assertFalse(late.try_acquire())
+        self.assertTrue(stale_file.closed)
+        newcomer.release()
+        self.assertFalse(os.path.exists(late.path))
+
+    def governor(self, limit):
+        from .ee_session import EarthEngineGovernor
+
+        return EarthEngineGovernor(f'{self.directory}/turnos.sqlite3', limit)
+
+    def test_governor_serves_in_order(self):
+        governor = self.governor(limit=2)
+        first, second, third = governor.enqueue(), governor.enqueue(), governor.enqueue()
+        self.assertFalse(governor.try_acquire(third))
+        self.assertTrue(governor.try_acquire(second))
+        self.assertTrue(governor.try_acquire(first))
+        self.assertFalse(governor.try_acquire(third))
+        governor.release(first)
+        self.assertTrue(governor.try_acquire(third))
+
+    def test_governor_leases_expire(self):
+        from unittest import mock
+
+        from .ee_session import SLOT_LEASE, WAITER_LEASE
+
+        governor = self.governor(limit=1)
+        now = [1_000_000.0]
+        with mock.patch('api.ee_session.time.time', lambda: now[0]):
+            holder, _, latecomer = governor.enqueue(), governor.enqueue(), governor.enqueue()
+            self.assertTrue(governor.try_acquire(holder))
+            self.assertFalse(governor.try_acquire(latecomer))
+            # `waiter` dejó de consultar la cola: se descarta y no bloquea a los que siguen
+            now[0] += WAITER_LEASE + 1
+            self.assertFalse(governor.try_acquire(latecomer))
+            # Quien tenía el turno no lo devolvió a tiempo
+            now[0] += SLOT_LEASE
+            self.assertTrue(governor.try_acquire(latecomer))
+
+
+class ResponseCacheTests(SimpleTestCase):
+    """Claves, vigencia y ETags de la caché de respuestas (response_cache)."""
+
+    rings = [[[-64.3, -36.6], [-64.29, -36.6], [-64.29, -36.59], [-64.3, -36.59], [-64.3, -36.6]]]
+
+    def test_cache_key(self):
+        from .response_cache import cache_key
+
+        key = cache_key(self.rings, '2024-01-01', '2024-02-01', estadisticas=['p95', 'media'])
+        self.assertEqual(cache_key(self.rings, '2024-01-01', '2024-02-01', estadisticas=['media', 'p95']), key)
+        self.assertEqual(cache_key(self.rings, '2024-01-01', '2024-02-01', estadisticas=('p95', 'media', 'p95')), key)
+        # El mismo polígono empezando en otro vértice
+        rotated = [self.rings[0][1:] + self.rings[0][1:2]]
+        self.assertEqual(cache_key(rotated, '2024-01-01', '2024-02-01', estadisticas=['media', 'p95']), key)
+        self.assertNotEqual(cache_key(self.rings, '2024-01-01', '2024-02-01', estadisticas=['media']), key)
+        self.assertNotEqual(cache_key(self.rings, '2024-01-01', '2024-02-02', estadisticas=['media', 'p95']), key)
+
+    def test_timeout_for(self):
+        from .response_cache import HISTORICAL_TIMEOUT, RECENT_DAYS, RECENT_TIMEOUT, timeout_for
+
+        today = date(2024, 6, 30)
+        self.assertEqual(timeout_for('2024-06-30', today=today), RECENT_TIMEOUT)
+        self.assertEqual(timeout_for(date(2024, 6, 30 - RECENT_DAYS), today=today), RECENT_TIMEOUT)
+        self.assertEqual(timeout_for(date(2024, 6, 29 - RECENT_DAYS), today=today), HISTORICAL_TIMEOUT)
+
+    def test_etag_matches(self):
+        from .response_cache import etag_matches
+
+        self.assertTrue(etag_matches('"abc"', '"abc"'))
+        # La compresión vuelve débil al ETag y el cliente lo devuelve así
+        self.assertTrue(etag_matches('"abc"', 'W/"abc"'))
+        self.assertTrue(etag_matches('W/"abc"', '"xyz", "abc"'))
+        self.assertTrue(etag_matches('"abc"', '*'))
+        self.assertFalse(etag_matches('"abc"', '"xyz"'))
+        self.assertFalse(etag_matches('"abc"', ''))
+
+
+class TileTests(SimpleTestCase):
+    """Teselas del compuesto de NDVI (tiles y /api/ndvi/teselas/)."""
+
+    @staticmethod
+    def tile_at(z, longitud, latitud):
+        import math
+
+        n = 2 ** z
+        row = (1 - math.asinh(math.tan(math.radians(latitud))) / math.pi) / 2 * n
+        return int((longitud + 180) / 360 * n), int(row)
+
+    def test_validate_window(self):
+        from .tiles import TileRequestError, validate_window
+
+        validate_window('2024-01-01', '2024-01-02')
+        # 2024 es bisiesto: el año entero son MAX_WINDOW_DAYS días
+        validate_window('2024-01-01', '2025-01-01')
+        for start, end in (('2024-01-01', '2025-01-02'), ('2024-01-01', '2024-01-01'),
+                           ('2024-02-01', '2024-01-01'), ('2024-1-1', '2024-02-01'), ('ayer', 'hoy')):
+            with self.assertRaises(TileRequestError):
+                validate_window(start, end)
+
+    def test_in_range(self):
+        from .tiles import MAX_ZOOM, MIN_ZOOM, in_range
+
+        for z in (MIN_ZOOM, 12, MAX_ZOOM):
+            self.assertTrue(in_range(z, *self.tile_at(z, -64.3, -36.6)))
+        # Zoom fuera de 8 a 18
+        self.assertFalse(in_range(MIN_ZOOM - 1, *self.tile_at(MIN_ZOOM - 1, -64.3, -36.6)))
+        self.assertFalse(in_range(MAX_ZOOM + 1, *self.tile_at(MAX_ZOOM + 1, -64.3, -36.6)))
+        # Fuera de SERVICE_BBOX (Madrid, el Atlántico frente a Buenos Aires) o de la grilla
+        self.assertFalse(in_range(10, *self.tile_at(10, -3.7, 40.4)))
+        self.assertFalse(in_range(10, *self.tile_at(10, -50.0, -36.6)))
+        self.assertFalse(in_range(10, 2 ** 10, 0))
+        self.assertFalse(in_range(10, -1, 600))
+
+    def test_tile_is_cached(self):
+        import tempfile
+        from unittest import mock
+
+        from . import benchmark
+
+        fake_ee = benchmark.FakeEarthEngine(benchmark.synthetic_ee_fixture())
+        directory = tempfile.TemporaryDirectory(prefix='tests-teselas-')
+        self.addCleanup(directory.cleanup)
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=200, ok=True, content=b'\x89PNG tesela')
+        x, y = self.tile_at(12, -64.3, -36.6)
+        path = f'/api/ndvi/teselas/2024-01-01/2024-02-01/12/{x}/{y}.png'
+        with benchmark.offline_services(fake_ee, benchmark.FakePowerServer(), directory.name), \
+                mock.patch('api.tiles.get_session', return_value=session):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response['Content-Type'], response.content), ('image/png', b'\x89PNG tesela'))
+            session.get.assert_called_once_with(fake_ee.TILE_URL.format(z=12, x=x, y=y), timeout=mock.ANY)
+            self.assertEqual(fake_ee.calls.count, 1)
+
+            # La segunda vez sale de la caché, sin pedir otro map id ni descargarla
+            self.assertEqual(self.client.get(path).content, b'\x89PNG tesela')
+            self.assertEqual((session.get.call_count, fake_ee.calls.count), (1, 1))
+            # Otra tesela de la misma capa reutiliza el map id
+            self.assertEqual(self.client.get(f'/api/ndvi/teselas/2024-01-01/2024-02-01/12/{x + 1}/{y}.png').status_code, 200)
+            self.assertEqual((session.get.call_count, fake_ee.calls.count), (2, 1))
+
+            self.assertEqual(self.client.get(f'/api/ndvi/teselas/2024-01-01/2024-02-01/7/{x}/{y}.png').status_code, 404)
+            self.assertEqual(self.client.get(f'/api/ndvi/teselas/2024-01-01/2023-02-01/12/{x}/{y}.png').status_code, 400)
@@ -0,0 +1,160 @@
+import logging
+import math
+import threading
+from datetime import date
+
+import requests
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+
+from . import metrics, response_cache, singleflight
+
+logger = logging.getLogger(__name__)
+
+# Caché en disco de las teselas (ver settings.CACHES), limitada por tamaño
+TILE_CACHE_ALIAS = 'teselas'
+# Los map id de Earth Engine vencen; se renuevan antes y también si una tesela da 404
+MAP_ID_TIMEOUT = 6 * 60 * 60
+# Niveles de zoom servidos: por debajo una tesela abarca demasiado para calcularla a demanda
+MIN_ZOOM = 8
+MAX_ZOOM = 18
+# Sólo se sirven teselas que tocan este rectángulo (oeste, sur, este, norte): el de
+# par_climatology.ARGENTINA_BBOX, que se repite para no cargar numpy en cada tesela
+SERVICE_BBOX = (-73.6, -55.1, -53.6, -21.7)
+# Días como máximo del compuesto de una capa
+MAX_WINDOW_DAYS = 366
+TILE_TIMEOUT = 30
+POOL_SIZE = 8
+# Del suelo desnudo (marrón) a la vegetación densa (verde oscuro). Si se cambia, cambiar
+# también VISUALIZATION_VERSION para no mezclar teselas viejas con nuevas.
+NDVI_VISUALIZATION = {
+    'min': 0.0,
+    'max': 0.9,
+    'palette': ['8c510a', 'd8b365', 'f6e8c3', 'c7eae5', '91cf60', '1a9850', '004529'],
+}
+VISUALIZATION_VERSION = 1
+
+
+class TileError(Exception):
+    """Earth Engine no devolvió la tesela."""
+
+
+class TileRequestError(ValueError):
+    """La capa o la tesela pedida no es válida."""
+
+
+def validate_window(start_date, end_date):
+    """Valida el rango de fechas de una capa (YYYY-MM-DD, fin exclusivo como en /api/ndvi/)."""
+    try:
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    except ValueError:
+        raise TileRequestError("Las fechas deben tener el formato YYYY-MM-DD.")
+    if not 0 < (end - start).days <= MAX_WINDOW_DAYS:
+        raise TileRequestError(f"El rango de fechas debe tener entre 1 y {MAX_WINDOW_DAYS} días.")
+
+
+def tile_bounds(z, x, y):
+    """(oeste, sur, este, norte) en grados de la tesela XYZ (Web Mercator)."""
+    n = 2 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+
+def in_range(z, x, y):
+    """
+    Si la tesela existe y toca el área del servicio (SERVICE_BBOX). Las de afuera no se
+    calculan: cada tesela nueva consume cuota de Earth Engine y espacio en la caché.
+    """
+    if not (MIN_ZOOM <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return False
+    west, south, east, north = tile_bounds(z, x, y)
+    bbox_west, bbox_south, bbox_east, bbox_north = SERVICE_BBOX
+    return west < bbox_east and east > bbox_west and south < bbox_north and north > bbox_south
+
+
+def map_key(start_date, end_date):
+    return f"mapa:ndvi:v{VISUALIZATION_VERSION}:{start_date}:{end_date}"
+
+
+def map_url(start_date, end_date):
+    """
+    Plantilla de URL de las teselas del compuesto de NDVI de la capa. El map id se pide a
+    Earth Engine una sola vez por capa y se comparte entre los workers en la caché de respuestas.
+    """
+    key = map_key(start_date, end_date)
+    cache = caches[response_cache.CACHE_ALIAS]
+    url = cache.get(key)
+    if url is not None:
+        return url
+
+    def compute():
+        from .ee_session import ensure_earth_engine, get_map_url
+        from .evaluate import ndvi_composite
+
+        ensure_earth_engine()
+        url = get_map_url(ndvi_composite(start_date, end_date), NDVI_VISUALIZATION)
+        cache.set(key, url, MAP_ID_TIMEOUT)
+        return url
+    return singleflight.do(key, lambda: cache.get(key), compute)
+
+
+_session = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Sesión HTTP del proceso para descargar teselas, con conexiones persistentes."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def fetch_tile(start_date, end_date, z, x, y):
+    """Descarga una tesela PNG de Earth Engine; si el map id venció, lo renueva una vez."""
+    for attempt in range(2):
+        url = map_url(start_date, end_date).format(z=z, x=x, y=y)
+        try:
+            with metrics.stage('ee_tesela'):
+                response = get_session().get(url, timeout=TILE_TIMEOUT)
+        except requests.RequestException as e:
+            metrics.count_upstream('earth_engine_teselas', ok=False)
+            raise TileError(f"Error al descargar la tesela: {e}")
+        if response.status_code in (400, 404) and attempt == 0:
+            logger.info("El map id de %s a %s venció; se pide otro", start_date, end_date)
+            caches[response_cache.CACHE_ALIAS].delete(map_key(start_date, end_date))
+            continue
+        metrics.count_upstream('earth_engine_teselas', ok=response.ok)
+        if not response.ok:
+            raise TileError(f"Earth Engine respondió {response.status_code} a la tesela {z}/{x}/{y}.")
+        return response.content
+
+
+def get_tile(start_date, end_date, z, x, y):
+    """
+    Tesela PNG {z}/{x}/{y} del compuesto de NDVI de la capa. Las teselas se guardan en disco
+    (caché TILE_CACHE_ALIAS, con descarte LRU por tamaño) con la misma vigencia que las
+    respuestas de /api/ndvi/ para ese rango, y cada una se pide a Earth Engine una sola vez
+    aunque la pidan varios usuarios a la vez. Lanza TileError si no se pudo obtener.
+    """
+    key = f"tesela:v{VISUALIZATION_VERSION}:{start_date}:{end_date}:{z}:{x}:{y}"
+    cache = caches[TILE_CACHE_ALIAS]
+    tile = cache.get(key)
+    metrics.count_cache('teselas', hit=tile is not None)
+    if tile is not None:
+        return tile
+
+    def compute():
+        tile = fetch_tile(start_date, end_date, z, x, y)
+        cache.set(key, tile, response_cache.timeout_for(end_date))
+        return tile
+    return singleflight.do(key, lambda: cache.get(key), compute)
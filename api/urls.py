@@ -1,11 +1,17 @@
 from django.urls import path, include
 from rest_framework import routers
 from api import views
-from .views import NDVIAPIView
+from .views import NDVIAPIView, NDVIAsyncView, NDVIBatchAPIView, NDVIStreamView, NDVIJobAPIView, NDVIJobDetailAPIView, NDVITileView, PastureAvailabilityAPIView
 from rest_framework.documentation import include_docs_urls
-# from .views import PastureAvailabilityAPIView
 
 urlpatterns = [
     path('ndvi/', NDVIAPIView.as_view(), name='ndvi'),
-    # path('disponibilidad/', PastureAvailabilityAPIView.as_view(), name='pasto-disponibilidad'),
+    path('ndvi/async/', NDVIAsyncView.as_view(), name='ndvi-async'),
+    path('ndvi/lote/', NDVIBatchAPIView.as_view(), name='ndvi-lote'),
+    path('ndvi/stream/', NDVIStreamView.as_view(), name='ndvi-stream'),
+    path('ndvi/trabajos/', NDVIJobAPIView.as_view(), name='ndvi-trabajos'),
+    path('ndvi/trabajos/<uuid:job_id>/', NDVIJobDetailAPIView.as_view(), name='ndvi-trabajo'),
+    path('ndvi/teselas/<str:start_date>/<str:end_date>/<int:z>/<int:x>/<int:y>.png', NDVITileView.as_view(),
+         name='ndvi-teselas'),
+    path('disponibilidad/', PastureAvailabilityAPIView.as_view(), name='pasto-disponibilidad'),
 ]
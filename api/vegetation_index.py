@@ -0,0 +1,232 @@
+import json
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .geometry import centroid
+
+# Nombres de las unidades de vegetación de Raster_UV, indexados por el código de clase
+VEGETATION_UNIT_NAMES = (
+    None,
+    'Selva Montana y Bosque de Aliso y Pino del cerro',
+    'Selva de Transicion',
+    'Selva Misionera-Selva Paranaense',
+    'Valle del Parana',
+    'Delta del Parana',
+    'Prepuna',
+    'Chaco Serrano',
+    'Pastizales de Altura',
+    'Chaco Arido',
+    'Salinas Grandes',
+    'Banados de Mar Chiquita-Espartillares y zampales',
+    'Chaco Semiarido',
+    'Chaco Subhumedo',
+    'Chaco Humedo con Bosques, Pajonales y Palmares de Caranday',
+    'Chaco Humedo con Bosques y Canadas',
+    'Bajos Submeridionales-Espartillares',
+    'Pajonales y Palmares de Yatay',
+    'Esteros del Ibera',
+    'Nandubayzal y Selva de Montiel',
+    'Espinillar',
+    'Algarrobal',
+    'Caldenal',
+    'Monte de Sierras y Bolsones',
+    'Bolsones Endorreicos',
+    'Monte Austral o Tipico',
+    'Monte Oriental o de Transicion',
+    'Campos y Urundayzales',
+    'Malezales',
+    'Pampa Mesopotamica',
+    'Pampa Ondulada',
+    'Pampa Interior Plana',
+    'Pampa Interior Occidental',
+    'Pampa Deprimida',
+    'Pampa Austral',
+    'Puna',
+    'Provincia Altoandina',
+    'Distrito de la Payunia',
+    'Distrito Subandino-Estepa de coiron blanco',
+    'Distrito Occidental',
+    'Distrito Central-Estepa arbustiva de quilenbai',
+    'Distrito Central-Estepa arbustiva serrana',
+    'Distrito Central-Erial',
+    'Distrito del Golfo San Jorge',
+    'Distrito Central',
+    'Estepa arbustiva de mata negra',
+    'Distrito Subandino-Estepa magallanica seca',
+    'Distrito Fueguino-Estepa magallanica humeda',
+    'Ecotono Rionegrino',
+    'Ecotono de la Peninsula de Valdes',
+    'Bosques Andino-Patagonicos',
+)
+
+DATA_FILE = 'clases.npy'
+METADATA_FILE = 'metadata.json'
+DEFAULT_TILE_SIZE = 256
+
+
+def unit_name(code):
+    """Nombre de la unidad de vegetación para un código de clase (int, o clave "25.0" de GEE)."""
+    code = int(float(code))
+    if 0 <= code < len(VEGETATION_UNIT_NAMES) and VEGETATION_UNIT_NAMES[code]:
+        return VEGETATION_UNIT_NAMES[code]
+    return "Unknown"
+
+
+def write_index(directory, classes, origin, pixel_size, nodata=0, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Guarda un ráster de clases (arreglo 2D, fila 0 al norte, en grados) como un arreglo de
+    teselas tile_size × tile_size en disco, listo para abrir con VegetationIndex.
+
+    `origin` es (longitud, latitud) de la esquina noroeste y `pixel_size` el tamaño del píxel
+    (ancho, alto) en grados. El ráster se copia de a una fila de teselas, así que puede ser un
+    memmap más grande que la memoria.
+    """
+    height, width = classes.shape
+    tiles_y, tiles_x = math.ceil(height / tile_size), math.ceil(width / tile_size)
+    os.makedirs(directory, exist_ok=True)
+
+    tmp_path = os.path.join(directory, DATA_FILE + '.tmp')
+    tiles = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.uint8, shape=(tiles_y, tiles_x, tile_size, tile_size)
+    )
+    try:
+        for tile_row in range(tiles_y):
+            band = np.full((tile_size, tiles_x * tile_size), nodata, dtype=np.uint8)
+            rows = np.asarray(classes[tile_row * tile_size:(tile_row + 1) * tile_size])
+            if rows.size and (rows.min() < 0 or rows.max() > 255):
+                raise ValueError("Los códigos de clase deben estar entre 0 y 255.")
+            band[:rows.shape[0], :width] = rows
+            tiles[tile_row] = band.reshape(tile_size, tiles_x, tile_size).swapaxes(0, 1)
+        tiles.flush()
+    except BaseException:
+        del tiles
+        os.remove(tmp_path)
+        raise
+    del tiles
+    os.replace(tmp_path, os.path.join(directory, DATA_FILE))
+
+    metadata = {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'origin': list(origin),
+        'pixel_size': list(pixel_size),
+        'nodata': nodata,
+    }
+    with open(os.path.join(directory, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f)
+
+
+def rasterize(rings, origin, pixel_size, window):
+    """
+    Máscara booleana de los píxeles de `window` (fila0, fila1, col0, col1) cuyo centro cae
+    dentro del polígono. Se recorre por filas: en cada fila se calculan los cruces con todos los
+    bordes a la vez y se completa por paridad, así que los huecos quedan afuera.
+    """
+    row0, row1, col0, col1 = window
+    (lon0, lat0), (dx, dy) = origin, pixel_size
+    latitudes = lat0 - (np.arange(row0, row1) + 0.5) * dy
+
+    parity = np.zeros((row1 - row0, col1 - col0 + 1), dtype=np.int32)
+    for ring in rings:
+        ring = np.asarray(ring, dtype=float)
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        crosses = (y1 <= latitudes[:, None]) != (y2 <= latitudes[:, None])
+        row_index, edge_index = np.nonzero(crosses)
+        y = latitudes[row_index]
+        x1, y1, x2, y2 = x1[edge_index], y1[edge_index], x2[edge_index], y2[edge_index]
+        x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        # Primer píxel cuyo centro queda a la derecha del cruce
+        columns = np.floor((x - lon0) / dx - 0.5).astype(np.int64) + 1 - col0
+        np.add.at(parity, (row_index, np.clip(columns, 0, col1 - col0)), 1)
+    return (np.cumsum(parity, axis=1)[:, :-1] % 2) == 1
+
+
+class VegetationIndex:
+    """Ráster de unidades de vegetación en teselas mapeadas en memoria (ver write_index)."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.width = metadata['width']
+        self.height = metadata['height']
+        self.tile_size = metadata['tile_size']
+        self.origin = tuple(metadata['origin'])
+        self.pixel_size = tuple(metadata['pixel_size'])
+        self.nodata = metadata['nodata']
+        self.tiles = np.load(os.path.join(directory, DATA_FILE), mmap_mode='r')
+
+    def pixel_window(self, rings):
+        """(fila0, fila1, col0, col1) de los píxeles que cubre el rectángulo del polígono."""
+        (lon0, lat0), (dx, dy) = self.origin, self.pixel_size
+        exterior = np.asarray(rings[0], dtype=float)
+        col0 = max(int(math.floor((exterior[:, 0].min() - lon0) / dx)), 0)
+        col1 = min(int(math.ceil((exterior[:, 0].max() - lon0) / dx)), self.width)
+        row0 = max(int(math.floor((lat0 - exterior[:, 1].max()) / dy)), 0)
+        row1 = min(int(math.ceil((lat0 - exterior[:, 1].min()) / dy)), self.height)
+        return row0, max(row1, row0), col0, max(col1, col0)
+
+    def read(self, window):
+        """Clases de la ventana, leyendo sólo las teselas que toca."""
+        row0, row1, col0, col1 = window
+        size = self.tile_size
+        classes = np.empty((row1 - row0, col1 - col0), dtype=np.uint8)
+        for tile_row in range(row0 // size, (row1 - 1) // size + 1):
+            for tile_col in range(col0 // size, (col1 - 1) // size + 1):
+                top, left = tile_row * size, tile_col * size
+                r0, r1 = max(row0, top), min(row1, top + size)
+                c0, c1 = max(col0, left), min(col1, left + size)
+                classes[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = \
+                    self.tiles[tile_row, tile_col, r0 - top:r1 - top, c0 - left:c1 - left]
+        return classes
+
+    def class_at(self, longitud, latitud):
+        (lon0, lat0), (dx, dy) = self.origin, self.pixel_size
+        row, col = int((lat0 - latitud) // dy), int((longitud - lon0) // dx)
+        if 0 <= row < self.height and 0 <= col < self.width:
+            return int(self.read((row, row + 1, col, col + 1))[0, 0])
+        return self.nodata
+
+    def histogram(self, rings):
+        """
+        Píxeles de cada clase dentro del polígono, como { código: píxeles }. Si el polígono es
+        más chico que un píxel se toma la clase del píxel que contiene a su centroide.
+        """
+        window = self.pixel_window(rings)
+        row0, row1, col0, col1 = window
+        counts = {}
+        if row1 > row0 and col1 > col0:
+            classes = self.read(window)[rasterize(rings, self.origin, self.pixel_size, window)]
+            frequencies = np.bincount(classes, minlength=256)
+            frequencies[self.nodata] = 0
+            counts = {int(code): int(frequencies[code]) for code in np.flatnonzero(frequencies)}
+        if not counts and row1 > row0 and col1 > col0:
+            code = self.class_at(*centroid(rings))
+            if code != self.nodata:
+                counts = {code: 1}
+        return counts
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vegetation_index():
+    """
+    Índice local del proceso, o None si todavía no se importó el ráster (ver el comando
+    import_vegetation_raster); en ese caso las unidades de vegetación se piden a GEE.
+    """
+    global _index
+    if _index is None:
+        directory = settings.VEGETATION_INDEX_DIR
+        if not os.path.exists(os.path.join(directory, METADATA_FILE)):
+            return None
+        with _index_lock:
+            if _index is None:
+                _index = VegetationIndex(directory)
+    return _index
@@ -1,39 +1,344 @@
-from rest_framework import viewsets
 from rest_framework.views import APIView
-from .serializer import TaskSerializer, PolygonSerializer
-from .models import Task
+from .serializer import FeatureCollectionSerializer, JobSerializer, PastureAvailabilitySerializer, PolygonSerializer
+from .models import Job
 from rest_framework.response import Response
 from rest_framework import status
-import geojson
-from .evaluate import get_ndvi_and_regions
-from .ndvi_script import calculate_centroid, get_nasa_power_data
+from rest_framework.exceptions import NotAcceptable
+from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
 import json
+import math
+from . import response_cache, singleflight, streaming
+from .ee_session import EarthEngineBusyError
+from .jobs import submit_job
+from .power_client import PowerRequestError, PowerServiceError
+from .renderers import NDVI_RENDERERS, negotiate, variant_etag
+
+
+# Errores de los servicios externos que se responden sin 500 (ver upstream_error): NASA POWER
+# no responde o rechazó la consulta, o Earth Engine no da turno a tiempo
+UPSTREAM_ERRORS = (PowerServiceError, EarthEngineBusyError, PowerRequestError)
+
+
+def upstream_error(error, response_class=Response):
+    """
+    503 cuando NASA POWER o Earth Engine no están disponibles, con Retry-After si se conoce, o
+    502 con el mensaje de POWER si rechazó la consulta.
+    """
+    if isinstance(error, PowerRequestError):
+        return response_class({"detail": str(error)}, status=status.HTTP_502_BAD_GATEWAY)
+    headers = {'Retry-After': str(math.ceil(error.retry_after))} if error.retry_after else {}
+    return response_class({"detail": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers=headers)
+
+
+class VaryOnAcceptMixin:
+    """
+    Para las vistas de DRF: el formato de la respuesta depende de Accept (o de ?format=), así
+    que los caches compartidos y el navegador tienen que guardar una versión por cada Accept.
+    """
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+def compute_once(key, end_date, compute):
+    """
+    (resultado, ETag) de `compute()`, guardado en la caché de respuestas con `key`. Los pedidos
+    iguales que llegan mientras se calcula esperan ese cálculo (ver singleflight.do).
+    """
+    def run():
+        result = compute()
+        return result, response_cache.set_response(key, result, end_date)
+    return singleflight.do(key, lambda: response_cache.get_response(key), run)
+
+
+async def compute_once_async(key, end_date, compute):
+    """Igual que compute_once para una corrutina `compute`."""
+    async def run():
+        result = await compute()
+        etag = await sync_to_async(response_cache.set_response, thread_sensitive=False)(key, result, end_date)
+        return result, etag
+    return await singleflight.do_async(key, lambda: response_cache.get_response(key), run)
+
+
+def batch_results(polygons, start_date, end_date, statistics):
+    """
+    { id: resultado de /api/ndvi/ } de varios potreros. Cada potrero comparte la caché de
+    respuestas con /api/ndvi/; sólo se calculan los que faltan, una sola vez aunque el mismo
+    lote llegue repetido. Lanza uno de UPSTREAM_ERRORS si NASA POWER o Earth Engine no
+    están disponibles o rechazan la consulta.
+    """
+    keys = {
+        feature_id: response_cache.cache_key(rings, start_date, end_date, estadisticas=statistics)
+        for feature_id, rings in polygons.items()
+    }
+    results = {}
+    pending = {}
+    for feature_id, rings in polygons.items():
+        cached = response_cache.get_response(keys[feature_id])
+        if cached is None:
+            pending[feature_id] = rings
+        else:
+            results[feature_id] = cached[0]
+
+    if pending:
+        from .pipeline import run_batch_pipeline
+
+        def lookup():
+            found = {feature_id: response_cache.get_response(keys[feature_id]) for feature_id in pending}
+            if any(cached is None for cached in found.values()):
+                return None
+            return {feature_id: cached[0] for feature_id, cached in found.items()}
+
+        def compute():
+            computed = run_batch_pipeline(pending, start_date, end_date, statistics)
+            for feature_id, result in computed.items():
+                response_cache.set_response(keys[feature_id], result, end_date)
+            return computed
+
+        batch_key = "lote:" + ",".join(sorted(keys[feature_id] for feature_id in pending))
+        results.update(singleflight.do(batch_key, lookup, compute))
+    return {feature_id: results[feature_id] for feature_id in polygons}
+
+
+class NDVIAPIView(VaryOnAcceptMixin, APIView):
+    # Además del JSON de siempre, el formato columnar y, si están instalados, MessagePack y Arrow
+    renderer_classes = NDVI_RENDERERS
 
-class NDVIAPIView(APIView):
     def post(self, request):
         # Asegúrate de que los datos se pasan correctamente
         serializer = PolygonSerializer(data=request.data)
         if serializer.is_valid():
             coordinates = serializer.validated_data['coordinates']
-            polygon = geojson.Polygon([coordinates])
-            start_date = request.data.get('start_date', '2024-01-01')
-            end_date = request.data.get('end_date', '2024-09-30')
-            
-            # Llamar a la función get_ndvi para obtener los datos de NDVI
-            ndvi_data = get_ndvi_and_regions(polygon, start_date, end_date)
-            # print(ndvi_data)
-
-            # Calcular el centroide del polígono
-            centroid = calculate_centroid(polygon)
-
-            # Obtener datos de NASA POWER (temperatura y radiación)
-            nasa_power_data = get_nasa_power_data(centroid, start_date, end_date)
-
-            # Combinar los resultados de NDVI y NASA POWER
-            combined_results = {
-                "ndvi_data": ndvi_data,
-                "nasa_power_data": nasa_power_data
-            }
-
-            return Response(combined_results, status=status.HTTP_200_OK)
+            start_date = serializer.validated_data['start_date']
+            end_date = serializer.validated_data['end_date']
+            statistics = serializer.validated_data['estadisticas']
+
+            # Si la misma consulta ya se resolvió, se responde desde la caché
+            cache_key = response_cache.cache_key(coordinates, start_date, end_date, estadisticas=statistics)
+            cached = response_cache.get_response(cache_key)
+            if cached is None:
+                try:
+                    combined_results, etag = compute_once(
+                        cache_key, end_date, lambda: self.compute(coordinates, start_date, end_date, statistics)
+                    )
+                except UPSTREAM_ERRORS as e:
+                    return upstream_error(e)
+            else:
+                combined_results, etag = cached
+
+            # Si el cliente ya tiene esta versión no se vuelve a enviar
+            etag = variant_etag(etag, request.accepted_renderer)
+            if response_cache.etag_matches(etag, request.headers.get('If-None-Match', '')):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            return Response(combined_results, status=status.HTTP_200_OK, headers={'ETag': etag})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def compute(self, coordinates, start_date, end_date, statistics):
+        """Ejecuta el pipeline completo (NDVI, unidad de vegetación y NASA POWER) para un polígono."""
+        # El pipeline importa ee y numpy; se carga recién aquí (o en el arranque del
+        # worker, ver ee_session.warm_up) para no demorar la carga de las urls
+        from .pipeline import run_ndvi_pipeline
+        return run_ndvi_pipeline(coordinates, start_date, end_date, statistics)
+
+
+class NDVIBatchAPIView(VaryOnAcceptMixin, APIView):
+    """
+    Igual que NDVIAPIView para todos los potreros de un establecimiento, recibidos como una
+    FeatureCollection. Responde { id del potrero: resultado de /api/ndvi/ }.
+    """
+    renderer_classes = NDVI_RENDERERS
+
+    def post(self, request):
+        serializer = FeatureCollectionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        polygons = serializer.validated_data['features']
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+        statistics = serializer.validated_data['estadisticas']
+        try:
+            results = batch_results(polygons, start_date, end_date, statistics)
+        except UPSTREAM_ERRORS as e:
+            return upstream_error(e)
+        return Response(results, status=status.HTTP_200_OK)
+
+
+class PastureAvailabilityAPIView(VaryOnAcceptMixin, APIView):
+    """
+    Producción de forraje de los potreros de un establecimiento (ver forage.forage_availability),
+    a partir de los mismos datos que /api/ndvi/lote/. Responde { id del potrero: disponibilidad }.
+    """
+
+    def post(self, request):
+        serializer = PastureAvailabilitySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        polygons = serializer.validated_data['features']
+        parameters = serializer.validated_data['parametros']
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+        # forage usa la media histórica de la radiación para los días sin dato medido (es
+        # forage.PAR_FALLBACK_STATISTIC, que se repite para no cargar numpy antes de tiempo)
+        try:
+            results = batch_results(polygons, start_date, end_date, ["media"])
+        except UPSTREAM_ERRORS as e:
+            return upstream_error(e)
+
+        from .forage import forage_availability
+        paddocks = {
+            feature_id: (rings, results[feature_id], dict(parameters[feature_id]))
+            for feature_id, rings in polygons.items()
+        }
+        return Response(forage_availability(paddocks, start_date, end_date), status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class NDVIAsyncView(View):
+    """
+    Versión asíncrona de NDVIAPIView para servir con ASGI (ver api_ee/asgi.py): Earth Engine y
+    NASA POWER se consultan al mismo tiempo y el worker puede atender otros pedidos mientras tanto.
+    """
+    async def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({"detail": "JSON inválido."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = PolygonSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            renderer, media_type = negotiate(request)
+        except NotAcceptable as e:
+            return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_406_NOT_ACCEPTABLE)
+
+        coordinates = serializer.validated_data['coordinates']
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+        statistics = serializer.validated_data['estadisticas']
+
+        cache_key = response_cache.cache_key(coordinates, start_date, end_date, estadisticas=statistics)
+        cached = await sync_to_async(response_cache.get_response, thread_sensitive=False)(cache_key)
+        if cached is None:
+            from .pipeline import run_ndvi_pipeline_async
+            try:
+                combined_results, etag = await compute_once_async(
+                    cache_key, end_date,
+                    lambda: run_ndvi_pipeline_async(coordinates, start_date, end_date, statistics),
+                )
+            except UPSTREAM_ERRORS as e:
+                return upstream_error(e, JsonResponse)
+        else:
+            combined_results, etag = cached
+
+        etag = variant_etag(etag, renderer)
+        if response_cache.etag_matches(etag, request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+        else:
+            content_type = media_type if renderer.charset is None else f"{media_type}; charset={renderer.charset}"
+            response = HttpResponse(renderer.render(combined_results), content_type=content_type, headers={'ETag': etag})
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class NDVIStreamView(View):
+    """
+    Igual que NDVIAPIView, pero envía cada parte apenas está lista (ver
+    pipeline.stream_ndvi_pipeline): NDJSON por defecto o Server-Sent Events si el cliente
+    los pide con Accept: text/event-stream.
+    """
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({"detail": "JSON inválido."}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = PolygonSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        coordinates = serializer.validated_data['coordinates']
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+        statistics = serializer.validated_data['estadisticas']
+
+        cached = response_cache.get_response(
+            response_cache.cache_key(coordinates, start_date, end_date, estadisticas=statistics)
+        )
+        if cached is not None:
+            events = streaming.cached_events(cached[0], start_date, end_date)
+        else:
+            from .pipeline import stream_ndvi_pipeline
+            events = stream_ndvi_pipeline(coordinates, start_date, end_date, statistics)
+
+        if streaming.wants_sse(request):
+            encode, content_type = streaming.encode_sse, streaming.SSE_CONTENT_TYPE
+        else:
+            encode, content_type = streaming.encode_ndjson, streaming.NDJSON_CONTENT_TYPE
+        response = StreamingHttpResponse(
+            (encode(event, payload) for event, payload in events), content_type=content_type
+        )
+        # Que ni el navegador ni un proxy (nginx) retengan los eventos
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        # NDJSON o SSE según Accept
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class NDVITileView(View):
+    """
+    Teselas PNG ({z}/{x}/{y}, esquema XYZ) del compuesto de NDVI entre start_date y end_date,
+    para usar como capa de Leaflet. Se sirven desde la caché de teselas; Earth Engine sólo se
+    consulta la primera vez que alguien pide cada una (ver tiles.get_tile).
+    """
+    def get(self, request, start_date, end_date, z, x, y):
+        from . import tiles
+
+        try:
+            tiles.validate_window(start_date, end_date)
+        except tiles.TileRequestError as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not tiles.in_range(z, x, y):
+            return JsonResponse({"detail": "Tesela fuera de rango o del área del servicio."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            tile = tiles.get_tile(start_date, end_date, z, x, y)
+        except EarthEngineBusyError as e:
+            return upstream_error(e, JsonResponse)
+        except tiles.TileError as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        max_age = response_cache.timeout_for(end_date)
+        return HttpResponse(tile, content_type='image/png', headers={'Cache-Control': f'public, max-age={max_age}'})
+
+
+class NDVIJobAPIView(VaryOnAcceptMixin, APIView):
+    """Encola una consulta de NDVI para resolverla en segundo plano (ver run_ndvi_jobs)."""
+    def post(self, request):
+        serializer = PolygonSerializer(data=request.data)
+        if serializer.is_valid():
+            job, created = submit_job(
+                serializer.validated_data['coordinates'],
+                serializer.validated_data['start_date'],
+                serializer.validated_data['end_date'],
+                serializer.validated_data['estadisticas'],
+            )
+            # Las urls de la api se publican con dos prefijos (api/ y gee/); se respeta el usado
+            location = f"{request.path}{job.pk}/"
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class NDVIJobDetailAPIView(VaryOnAcceptMixin, APIView):
+    """Estado, avance y, cuando termina, resultado de un trabajo."""
+    def get(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id)
+        return Response(JobSerializer(job).data)
@@ -3,6 +3,11 @@ ASGI config for api_ee project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The async endpoint /api/ndvi/async/ only runs concurrently when served through
+this module, for example:
+
+    gunicorn api_ee.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
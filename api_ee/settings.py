@@ -49,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.ServerTimingMiddleware',
+    # Brotli o gzip según Accept-Encoding (ver api/compression.py)
+    'api.compression.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -88,6 +91,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Varios hilos (y run_ndvi_jobs) escriben a la vez: las transacciones toman el bloqueo
+        # de escritura al empezar y esperan su turno en lugar de fallar con "database is locked"
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 
@@ -142,3 +148,68 @@ CORS_ALLOWED_ORIGINS = ["https://web-mf-inta.vercel.app","http://localhost:3000"
 
 # Configuración de Google Earth Engine
 GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+
+# Caché en disco de NASA POWER, compartida por todos los workers
+CACHE_DIR = Path(os.environ.get('CACHE_DIR', BASE_DIR / 'cache'))
+POWER_CACHE_PATH = CACHE_DIR / 'nasa_power.sqlite3'
+# Endpoint diario de NASA POWER (se puede apuntar a un servidor local de prueba)
+POWER_BASE_URL = os.environ.get('POWER_BASE_URL', 'https://power.larc.nasa.gov/api/temporal/daily/point')
+# Límite de consultas a NASA POWER compartido por todos los procesos (ver api/power_client.py)
+POWER_LIMITER_PATH = CACHE_DIR / 'nasa_power_limiter.sqlite3'
+POWER_RATE_LIMIT = float(os.environ.get('POWER_RATE_LIMIT', 2))  # consultas por segundo
+POWER_RATE_BURST = int(os.environ.get('POWER_RATE_BURST', 5))
+# Evaluaciones de Earth Engine simultáneas entre todos los procesos; las demás esperan turno
+# en orden de llegada hasta EE_QUEUE_TIMEOUT segundos (ver api/ee_session.py)
+EE_GOVERNOR_PATH = CACHE_DIR / 'ee_turnos.sqlite3'
+EE_MAX_CONCURRENT = int(os.environ.get('EE_MAX_CONCURRENT', 4))
+EE_QUEUE_TIMEOUT = float(os.environ.get('EE_QUEUE_TIMEOUT', 120))
+# Candados para que los pedidos iguales simultáneos se calculen una sola vez (ver api/singleflight.py)
+SINGLEFLIGHT_DIR = CACHE_DIR / 'en_curso'
+# Métricas de cada proceso, que /metrics suma (ver api/metrics.py)
+METRICS_DIR = CACHE_DIR / 'metrics'
+# /metrics está apagado salvo que se active; con METRICS_TOKEN pide "Authorization: Bearer <token>"
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Ráster de unidades de vegetación importado con `manage.py import_vegetation_raster`
+VEGETATION_INDEX_DIR = Path(os.environ.get('VEGETATION_INDEX_DIR', BASE_DIR / 'data' / 'raster_uv'))
+# Climatología de radiación precalculada con `manage.py build_par_climatology`
+PAR_CLIMATOLOGY_DIR = Path(os.environ.get('PAR_CLIMATOLOGY_DIR', BASE_DIR / 'data' / 'clima_par'))
+
+# Caché de respuestas de /api/ndvi/ (ver api/response_cache.py). Para compartirla entre
+# varias máquinas se puede cambiar por DatabaseCache u otro backend compartido.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ndvi': {
+        'BACKEND': 'api.cache_backends.LRUFileBasedCache',
+        'LOCATION': CACHE_DIR / 'ndvi',
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Teselas PNG de /api/ndvi/teselas/: LRU por espacio en disco (MAX_SIZE) y por cantidad
+    'teselas': {
+        'BACKEND': 'api.cache_backends.LRUFileBasedCache',
+        'LOCATION': CACHE_DIR / 'teselas',
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('TILE_CACHE_MAX_ENTRIES', 100_000)),
+            'MAX_SIZE': int(os.environ.get('TILE_CACHE_MAX_BYTES', 1024 ** 3)),
+        },
+    },
+}
+
+# Los avisos del pipeline (errores de GEE o de POWER, reintentos) salen por consola
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.environ.get('API_LOG_LEVEL', 'INFO')},
+    },
+}
@@ -0,0 +1,16 @@
+"""
+Configuración de las pruebas: la de api_ee.settings con la base de prueba en un archivo.
+`manage.py test` la usa por defecto.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+# En memoria SQLite bloquea por tabla sin respetar el timeout, y fallan las pruebas que corren
+# las etapas en hilos o en procesos. El nombre lleva el pid para que dos corridas en la misma
+# máquina no se pisen, y queda en el entorno para que los procesos hijos (spawn) usen la misma.
+os.environ.setdefault('API_EE_TEST_DB', str(Path(tempfile.gettempdir()) / f'api_ee_test_{os.getpid()}.sqlite3'))
+DATABASES['default']['TEST'] = {'NAME': os.environ['API_EE_TEST_DB']}
@@ -6,7 +6,7 @@ import "./assets/leaflet.css"
 import "./assets/leaflet.draw.css"
 import ReactLeafletGoogleLayer from 'react-leaflet-google-layer'
 import { Line } from 'react-chartjs-2'
-import { format } from 'date-fns';
+import { format, parseISO } from 'date-fns';
 import L from 'leaflet'
 import { es } from 'date-fns/locale'; // Importa el locale español
 import { Chart, CategoryScale, LinearScale, LineElement, PointElement } from 'chart.js';
@@ -51,7 +51,9 @@ const DrawMap = () => {
       sendCoordinates(newPositions);
     };
     const chartData = { 
-      labels: data?.map(entry => format(entry.fecha, 'dd-MM-yyyy', { locale: es })),
+      // fecha es un día YYYY-MM-DD: parseISO lo toma en hora local (new Date() lo tomaría en UTC
+      // y en Argentina mostraría el día anterior)
+      labels: data?.map(entry => format(parseISO(entry.fecha), 'dd-MM-yyyy', { locale: es })),
       datasets: [
           {
               label: 'NDVI',
@@ -0,0 +1,46 @@
+# Configuración de gunicorn. Se carga automáticamente desde el directorio de trabajo.
+import os
+import signal
+import subprocess
+import sys
+
+# Hilos del worker de trabajos en segundo plano (run_ndvi_jobs) que se inicia junto con el
+# servidor; con 0 no se inicia (por ejemplo, si corre en otro servicio)
+JOBS_WORKERS = int(os.environ.get('NDVI_JOBS_WORKERS', 2))
+
+_jobs_process = None
+
+
+def on_starting(server):
+    # Las métricas de los workers de una corrida anterior no se suman a las nuevas
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_ee.settings')
+    from api.metrics import reset
+    reset()
+
+
+def when_ready(server):
+    # Los trabajos de /api/ndvi/trabajos/ los procesa run_ndvi_jobs, no los workers HTTP. Es un
+    # hijo del master, así que si termina gunicorn lo informa como "Worker (pid:...) exited"
+    global _jobs_process
+    if JOBS_WORKERS > 0:
+        manage = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manage.py')
+        _jobs_process = subprocess.Popen([sys.executable, manage, 'run_ndvi_jobs', '--workers', str(JOBS_WORKERS)])
+        server.log.info("run_ndvi_jobs iniciado (pid %s, %s hilos)", _jobs_process.pid, JOBS_WORKERS)
+
+
+def post_fork(server, worker):
+    # Cada worker prepara su sesión de Earth Engine apenas se crea, en lugar de en el primer pedido
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_ee.settings')
+    from api.ee_session import warm_up_in_background
+    warm_up_in_background()
+
+
+def on_exit(server):
+    # run_ndvi_jobs termina los trabajos en curso al recibir SIGINT; los que no alcancen a
+    # terminar vuelven a la cola cuando vence su latido
+    if _jobs_process is not None and _jobs_process.poll() is None:
+        _jobs_process.send_signal(signal.SIGINT)
+        try:
+            _jobs_process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            _jobs_process.kill()
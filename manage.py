@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_ee.settings')
+    # Las pruebas usan su propia configuración (ver api_ee/test_settings.py)
+    default_settings = 'api_ee.test_settings' if sys.argv[1:2] == ['test'] else 'api_ee.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: